@@ -0,0 +1,112 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import sys
+import argparse
+import logging
+from checks import batch
+from checks import cache
+from checks import journal
+from checks import executors
+from checks import resources
+from main import add_comparison_args, get_comparison_kwargs, setup_reference
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Checks a batch of BAM-CRAM pairs on a pool of local processes, "
+                                                 "or as a job array on an LSF or Slurm cluster.")
+    inputs = parser.add_mutually_exclusive_group(required=True)
+    inputs.add_argument('--bam-dir', dest='bam_dir', help="Directory of BAM files, each paired with "
+                                                          "<name>.bam.cram or <name>.cram from --cram-dir")
+    inputs.add_argument('--manifest', help="File with the BAM and CRAM paths of one pair per line, tab separated "
+                                               "or as a JSON object (see main.py --manifest)")
+    parser.add_argument('--cram-dir', dest='cram_dir', help="Directory of CRAM files, required with --bam-dir")
+    parser.add_argument('--output-dir', dest='output_dir', required=True,
+                        help="Directory for the result of each pair and the summary.json of the batch")
+    parser.add_argument('--log-dir', dest='log_dir', help="Directory for the log of each pair")
+    parser.add_argument('--log', help="File path to the log of the batch", required=False)
+    parser.add_argument('--journal', help="SQLite database recording the progress of the batch. When running again "
+                                          "with the same journal, the pairs already verified are skipped and the "
+                                          "others resume from the last stage completed")
+    parser.add_argument('-j', '--jobs', type=int, help="Number of pairs checked at the same time "
+                                                       "(by default the number of CPUs divided by --threads), "
+                                                       "or of array elements running at the same time on a cluster")
+    parser.add_argument('--executor', choices=sorted(executors.EXECUTORS), default='local',
+                        help="Where the pairs are checked: on this host (default), or as a single job array "
+                             "submitted with bsub (lsf) or sbatch (slurm)")
+    parser.add_argument('--pairs-per-job', type=int, dest='pairs_per_job', default=executors.DEFAULT_PAIRS_PER_ELEMENT,
+                        help="Number of pairs checked one after the other by each element of the job array "
+                             "(default: %(default)s)")
+    parser.add_argument('--memory-mb', type=int, dest='memory_mb', default=executors.DEFAULT_MEMORY_MB,
+                        help="Memory reserved for each element of the job array, in MB (default: %(default)s)")
+    parser.add_argument('--history', help="SQLite database recording the time, CPU and memory used by the samtools "
+                                          "commands of each pair against the size of the files; on a cluster, "
+                                          "the memory, threads and walltime of the pairs are predicted from it and "
+                                          "the small pairs are packed in the same job array elements")
+    parser.add_argument('--job-minutes', type=int, dest='job_minutes', default=resources.DEFAULT_ELEMENT_MINUTES,
+                        help="Predicted run time up to which pairs are packed in the same job array element "
+                             "(default: %(default)s)")
+    parser.add_argument('--stalled-retries', type=int, dest='stalled_retries',
+                        default=executors.DEFAULT_STALLED_RETRIES,
+                        help="How many times the pairs whose verification stalled or timed out (see --stall-timeout "
+                             "and --stage-timeout) are submitted again to the cluster (default: %(default)s)")
+    parser.add_argument('--queue', help="LSF queue or Slurm partition of the job array")
+    parser.add_argument('--submit-options', dest='submit_options',
+                        help="Other options for bsub or sbatch, e.g. '-G <group>'")
+    add_comparison_args(parser)
+    parser.add_argument('-v', action='count')
+    args = parser.parse_args()
+    if args.bam_dir and not args.cram_dir:
+        parser.error("--cram-dir is required with --bam-dir")
+    return args
+
+
+def main():
+    args = parse_args()
+    log_level = (logging.CRITICAL - 10 * args.v) if args.v else logging.INFO
+    log_file = args.log if args.log else 'batch_b2c.log'
+    logging.basicConfig(level=log_level, format='%(levelname)s - %(asctime)s %(message)s', filename=log_file)
+
+    pairs = batch.find_pairs(args.bam_dir, args.cram_dir) if args.bam_dir else batch.read_manifest(args.manifest)
+    setup_reference(args)
+    # The elements of a job array write the journal from other hosts, over a shared filesystem
+    journal_mode = cache.LOCAL_JOURNAL_MODE if args.executor == 'local' else cache.SHARED_JOURNAL_MODE
+    verification_journal = journal.VerificationJournal(args.journal, journal_mode=journal_mode) \
+        if args.journal else None
+    history = resources.ResourceHistory(args.history) if args.history else None
+    if args.executor == 'local':
+        executor = executors.LocalExecutor(history)
+        jobs = args.jobs or max(1, os.cpu_count() // (args.threads or 2))
+    else:
+        executor = executors.EXECUTORS[args.executor](args.pairs_per_job, args.memory_mb, args.queue,
+                                                      args.submit_options, history, args.job_minutes,
+                                                      args.stalled_retries)
+        jobs = args.jobs
+    summary = executor.run(pairs, args.output_dir, jobs, get_comparison_kwargs(args), args.log_dir,
+                           verification_journal)
+    print("%s pairs checked: %s passed (%s of them skipped as already verified), %s failed (%s of them stalled)" %
+          (summary['total'], summary['passed'], summary['skipped'], summary['failed'], summary['stalled']))
+    if summary['failed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import random
+import stat
+
+# The outputs the fake samtools gives for a file are stored next to it, named <file>.fake-<command>
+FAKE_OUTPUT_EXT = '.fake-%s'
+
+FAKE_SAMTOOLS = """#!/bin/sh
+# Stand-in for samtools, giving back the outputs stored next to the files by benchmarks/fixtures.py,
+# after sleeping for $FAKE_SAMTOOLS_LATENCY seconds (if set). The data streamed to its stdin (-) is read whole,
+# and the outputs given are those of the file $FAKE_SAMTOOLS_STDIN.
+if [ -n "$FAKE_SAMTOOLS_LATENCY" ]; then
+    sleep "$FAKE_SAMTOOLS_LATENCY"
+fi
+cmd=$1
+for fpath; do :; done
+case $cmd in
+    --version)
+        echo "samtools 1.10"
+        echo "Using htslib 1.10"
+        ;;
+    quickcheck)
+        test -e "$fpath" || { echo "$fpath is missing" >&2; exit 1; }
+        ;;
+    flagstat|stats|idxstats)
+        if [ "$fpath" = "-" ]; then
+            cat > /dev/null
+            fpath=$FAKE_SAMTOOLS_STDIN
+        fi
+        cat "$fpath.fake-$cmd"
+        ;;
+    view)
+        case " $* " in
+            *" -H "*) cat "$fpath.fake-header" ;;
+            *) cat "$fpath.fake-view" ;;
+        esac
+        ;;
+    *)
+        echo "Unsupported command: $cmd" >&2
+        exit 1
+        ;;
+esac
+"""
+
+FAKE_BSUB = """#!/bin/sh
+# Stand-in for bsub -K, running the elements of a job array (-J <name>[<first>-<last>]) one after the other
+# on this host, with LSB_JOBINDEX set, and exiting once they are all done.
+array=
+output=/dev/null
+while [ $# -gt 1 ]; do
+    case $1 in
+        -K) shift ;;
+        -J) array=$2; shift 2 ;;
+        -o) output=$2; shift 2 ;;
+        *) shift 2 ;;
+    esac
+done
+range=${array#*\\[}
+range=${range%%]*}
+status=0
+for index in $(seq "${range%-*}" "${range#*-}"); do
+    LSB_JOBINDEX=$index sh -c "$1" > "$(echo "$output" | sed "s/%I/$index/g")" 2>&1 || status=1
+done
+exit $status
+"""
+
+FAKE_SBATCH = """#!/bin/sh
+# Stand-in for sbatch --wait, running the elements of a job array (--array=<first>-<last>) one after the other
+# on this host, with SLURM_ARRAY_TASK_ID set, and exiting once they are all done.
+array=
+output=/dev/null
+command=
+for arg; do
+    case $arg in
+        --array=*) array=${arg#--array=} ;;
+        --output=*) output=${arg#--output=} ;;
+        --wrap=*) command=${arg#--wrap=} ;;
+    esac
+done
+array=${array%%%*}
+echo "Submitted batch job $$"
+status=0
+for index in $(seq "${array%-*}" "${array#*-}"); do
+    SLURM_ARRAY_TASK_ID=$index sh -c "$command" > "$(echo "$output" | sed "s/%a/$index/g")" 2>&1 || status=1
+done
+exit $status
+"""
+
+HEADER = "@HD\tVN:1.4\tSO:coordinate\n@SQ\tSN:1\tLN:249250621\n@SQ\tSN:2\tLN:243199373\n" \
+         "@RG\tID:1#1\tSM:sample1\tLB:lib1\n"
+
+
+def _write_executable(bin_dir, name, script):
+    os.makedirs(bin_dir, exist_ok=True)
+    fpath = os.path.join(bin_dir, name)
+    with open(fpath, 'w') as f:
+        f.write(script)
+    os.chmod(fpath, os.stat(fpath).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return fpath
+
+
+def write_fake_samtools(bin_dir):
+    """Writes the stand-in samtools executable to bin_dir, to be put first in the PATH."""
+    return _write_executable(bin_dir, 'samtools', FAKE_SAMTOOLS)
+
+
+def write_fake_schedulers(bin_dir):
+    """Writes the stand-in bsub and sbatch executables to bin_dir, running the job arrays on this host."""
+    return [_write_executable(bin_dir, 'bsub', FAKE_BSUB), _write_executable(bin_dir, 'sbatch', FAKE_SBATCH)]
+
+
+def synthetic_counts(seed):
+    """:return: dict of the counters of a synthetic file, the same for the same seed"""
+    rand = random.Random(seed)
+    total = rand.randint(10 ** 6, 10 ** 9)
+    unmapped = rand.randint(0, total // 10)
+    duplicated = rand.randint(0, total // 5)
+    return {'total': total, 'mapped': total - unmapped, 'unmapped': unmapped, 'duplicated': duplicated,
+            'chk': [rand.getrandbits(32) for _ in range(3)]}
+
+
+def synthetic_flagstat(counts):
+    """:return: samtools flagstat output for the counters given"""
+    lines = ["%s + 0 in total (QC-passed reads + QC-failed reads)" % counts['total'],
+             "0 + 0 secondary",
+             "0 + 0 supplementary",
+             "%s + 0 duplicates" % counts['duplicated'],
+             "%s + 0 mapped (%.2f%% : N/A)" % (counts['mapped'], 100.0 * counts['mapped'] / counts['total']),
+             "%s + 0 paired in sequencing" % counts['total'],
+             "%s + 0 read1" % (counts['total'] // 2),
+             "%s + 0 read2" % (counts['total'] - counts['total'] // 2),
+             "%s + 0 properly paired (N/A : N/A)" % counts['mapped'],
+             "%s + 0 with itself and mate mapped" % counts['mapped'],
+             "0 + 0 singletons (N/A : N/A)",
+             "0 + 0 with mate mapped to a different chr",
+             "0 + 0 with mate mapped to a different chr (mapQ>=5)"]
+    return '\n'.join(lines) + '\n'
+
+
+def synthetic_stats(counts, extra_lines=1000):
+    """
+    :param extra_lines: the number of histogram lines after the SN section, setting the size of the output
+                        (a real samtools stats output has a few thousands)
+    :return: samtools stats output for the counters given
+    """
+    sn_fields = [('raw total sequences', counts['total']), ('filtered sequences', 0),
+                 ('sequences', counts['total']), ('is sorted', 1),
+                 ('1st fragments', counts['total'] // 2), ('last fragments', counts['total'] - counts['total'] // 2),
+                 ('reads mapped', counts['mapped']), ('reads mapped and paired', counts['mapped']),
+                 ('reads unmapped', counts['unmapped']), ('reads properly paired', counts['mapped']),
+                 ('reads paired', counts['total']), ('reads duplicated', counts['duplicated']),
+                 ('reads MQ0', 0), ('reads QC failed', 0), ('non-primary alignments', 0),
+                 ('supplementary alignments', 0), ('total length', counts['total'] * 150),
+                 ('bases mapped', counts['mapped'] * 150), ('average length', 150), ('maximum length', 150),
+                 ('pairs on different chromosomes', 0)]
+    lines = ["# This file was produced by samtools stats (fake) and can be plotted using plot-bamstats",
+             "# CHK, Checksum\t[2]Read Names\t[3]Sequences\t[4]Qualities",
+             "CHK\t%08x\t%08x\t%08x" % tuple(counts['chk'])]
+    lines.extend("SN\t%s:\t%s" % field for field in sn_fields)
+    lines.extend("COV\t[%s-%s]\t%s\t%s" % (i, i, i, i * 7 % 1000) for i in range(1, extra_lines + 1))
+    return '\n'.join(lines) + '\n'
+
+
+def synthetic_idxstats(counts):
+    mapped_1 = counts['mapped'] // 2
+    return "1\t249250621\t%s\t0\n2\t243199373\t%s\t0\n*\t0\t0\t%s\n" % (mapped_1, counts['mapped'] - mapped_1,
+                                                                      counts['unmapped'])
+
+
+def synthetic_sam(seed, reads_nr, read_length=150):
+    """:return: samtools view output (SAM without the header) of reads_nr random reads of 2 read groups"""
+    rand = random.Random(seed)
+    # The sequences and qualities are overlapping slices of random strings, generating them read by read being slow:
+    bases = ''.join(rand.choices('ACGT', k=reads_nr + read_length))
+    quals = ''.join(rand.choices([chr(33 + phred) for phred in range(2, 41)], k=reads_nr + read_length))
+    lines = []
+    for i in range(reads_nr):
+        contig = rand.choice(['1', '2', '*'])
+        pos = rand.randint(1, 10 ** 8) if contig != '*' else 0
+        seq, qual = bases[i:i + read_length], quals[i:i + read_length]
+        lines.append("read%s\t%s\t%s\t%s\t%s\t%s\t*\t0\t0\t%s\t%s\tRG:Z:1#%s\tNM:i:0" %
+                     (i, 4 if contig == '*' else 0, contig, pos, 0 if contig == '*' else 60,
+                      '*' if contig == '*' else '%sM' % read_length, seq, qual, i % 2 + 1))
+    return '\n'.join(lines) + '\n'
+
+
+def write_fake_file(fpath, counts, extra_lines=1000):
+    """Writes a (fake) BAM or CRAM file and the outputs the fake samtools gives for it."""
+    with open(fpath, 'w') as f:
+        f.write("fake alignment file\n")
+    outputs = {'flagstat': synthetic_flagstat(counts), 'stats': synthetic_stats(counts, extra_lines),
+               'idxstats': synthetic_idxstats(counts), 'header': HEADER}
+    for command, output in outputs.items():
+        with open(fpath + FAKE_OUTPUT_EXT % command, 'w') as f:
+            f.write(output)
+
+
+def make_pairs(dirpath, pairs_nr, extra_lines=1000, different_every=0):
+    """
+    Writes pairs_nr pairs of fake BAM and CRAM files to dirpath.
+    :param different_every: if given, every different_every-th CRAM has a different checksum than its BAM
+    :return: list of (bam_path, cram_path) tuples
+    """
+    os.makedirs(dirpath, exist_ok=True)
+    pairs = []
+    for i in range(pairs_nr):
+        counts = synthetic_counts(i)
+        bam_path = os.path.join(dirpath, 'pair%s.bam' % i)
+        cram_path = os.path.join(dirpath, 'pair%s.cram' % i)
+        write_fake_file(bam_path, counts, extra_lines)
+        if different_every and i % different_every == 0:
+            counts = dict(counts, chk=[counts['chk'][0], counts['chk'][1] ^ 1, counts['chk'][2]])
+        write_fake_file(cram_path, counts, extra_lines)
+        pairs.append((bam_path, cram_path))
+    return pairs
@@ -0,0 +1,254 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import contextlib
+
+from benchmarks import fixtures
+from checks import batch
+from checks import capabilities
+from checks import cache
+from checks import checksums
+from checks import streaming
+from checks.stats_checks import CompareStatsForFiles, HandleSamtoolsStats, RunSamtoolsCommands
+
+DEFAULT_SCALES = [1, 100, 10000]
+
+
+def _remove_stats_files(pairs):
+    """Removes the stats files saved next to the data files, so that the next run generates the stats again."""
+    for pair in pairs:
+        for fpath in pair:
+            for stats_fpath in glob.glob(fpath + '.stats*'):
+                os.remove(stats_fpath)
+
+
+def bench_checksum_extraction(pairs, work_dir, options):
+    """Reads the stats outputs and compares their checksums, without running any process."""
+    for bam_path, cram_path in pairs:
+        stats_b = HandleSamtoolsStats._get_stats(bam_path + fixtures.FAKE_OUTPUT_EXT % 'stats')
+        stats_c = HandleSamtoolsStats._get_stats(cram_path + fixtures.FAKE_OUTPUT_EXT % 'stats')
+        CompareStatsForFiles.compare_stats_by_sequence_checksum(stats_b, stats_c)
+
+
+def bench_compare(pairs, work_dir, options):
+    """Compares the pairs one after the other, end to end, with the (fake) samtools."""
+    for bam_path, cram_path in pairs:
+        CompareStatsForFiles.compare_bam_and_cram_by_statistics(bam_path, cram_path, threads=options.threads)
+
+
+def bench_compare_cache_miss(pairs, work_dir, options):
+    stats_cache = cache.DirectoryCache(os.path.join(work_dir, 'cache'))
+    for bam_path, cram_path in pairs:
+        CompareStatsForFiles.compare_bam_and_cram_by_statistics(bam_path, cram_path, threads=options.threads,
+                                                                cache=stats_cache)
+
+
+def bench_compare_cache_hit(pairs, work_dir, options):
+    # Same as the cache miss benchmark, on the cache it has filled:
+    bench_compare_cache_miss(pairs, work_dir, options)
+
+
+def bench_batch(pairs, work_dir, options):
+    batch.run_batch(pairs, os.path.join(work_dir, 'batch-output'), options.jobs, {'threads': options.threads})
+
+
+def bench_checksum_engine(pairs, work_dir, options):
+    """Computes the checksums of the reads of each file in process, out of the (fake) samtools view output."""
+    sam_fpath = os.path.join(work_dir, 'reads.sam')
+    with open(sam_fpath, 'w') as f:
+        f.write(fixtures.synthetic_sam(0, options.sam_reads))
+    for pair in pairs:
+        for fpath in pair:
+            view_fpath = fpath + fixtures.FAKE_OUTPUT_EXT % 'view'
+            if os.path.lexists(view_fpath):
+                os.remove(view_fpath)
+            os.symlink(sam_fpath, view_fpath)
+            checksums.compute_checksums(fpath)
+
+
+BENCHMARKS = [('checksum_extraction', bench_checksum_extraction),
+              ('checksum_engine', bench_checksum_engine),
+              ('compare', bench_compare),
+              ('compare_cache_miss', bench_compare_cache_miss),
+              ('compare_cache_hit', bench_compare_cache_hit),
+              ('batch', bench_batch)]
+
+
+def run_benchmarks(work_dir, scales=None, names=None, options=None):
+    """
+    Runs the benchmarks on fake files and a fake samtools, created in work_dir.
+    :param scales: the numbers of pairs each benchmark is run on
+    :param names: the names of the benchmarks to run, by default all of them
+    :param options: the parsed command line arguments (latency, stats_lines, threads, jobs)
+    :return: dict with the metadata of the run and, for each benchmark and each scale,
+             the total time and the time per pair
+    """
+    options = options or parse_args([])
+    scales = scales or DEFAULT_SCALES
+    bin_dir = os.path.join(work_dir, 'bin')
+    fixtures.write_fake_samtools(bin_dir)
+    results = {}
+    environ = dict(os.environ, PATH=bin_dir + os.pathsep + os.environ.get('PATH', ''))
+    environ[capabilities.CAPABILITIES_CACHE_ENV_VAR] = os.path.join(work_dir, 'samtools-capabilities')
+    if options.latency:
+        environ['FAKE_SAMTOOLS_LATENCY'] = str(options.latency)
+    with mock_environ(environ), open(os.devnull, 'w') as devnull:
+        for scale in scales:
+            data_dir = os.path.join(work_dir, 'data-%s' % scale)
+            pairs = fixtures.make_pairs(data_dir, scale, options.stats_lines)
+            for name, benchmark in BENCHMARKS:
+                if names and name not in names:
+                    continue
+                _remove_stats_files(pairs)
+                bench_dir = os.path.join(work_dir, 'work-%s' % scale)
+                if name != 'compare_cache_hit':
+                    shutil.rmtree(bench_dir, ignore_errors=True)
+                os.makedirs(bench_dir, exist_ok=True)
+                logging.info("Running benchmark %s on %s pairs" % (name, scale))
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(devnull):
+                    benchmark(pairs, bench_dir, options)
+                seconds = time.perf_counter() - start
+                results.setdefault(name, {})[str(scale)] = {'seconds': seconds, 'per_pair_ms': 1000 * seconds / scale}
+            shutil.rmtree(data_dir, ignore_errors=True)
+    return {'metadata': {'python': platform.python_version(), 'platform': platform.platform(),
+                         'cpu_count': os.cpu_count(), 'latency': options.latency,
+                         'stats_lines': options.stats_lines, 'sam_reads': options.sam_reads,
+                         'threads': options.threads, 'jobs': options.jobs,
+                         'date': time.strftime('%Y-%m-%d %H:%M:%S')},
+            'results': results}
+
+
+def compare_engine_to_samtools(fpath, threads=None):
+    """
+    Times samtools stats and the in-process checksum engine (checksums.compute_checksums) on a real file.
+    :return: dict with the seconds each took, their throughput in MB of the file per second,
+             and whether their checksums are the same
+    """
+    size_mb = os.path.getsize(fpath) / (1024 * 1024)
+    checksum = streaming.ChecksumExtractor()
+    start = time.perf_counter()
+    RunSamtoolsCommands.stream_samtools_stats_output(fpath, [checksum], threads)
+    stats_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    engine_checksums = checksums.compute_checksums(fpath, threads)
+    engine_seconds = time.perf_counter() - start
+    return {'file': fpath, 'size_mb': size_mb,
+            'samtools_stats_seconds': stats_seconds, 'samtools_stats_mb_per_s': size_mb / max(stats_seconds, 1e-9),
+            'engine_seconds': engine_seconds, 'engine_mb_per_s': size_mb / max(engine_seconds, 1e-9),
+            'same_checksum': checksum.checksum == engine_checksums.checksum_line()}
+
+
+@contextlib.contextmanager
+def mock_environ(environ):
+    """Replaces the environment of the process (inherited by the fake samtools processes) while running."""
+    previous = dict(os.environ)
+    os.environ.clear()
+    os.environ.update(environ)
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(previous)
+
+
+def compare_to_baseline(results, baseline, tolerance=0.2):
+    """
+    :param tolerance: how much slower (as a fraction) a benchmark may be than in the baseline
+    :return: list of (benchmark, scale, baseline seconds, seconds) for the benchmarks slower than that
+    """
+    regressions = []
+    for name, scales in sorted(results['results'].items()):
+        for scale, result in sorted(scales.items(), key=lambda item: int(item[0])):
+            baseline_result = baseline['results'].get(name, {}).get(scale)
+            if baseline_result and result['seconds'] > baseline_result['seconds'] * (1 + tolerance):
+                regressions.append((name, scale, baseline_result['seconds'], result['seconds']))
+    return regressions
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the checks on fake files, with a fake samtools.")
+    parser.add_argument('--output', help="File path for the results, as JSON")
+    parser.add_argument('--baseline', help="Results of a previous run (--output) to compare to")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="How much slower than the baseline a benchmark may be, e.g. 0.2 for 20%%")
+    parser.add_argument('--scales', default=','.join(str(scale) for scale in DEFAULT_SCALES),
+                        help="Comma separated numbers of pairs to run each benchmark on")
+    parser.add_argument('--benchmarks', help="Comma separated benchmarks to run, out of: %s" %
+                                             ','.join(name for name, _ in BENCHMARKS))
+    parser.add_argument('--latency', type=float, default=0, help="Seconds each fake samtools process takes")
+    parser.add_argument('--stats-lines', type=int, default=200, dest='stats_lines',
+                        help="Number of lines after the SN section of the fake stats outputs")
+    parser.add_argument('--sam-reads', type=int, default=10000, dest='sam_reads',
+                        help="Number of reads of the fake samtools view output of the checksum_engine benchmark")
+    parser.add_argument('--real-file', action='append', dest='real_files',
+                        help="A BAM or CRAM file on which to compare the throughput of samtools stats and of the "
+                             "checksum engine, with the real samtools, instead of running the benchmarks "
+                             "(can be given several times)")
+    parser.add_argument('--threads', type=int, help="--threads of the comparisons")
+    parser.add_argument('-j', '--jobs', type=int, default=4, help="Number of jobs of the batch benchmark")
+    parser.add_argument('--work-dir', dest='work_dir', help="Directory for the fake files, by default a temporary one")
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+    scales = [int(scale) for scale in args.scales.split(',')]
+    names = args.benchmarks.split(',') if args.benchmarks else None
+    if args.real_files:
+        engine_results = [compare_engine_to_samtools(fpath, args.threads) for fpath in args.real_files]
+        for result in engine_results:
+            print("%s (%.1fMB): samtools stats %.1fMB/s, checksum engine %.1fMB/s, same checksum: %s" %
+                  (result['file'], result['size_mb'], result['samtools_stats_mb_per_s'], result['engine_mb_per_s'],
+                   result['same_checksum']))
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(engine_results, f, indent=2)
+        return
+    with tempfile.TemporaryDirectory(dir=args.work_dir) as work_dir:
+        results = run_benchmarks(work_dir, scales, names, args)
+    for name, scales_results in results['results'].items():
+        for scale, result in scales_results.items():
+            print("%-20s %6s pairs: %10.3fs %10.3fms/pair" % (name, scale, result['seconds'], result['per_pair_ms']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+        for name, scale, baseline_seconds, seconds in regressions:
+            print("REGRESSION %s on %s pairs: %.3fs, was %.3fs" % (name, scale, seconds, baseline_seconds))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import time
+import asyncio
+import itertools
+import logging
+
+from checks import utils
+from checks import streaming
+from checks import threads as samtools_threads
+from checks.stats_checks import CompareStatsForFiles, HandleSamtoolsStats
+
+# The number of pairs verify_pairs verifies at the same time by default
+DEFAULT_MAX_CONCURRENT_PAIRS = 16
+
+
+async def _run_blocking(func, *args):
+    """Runs func (e.g. a cache lookup or the samtools probe) in the default executor, not to block the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+class AsyncRunSamtoolsCommands:
+    """
+    Coroutine versions of the RunSamtoolsCommands methods, built on asyncio subprocesses, so that a single event loop
+    can drive many samtools processes at the same time. The processes are killed when the coroutine running them
+    is cancelled or when they take longer than their timeout (in seconds).
+    """
+    @classmethod
+    async def _wait_for_process(cls, proc, coroutine, args_list, timeout=None):
+        try:
+            return await asyncio.wait_for(coroutine, timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError("TIMEOUT running process: %s, killed after %s seconds" % (args_list, timeout))
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+
+    @classmethod
+    async def _run_subprocess(cls, args_list, timeout=None):
+        proc = await asyncio.create_subprocess_exec(*args_list, stdout=asyncio.subprocess.PIPE,
+                                                    stderr=asyncio.subprocess.PIPE)
+        stdout, stderr = await cls._wait_for_process(proc, proc.communicate(), args_list, timeout)
+        stdout, stderr = stdout.decode(), stderr.decode(errors='replace')
+        utils.log_error(args_list, stderr, proc.returncode)
+        if stderr or proc.returncode != 0:
+            raise RuntimeError("ERROR running process: %s, error = %s and exit code = %s" %
+                               (args_list, stderr, proc.returncode))
+        return stdout
+
+    @classmethod
+    async def _stream_subprocess(cls, args_list, consumers, timeout=None):
+        """Like RunSamtoolsCommands._stream_subprocess, handing the output to the consumers line by line."""
+        proc = await asyncio.create_subprocess_exec(*args_list, stdout=asyncio.subprocess.PIPE,
+                                                    stderr=asyncio.subprocess.PIPE)
+
+        async def feed_consumers():
+            async for line in proc.stdout:
+                for consumer in consumers:
+                    consumer.consume(line.decode())
+
+        async def communicate():
+            stderr = (await asyncio.gather(feed_consumers(), proc.stderr.read()))[1]
+            await proc.wait()
+            return stderr.decode(errors='replace')
+
+        try:
+            stderr = await cls._wait_for_process(proc, communicate(), args_list, timeout)
+        except BaseException:
+            for consumer in consumers:
+                consumer.abort()
+            raise
+        utils.log_error(args_list, stderr, proc.returncode)
+        if stderr or proc.returncode != 0:
+            for consumer in consumers:
+                consumer.abort()
+            raise RuntimeError("ERROR running process: %s, error = %s and exit code = %s" %
+                               (args_list, stderr, proc.returncode))
+        for consumer in consumers:
+            consumer.finish()
+
+    @classmethod
+    async def run_samtools_quickcheck(cls, fpath, timeout=None):
+        return await cls._run_subprocess(['samtools', 'quickcheck', '-v', fpath], timeout)
+
+    @classmethod
+    async def get_samtools_flagstat_output(cls, fpath, threads=None, timeout=None):
+        threads_args = await _run_blocking(samtools_threads.samtools_threads_args, threads, 'flagstat')
+        return await cls._run_subprocess(['samtools', 'flagstat'] + threads_args + [fpath], timeout)
+
+    @classmethod
+    async def get_samtools_stats_output(cls, fpath, threads=None, timeout=None):
+        """:return: the compact stats text (the CHK line and the SN section), as HandleSamtoolsStats.fetch_stats"""
+        checksum, summary = streaming.ChecksumExtractor(), streaming.SummaryNumbersParser()
+        threads_args = await _run_blocking(samtools_threads.samtools_threads_args, threads, 'stats')
+        await cls._stream_subprocess(['samtools', 'stats'] + threads_args + [fpath], [checksum, summary], timeout)
+        return streaming.summary_stats_text(checksum.checksum, summary.summary)
+
+
+class AsyncCompareStatsForFiles:
+
+    @classmethod
+    def _empty_result(cls):
+        return {'quickcheck_errors': [], 'flagstat': None, 'flagstat_errors': [], 'stats': None, 'stats_errors': []}
+
+    @classmethod
+    async def _run_checks_on_file(cls, fpath, single_decode=False, threads=None, cache=None, timeout=None):
+        """Like CompareStatsForFiles._run_checks_on_file, running quickcheck, flagstat and stats one after the other."""
+        result = cls._empty_result()
+        try:
+            await AsyncRunSamtoolsCommands.run_samtools_quickcheck(fpath, timeout)
+        except RuntimeError as e:
+            result['quickcheck_errors'].append(str(e))
+            return result
+        if not single_decode:
+            try:
+                result['flagstat'] = await _run_blocking(cache.get_output, fpath, ['flagstat']) if cache else None
+                if not result['flagstat']:
+                    result['flagstat'] = await AsyncRunSamtoolsCommands.get_samtools_flagstat_output(fpath, threads,
+                                                                                                     timeout)
+                    if cache:
+                        await _run_blocking(cache.put_output, fpath, ['flagstat'], result['flagstat'])
+            except RuntimeError as e:
+                result['flagstat_errors'].append(str(e))
+        try:
+            result['stats'] = await _run_blocking(cache.get_output, fpath, ['stats']) if cache else None
+            if not result['stats']:
+                result['stats'] = await AsyncRunSamtoolsCommands.get_samtools_stats_output(fpath, threads, timeout)
+                if cache:
+                    await _run_blocking(cache.put_output, fpath, ['stats'], result['stats'])
+        except RuntimeError as e:
+            result['stats_errors'].append(str(e))
+        if single_decode and result['stats']:
+            result['flagstat'] = HandleSamtoolsStats.extract_flagstat_counts_from_stats(result['stats'])
+        return result
+
+    @classmethod
+    async def _run_checks_on_files(cls, fpaths, *args):
+        """
+        Runs _run_checks_on_file on the files at the same time, cancelling the checks of the other files (killing their
+        samtools processes) as soon as quickcheck fails on one of them, like the Cancellation of the blocking checks.
+        :return: list of the results of the files, empty for the files whose checks were cancelled
+        """
+        tasks = [asyncio.ensure_future(cls._run_checks_on_file(fpath, *args)) for fpath in fpaths]
+
+        def cancel_all_if_quickcheck_failed(task):
+            if not task.cancelled() and task.exception() is None and task.result()['quickcheck_errors']:
+                for other_task in tasks:
+                    other_task.cancel()
+        for task in tasks:
+            task.add_done_callback(cancel_all_if_quickcheck_failed)
+        try:
+            await asyncio.wait(tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return [cls._empty_result() if task.cancelled() else task.result() for task in tasks]
+
+    @classmethod
+    async def compare_bam_and_cram_by_statistics(cls, bam_path, cram_path, single_decode=False, threads=None,
+                                                 cache=None, timeout=None):
+        """
+        Coroutine version of CompareStatsForFiles.compare_bam_and_cram_by_statistics, giving the same errors.
+        The 2 files are checked at the same time. The stats files next to the data files are neither read nor written.
+        :param threads: the number of threads of each samtools process
+        :param cache: cache.StatsCache keeping the flagstat and stats outputs of files already seen
+        :param timeout: the number of seconds after which a samtools process is killed and reported as failed
+        :return: list of errors, empty if the files are equivalent
+        """
+        errors = await _run_blocking(CompareStatsForFiles._check_file_paths, bam_path, cram_path)
+        if errors:
+            return errors
+        # Probes samtools (once per binary) outside of the event loop, the -@ arguments then come from its capabilities:
+        errors = await _run_blocking(CompareStatsForFiles._check_samtools_version)
+        if errors:
+            return errors
+        result_b, result_c = await cls._run_checks_on_files((bam_path, cram_path), single_decode, threads, cache,
+                                                            timeout)
+        return CompareStatsForFiles._compare_file_results(result_b, result_c)
+
+
+async def verify_pair(bam_path, cram_path, semaphore=None, **compare_kwargs):
+    """
+    Compares a BAM and a CRAM, like batch.verify_pair.
+    :param semaphore: asyncio.Semaphore bounding the number of pairs verified at the same time
+    :param compare_kwargs: keyword arguments for AsyncCompareStatsForFiles.compare_bam_and_cram_by_statistics
+    :return: dict with the result of the comparison
+    """
+    if semaphore is not None:
+        await semaphore.acquire()
+    start = time.time()
+    try:
+        errors = await AsyncCompareStatsForFiles.compare_bam_and_cram_by_statistics(bam_path, cram_path,
+                                                                                     **compare_kwargs)
+    except Exception as e:
+        logging.exception("Unexpected error while comparing %s and %s" % (bam_path, cram_path))
+        errors = ["Unexpected error while comparing the files: %s" % e]
+    finally:
+        if semaphore is not None:
+            semaphore.release()
+    return {'bam': bam_path, 'cram': cram_path, 'status': 'failed' if errors else 'passed', 'errors': errors,
+            'tier': 'full', 'duration': time.time() - start}
+
+
+async def verify_pairs(pairs, max_concurrent=DEFAULT_MAX_CONCURRENT_PAIRS, **compare_kwargs):
+    """
+    Async generator verifying the pairs, at most max_concurrent at the same time,
+    and yielding the result of each pair (as returned by verify_pair) as soon as it is done.
+    The next pair is taken from the iterable only when a pair is done, so it can be a long or endless generator.
+    Closing the generator early cancels the pairs still being verified, killing their samtools processes.
+    :param pairs: iterable of (bam_path, cram_path) tuples
+    """
+    pairs = iter(pairs)
+    tasks = set()
+    try:
+        while True:
+            for bam_path, cram_path in itertools.islice(pairs, max_concurrent - len(tasks)):
+                tasks.add(asyncio.ensure_future(verify_pair(bam_path, cram_path, **compare_kwargs)))
+            if not tasks:
+                return
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,307 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+from checks import utils
+from checks import cache
+from checks import journal as verification_journal
+from checks import sources
+from checks import watchdog
+from checks.stats_checks import CompareStatsForFiles
+
+
+def find_pairs(bam_dir, cram_dir):
+    """
+    Pairs each <name>.bam in bam_dir with <name>.bam.cram or <name>.cram in cram_dir.
+    :return: list of (bam_path, cram_path) tuples
+    """
+    pairs = []
+    for bam_name in sorted(os.listdir(bam_dir)):
+        fname, ext = os.path.splitext(bam_name)
+        if ext != '.bam':
+            continue
+        bam_path = os.path.join(bam_dir, bam_name)
+        for cram_name in (bam_name + '.cram', fname + '.cram'):
+            cram_path = os.path.join(cram_dir, cram_name)
+            if os.path.isfile(cram_path):
+                pairs.append((bam_path, cram_path))
+                break
+        else:
+            logging.error("The CRAM corresponding to the BAM %s doesn't exist in %s" % (bam_path, cram_dir))
+    return pairs
+
+
+# The values a manifest can give for a pair, checked against the digests of its files
+EXPECTED_VALUES = {'bam_md5': ('bam', 'md5'), 'cram_md5': ('cram', 'md5'),
+                   'bam_size': ('bam', 'size'), 'cram_size': ('cram', 'size')}
+
+
+def _parse_manifest_line(line):
+    if line.startswith('{'):
+        entry = json.loads(line)
+        return entry.pop('bam', None), entry.pop('cram', None), entry.pop('expected', entry)
+    tokens = line.split('\t')
+    expected = dict(token.partition('=')[::2] for token in tokens[2:] if token)
+    return tokens[0], tokens[1] if len(tokens) > 1 else None, expected
+
+
+def iter_manifest(manifest_fpath):
+    """
+    Reads a manifest lazily, with one pair of files per line, either:
+    - the BAM path and the CRAM path separated by a tab, optionally followed by tab separated name=value
+      expected values, e.g. cram_md5=<md5>
+    - a JSON object with the bam and cram paths, and the expected values, e.g.
+      {"bam": "a.bam", "cram": "a.cram", "cram_md5": "<md5>"}
+    The expected values are the MD5 and the size of the files (bam_md5, cram_md5, bam_size, cram_size).
+    Empty lines and lines starting with # are skipped.
+    :return: generator of dicts with the bam and cram paths, and the expected values (expected)
+    """
+    with open(manifest_fpath) as f:
+        for line_nr, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                bam_path, cram_path, expected = _parse_manifest_line(line)
+            except ValueError as e:
+                raise ValueError("Line %s of the manifest %s isn't valid JSON: %s" % (line_nr, manifest_fpath, e))
+            if not bam_path or not cram_path:
+                raise ValueError("Line %s of the manifest %s doesn't have a BAM and a CRAM path" %
+                                 (line_nr, manifest_fpath))
+            unknown = sorted(set(expected) - set(EXPECTED_VALUES))
+            if unknown:
+                raise ValueError("Line %s of the manifest %s has unknown expected values: %s" %
+                                 (line_nr, manifest_fpath, ', '.join(unknown)))
+            yield {'bam': bam_path, 'cram': cram_path, 'expected': expected}
+
+
+def read_manifest(manifest_fpath):
+    """
+    Reads a manifest (see iter_manifest), ignoring the expected values.
+    :return: list of (bam_path, cram_path) tuples
+    """
+    return [(entry['bam'], entry['cram']) for entry in iter_manifest(manifest_fpath)]
+
+
+def check_expected(result, expected):
+    """
+    :param result: the result of a pair, as returned by verify_pair
+    :param expected: dict of the expected values of the pair, as read by iter_manifest
+    :return: list of errors, for the values different from the expected ones
+    """
+    errors = []
+    for name, value in sorted(expected.items()):
+        side, digest = EXPECTED_VALUES[name]
+        fpath = result[side]
+        actual = ((result.get('digests') or {}).get(fpath) or {}).get(digest)
+        if actual is None:
+            errors.append("The %s of %s wasn't computed, expected %s" % (digest, fpath, value))
+        elif str(actual).lower() != str(value).lower():
+            errors.append("The %s of %s is %s, expected %s" % (digest, fpath, actual, value))
+    return errors
+
+
+def pair_name(bam_path, cram_path):
+    """
+    :return: the name of the result (and log) files of a pair: the name of the BAM followed by a digest of the paths
+             of both files, as pairs from different directories (e.g. iRODS collections) often have the same names
+    """
+    digest = hashlib.sha1(('%s\t%s' % (bam_path, cram_path)).encode()).hexdigest()[:10]
+    return '%s.%s' % (os.path.splitext(os.path.basename(bam_path))[0], digest)
+
+
+def pair_status(errors):
+    """
+    :return: passed if there aren't any errors, watchdog.STALLED if a process was killed for timing out or stalling
+             (the pair can be verified again), failed otherwise
+    """
+    if not errors:
+        return 'passed'
+    return watchdog.STALLED if watchdog.is_stalled(errors) else 'failed'
+
+
+def verify_pair(bam_path, cram_path, compare_kwargs=None, log_fpath=None, next_pair=None):
+    """
+    Compares a BAM and a CRAM, meant to be run in a worker process of the batch.
+    :param compare_kwargs: keyword arguments for CompareStatsForFiles.verify_bam_and_cram
+    :param log_fpath: if given, the logging of this pair goes (also) to this file
+    :param next_pair: the (bam_path, cram_path) the same process verifies next; its iRODS files
+                      start being streamed while this pair is verified
+    :return: dict with the result of the comparison
+    """
+    handler = None
+    if log_fpath:
+        handler = logging.FileHandler(log_fpath, mode='w')
+        handler.setFormatter(logging.Formatter('%(levelname)s - %(asctime)s %(message)s'))
+        logging.getLogger().addHandler(handler)
+    start = time.time()
+    tier, telemetry, digests = None, None, None
+    for fpath in next_pair or ():
+        if utils.is_irods_path(fpath):
+            sources.prefetch(fpath, (compare_kwargs or {}).get('fetch_command'))
+    try:
+        verification = CompareStatsForFiles.verify_bam_and_cram(bam_path, cram_path, **(compare_kwargs or {}))
+        errors, tier, telemetry = verification['errors'], verification['tier'], verification.get('telemetry')
+        digests = verification.get('digests')
+    except Exception as e:
+        logging.exception("Unexpected error while comparing %s and %s" % (bam_path, cram_path))
+        errors = ["Unexpected error while comparing the files: %s" % e]
+    finally:
+        sources.discard_prefetched(keep=next_pair or ())
+        if handler:
+            logging.getLogger().removeHandler(handler)
+            handler.close()
+    return {'bam': bam_path, 'cram': cram_path, 'status': pair_status(errors), 'errors': errors,
+            'tier': tier, 'duration': time.time() - start, 'telemetry': telemetry, 'digests': digests}
+
+
+def _verify_entry(entry, compare_kwargs):
+    expected = entry.get('expected')
+    if expected:
+        compare_kwargs = dict(compare_kwargs or {}, compute_digests=True)
+    result = verify_pair(entry['bam'], entry['cram'], compare_kwargs)
+    if expected:
+        result['expected'] = expected
+        result['errors'].extend(check_expected(result, expected))
+        result['status'] = pair_status(result['errors'])
+    return result
+
+
+def verify_pairs(entries, jobs, compare_kwargs=None):
+    """
+    Verifies the pairs on a pool of threads of this process, at most jobs at the same time, taking the next
+    pair from entries only when a thread is free, so a manifest can be streamed through.
+    :param entries: iterable of dicts with the bam and cram paths of each pair, and optionally
+                    its expected values (expected), as yielded by iter_manifest
+    :param compare_kwargs: keyword arguments for CompareStatsForFiles.verify_bam_and_cram
+    :return: generator of the results of the pairs, as returned by verify_pair, as soon as each is done
+    """
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        running = set()
+        for entry in entries:
+            if len(running) >= jobs:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            running.add(executor.submit(_verify_entry, entry, compare_kwargs))
+        for future in as_completed(running):
+            yield future.result()
+
+
+def write_pair_result(output_dir, result):
+    fpath = os.path.join(output_dir, pair_name(result['bam'], result['cram']) + '.json')
+    return utils.write_to_file(fpath, json.dumps(result, indent=2))
+
+
+def with_journal(compare_kwargs, journal):
+    """:return: a copy of compare_kwargs taking the outputs of the stages completed already from the journal"""
+    compare_kwargs = dict(compare_kwargs or {})
+    if journal:
+        other_cache = compare_kwargs.get('cache')
+        compare_kwargs['cache'] = cache.CacheChain([journal, other_cache]) if other_cache else journal
+    return compare_kwargs
+
+
+def pairs_to_verify(pairs, journal=None, compare_kwargs=None):
+    """
+    :param compare_kwargs: the keyword arguments the pairs are to be verified with
+    :return: the pairs which aren't recorded in the journal as verified, for at least what these arguments check,
+             and unchanged
+    """
+    scope = verification_journal.verification_scope(compare_kwargs)
+    remaining = []
+    for bam_path, cram_path in pairs:
+        if journal and journal.is_verified(bam_path, cram_path, scope):
+            logging.info("Skipping %s and %s, already verified" % (bam_path, cram_path))
+            continue
+        remaining.append((bam_path, cram_path))
+    return remaining
+
+
+def write_summary(output_dir, total, results, skipped, start):
+    """
+    Writes the summary of a batch to <output_dir>/summary.json.
+    :param total: the number of pairs of the batch, including the skipped ones
+    :param results: the results of the pairs verified, as returned by verify_pair
+    :return: the summary, as a dict; the stalled pairs are counted as failed too
+    """
+    failed = [{'bam': result['bam'], 'cram': result['cram'], 'errors': result['errors']}
+              for result in results if result['errors']]
+    stalled = len([result for result in results if result.get('status') == watchdog.STALLED])
+    max_rss_mb = max([result['telemetry']['max_rss_mb'] for result in results if result.get('telemetry')] or [0])
+    summary = {'total': total, 'passed': total - len(failed), 'failed': len(failed), 'stalled': stalled,
+               'skipped': skipped, 'duration': time.time() - start, 'max_rss_mb': max_rss_mb, 'failed_pairs': failed}
+    utils.write_to_file(os.path.join(output_dir, 'summary.json'), json.dumps(summary, indent=2))
+    return summary
+
+
+def run_batch(pairs, output_dir, jobs=None, compare_kwargs=None, log_dir=None, journal=None, history=None):
+    """
+    Verifies the pairs of files on a pool of local processes, writing the result of each pair
+    to <output_dir>/<BAM name>.json as soon as it's done, and a summary to <output_dir>/summary.json at the end.
+    :param pairs: list of (bam_path, cram_path) tuples
+    :param jobs: the number of pairs verified at the same time, by default the number of CPUs
+    :param compare_kwargs: keyword arguments for CompareStatsForFiles.verify_bam_and_cram
+    :param log_dir: if given, the logging of each pair goes to <log_dir>/<BAM name>.log
+    :param journal: journal.VerificationJournal; the pairs it has as verified and unchanged are skipped,
+                    and the stages completed for the others are taken from it
+    :param history: resources.ResourceHistory recording the usage of the stages of each pair
+    :return: the summary, as a dict, with the peak memory used by a samtools process of the batch (max_rss_mb)
+
+    When there are iRODS files, the pairs are split in jobs lanes, each verified one after the other
+    by its own process, which prefetches the next pair of its lane while verifying the current one.
+    """
+    scope = verification_journal.verification_scope(compare_kwargs)
+    remaining = pairs_to_verify(pairs, journal, compare_kwargs)
+    compare_kwargs = with_journal(compare_kwargs, journal)
+    os.makedirs(output_dir, exist_ok=True)
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+    start = time.time()
+    results = []
+    prefetch = any(utils.is_irods_path(fpath) for pair in remaining for fpath in pair)
+    lanes_nr = (jobs or os.cpu_count()) if prefetch else 1
+    lanes = [remaining[i::lanes_nr] for i in range(lanes_nr) if remaining[i::lanes_nr]]
+    with ExitStack() as stack:
+        futures = []
+        for lane in lanes:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=1 if prefetch else jobs))
+            for i, (bam_path, cram_path) in enumerate(lane):
+                log_fpath = os.path.join(log_dir, pair_name(bam_path, cram_path) + '.log') if log_dir else None
+                next_pair = lane[i + 1] if prefetch and i + 1 < len(lane) else None
+                futures.append(executor.submit(verify_pair, bam_path, cram_path, compare_kwargs, log_fpath,
+                                               next_pair))
+        for future in as_completed(futures):
+            result = future.result()
+            write_pair_result(output_dir, result)
+            if journal:
+                journal.record_pair(result['bam'], result['cram'], result, scope)
+            if history and result.get('telemetry'):
+                history.record(result['telemetry'])
+            results.append(result)
+            logging.info("%s and %s: %s" % (result['bam'], result['cram'], result['status']))
+    return write_summary(output_dir, len(pairs), results, len(pairs) - len(remaining), start)
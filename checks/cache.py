@@ -0,0 +1,292 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import json
+import time
+import errno
+import hashlib
+import logging
+import sqlite3
+import threading
+import subprocess
+
+from checks import utils
+from checks import capabilities
+
+# The SQLite journal mode of a database used from a single host. WAL lets the readers and the writer go on
+# at the same time, but it keeps its index in shared memory, so it is unsafe on a networked filesystem (e.g. NFS).
+LOCAL_JOURNAL_MODE = 'WAL'
+# The SQLite journal mode of a database written from several hosts (e.g. by the elements of a job array):
+# the writers only rely on the locks of the files, which the filesystem must support (e.g. NFS with lockd).
+SHARED_JOURNAL_MODE = 'DELETE'
+# The number of entries a DirectoryCache writes between two scans of its directory, which add the size
+# of the entries written by the other processes sharing it
+DIRECTORY_SCAN_WRITES = 100
+
+# The iRODS checksums of the objects already looked up by this process, by path
+_irods_checksums = {}
+
+
+def samtools_version():
+    """The first line of samtools --version, probed once per samtools binary (see capabilities)."""
+    return capabilities.samtools_capabilities()['version_line']
+
+
+def _irods_checksum(path):
+    logical_path = path[len('irods:'):]
+    proc = subprocess.run(['ichksum', logical_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+    if proc.returncode != 0 or not proc.stdout.split():
+        raise IOError("Can't get the iRODS checksum of %s: %s" % (path, proc.stderr))
+    return proc.stdout.split()[-1]
+
+
+def file_identity(fpath):
+    """
+    Identifies the content of a file without reading it: size, mtime, inode and device for local files,
+    and the checksum kept by iRODS for iRODS objects, looked up only once per run.
+    :return: dict describing the file
+    """
+    if utils.is_irods_path(fpath):
+        if fpath not in _irods_checksums:
+            _irods_checksums[fpath] = _irods_checksum(fpath)
+        return {'irods': fpath, 'checksum': _irods_checksums[fpath]}
+    st = os.stat(fpath)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'inode': st.st_ino, 'device': st.st_dev}
+
+
+def cache_key(fpath, args_list):
+    """
+    :param fpath: the file the samtools command is run on
+    :param args_list: the samtools subcommand and the arguments affecting its output, e.g. ['stats']
+    :return: the key of the command's output in the cache, or None if the file can't be identified
+    """
+    try:
+        identity = file_identity(fpath)
+    except (IOError, OSError) as e:
+        logging.warning("Can't identify %s for caching: %s" % (fpath, e))
+        return None
+    key = {'file': identity, 'samtools': samtools_version(), 'args': args_list}
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+class StatsCache:
+    """
+    Base class for the caches of samtools outputs. The keys come from cache_key(), so an entry is only found again
+    for the same file content, samtools version and command, wherever the file is.
+    The size of the cache is kept under max_bytes by evicting the least recently used entries.
+    """
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+
+    def get(self, key):
+        raise NotImplementedError()
+
+    def put(self, key, value):
+        raise NotImplementedError()
+
+    def get_output(self, fpath, args_list):
+        key = cache_key(fpath, args_list)
+        if not key:
+            return None
+        value = self.get(key)
+        if value is not None:
+            logging.info("Found samtools %s output for %s in the cache" % (' '.join(args_list), fpath))
+        return value
+
+    def put_output(self, fpath, args_list, value):
+        key = cache_key(fpath, args_list)
+        if key and value:
+            self.put(key, value)
+
+
+class DirectoryCache(StatsCache):
+    """
+    Keeps each entry in its own file. The entries are written to a temporary file and moved in place,
+    so concurrent writers (threads, processes or nodes sharing the directory) never see a partial entry.
+    The size of the directory is tracked from the entries written, and the directory is only scanned when
+    that size goes over max_bytes, or every DIRECTORY_SCAN_WRITES entries for the entries of the other writers.
+    """
+    def __init__(self, dirpath, max_bytes=None):
+        super().__init__(max_bytes)
+        self.dirpath = dirpath
+        os.makedirs(dirpath, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = None
+        self._writes_since_scan = 0
+
+    def __getstate__(self):
+        return {'dirpath': self.dirpath, 'max_bytes': self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state['dirpath'], state['max_bytes'])
+
+    def _entry_fpath(self, key):
+        return os.path.join(self.dirpath, key[:2], key)
+
+    def get(self, key):
+        fpath = self._entry_fpath(key)
+        try:
+            with open(fpath) as f:
+                value = f.read()
+        except (IOError, OSError):
+            return None
+        try:
+            now = time.time()
+            os.utime(fpath, (now, now))
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        fpath = self._entry_fpath(key)
+        os.makedirs(os.path.dirname(fpath), exist_ok=True)
+        tmp_fpath = "%s.%s.%s.tmp" % (fpath, os.getpid(), threading.get_ident())
+        with open(tmp_fpath, 'w') as f:
+            f.write(value)
+        now = time.time()
+        os.utime(tmp_fpath, (now, now))
+        os.replace(tmp_fpath, fpath)
+        if not self.max_bytes:
+            return
+        with self._lock:
+            self._writes_since_scan += 1
+            if self._size is not None:
+                self._size += len(value.encode())
+            if self._size is not None and self._size <= self.max_bytes and \
+                    self._writes_since_scan < DIRECTORY_SCAN_WRITES:
+                return
+            self._writes_since_scan = 0
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used entries until the size of the directory is at most max_bytes."""
+        if not self.max_bytes:
+            return
+        entries = []
+        for subdir in os.listdir(self.dirpath):
+            subdir_path = os.path.join(self.dirpath, subdir)
+            if not os.path.isdir(subdir_path):
+                continue
+            for fname in os.listdir(subdir_path):
+                if fname.endswith('.tmp'):
+                    continue
+                try:
+                    st = os.stat(os.path.join(subdir_path, fname))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, os.path.join(subdir_path, fname)))
+        total = sum(size for _, size, _ in entries)
+        for _, size, fpath in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(fpath)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            total -= size
+        with self._lock:
+            self._size = total
+
+
+class SQLiteCache(StatsCache):
+    """
+    Keeps the entries in a SQLite database. Each thread has its own connection, and the writes
+    are done in transactions, so concurrent writers are serialized by SQLite.
+    The journal mode is LOCAL_JOURNAL_MODE, or SHARED_JOURNAL_MODE for a database written from several hosts.
+    """
+    def __init__(self, db_fpath, max_bytes=None, journal_mode=LOCAL_JOURNAL_MODE):
+        super().__init__(max_bytes)
+        self.db_fpath = db_fpath
+        self.journal_mode = journal_mode
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS entries "
+                         "(key TEXT PRIMARY KEY, value TEXT, size INTEGER, last_used REAL)")
+
+    def __getstate__(self):
+        return {'db_fpath': self.db_fpath, 'max_bytes': self.max_bytes, 'journal_mode': self.journal_mode}
+
+    def __setstate__(self, state):
+        self.__init__(state['db_fpath'], state['max_bytes'], state['journal_mode'])
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_fpath, timeout=60)
+            conn.execute("PRAGMA journal_mode=%s" % self.journal_mode)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        with self._connection() as conn:
+            row = conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, key, value):
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO entries (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+                         (key, value, len(value.encode()), time.time()))
+            if self.max_bytes:
+                self._evict(conn)
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+
+
+class CacheChain(StatsCache):
+    """Looks the outputs up in each of the caches in turn, and stores them in all of them."""
+    def __init__(self, caches):
+        super().__init__()
+        self.caches = caches
+
+    def get_output(self, fpath, args_list):
+        for stats_cache in self.caches:
+            value = stats_cache.get_output(fpath, args_list)
+            if value is not None:
+                return value
+        return None
+
+    def put_output(self, fpath, args_list, value):
+        for stats_cache in self.caches:
+            stats_cache.put_output(fpath, args_list, value)
+
+
+def open_cache(spec, max_bytes=None):
+    """
+    :param spec: either sqlite:<path to the database file> or the path to a directory
+    :param max_bytes: the maximum size of the cache, None for no limit
+    :return: the StatsCache for the given spec
+    """
+    if spec.startswith('sqlite:'):
+        return SQLiteCache(spec[len('sqlite:'):], max_bytes)
+    return DirectoryCache(spec, max_bytes)
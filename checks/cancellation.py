@@ -0,0 +1,100 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import threading
+from contextlib import contextmanager
+
+
+class Cancellation:
+    """
+    Shared by the pipelines (and their samtools processes) working on the same pair of files.
+    It works like a threading.Event, but setting it also terminates all the processes registered with it
+    that are still running, and any process registered after it has been set.
+    With a watchdog.Watchdog, the registered processes are also killed when they time out or stall.
+    """
+    def __init__(self, watchdog=None):
+        """:param watchdog: watchdog.Watchdog watching the processes while they are registered"""
+        self.watchdog = watchdog
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._processes = set()
+
+    def is_set(self):
+        return self._event.is_set()
+
+    def set(self):
+        with self._lock:
+            self._event.set()
+            processes = list(self._processes)
+        for proc in processes:
+            self._terminate(proc)
+
+    @staticmethod
+    def _terminate(proc):
+        if proc.poll() is None:
+            try:
+                proc.terminate()
+            except ProcessLookupError:
+                pass
+
+    @contextmanager
+    def registered(self, proc):
+        """Context manager keeping the process registered, so it's terminated if the cancellation is set meanwhile."""
+        with self._lock:
+            self._processes.add(proc)
+            cancelled = self._event.is_set()
+        if cancelled:
+            self._terminate(proc)
+        if self.watchdog:
+            self.watchdog.watch(proc)
+        try:
+            yield proc
+        finally:
+            if self.watchdog:
+                self.watchdog.unwatch(proc)
+            with self._lock:
+                self._processes.discard(proc)
+
+    def watchdog_error(self, proc):
+        """:return: the error of the process if the watchdog killed it, None otherwise"""
+        return self.watchdog.error(proc) if self.watchdog else None
+
+
+@contextmanager
+def registered(cancellation, proc):
+    """Like Cancellation.registered, doing nothing if there isn't any cancellation."""
+    if cancellation is None:
+        yield proc
+    else:
+        with cancellation.registered(proc):
+            yield proc
+
+
+def own_session(cancellation):
+    """
+    :return: True if the processes registered with the cancellation need to be started in their own session
+             (start_new_session of subprocess.Popen), so that their watchdog can kill their whole process group
+    """
+    return cancellation is not None and cancellation.watchdog is not None
+
+
+def watchdog_error(cancellation, proc):
+    """Like Cancellation.watchdog_error, None if there isn't any cancellation."""
+    return cancellation.watchdog_error(proc) if cancellation is not None else None
@@ -0,0 +1,184 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import re
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import subprocess
+
+CAPABILITIES_CACHE_ENV_VAR = 'BAM2CRAM_SAMTOOLS_CACHE'
+DEFAULT_CAPABILITIES_CACHE_DIR = os.path.join('~', '.cache', 'bam2cram-check', 'samtools')
+MIN_SAMTOOLS_VERSION = (1, 3)
+# The subcommands whose options are probed, from their usage
+PROBED_COMMANDS = ('view', 'flagstat', 'stats')
+PROBE_TIMEOUT = 30
+# The versions of CRAM decoded by htslib, and the first htslib version decoding each
+CRAM_VERSIONS = (('2.1', (1, 0)), ('3.0', (1, 0)), ('3.1', (1, 10)))
+
+_probed = {}
+_probed_lock = threading.Lock()
+
+
+def default_capabilities_cache_dir():
+    """The directory given in the BAM2CRAM_SAMTOOLS_CACHE environment variable, if set, otherwise the
+    DEFAULT_CAPABILITIES_CACHE_DIR in the home directory."""
+    return os.path.expanduser(os.environ.get(CAPABILITIES_CACHE_ENV_VAR) or DEFAULT_CAPABILITIES_CACHE_DIR)
+
+
+def parse_version_numbers(version):
+    """:return: the (major, minor, patch) numbers of a version like 1.10, 1.2.1 or 1.2-216-gdffc67f,
+    None if it doesn't start with numbers"""
+    match = re.match(r'(\d+)\.(\d+)(?:\.(\d+))?', version or '')
+    if not match:
+        return None
+    return tuple(int(nr) for nr in match.groups('0'))
+
+
+def parse_version_output(output):
+    """:return: dict with the first line (version_line), the samtools version and the htslib version
+    of samtools --version"""
+    lines = output.splitlines()
+    tokens = lines[0].split() if lines else []
+    if len(tokens) < 2:
+        raise ValueError("samtools --version output looks different than expected. Can't parse it.")
+    htslib = None
+    for line in lines[1:]:
+        if line.startswith('Using htslib'):
+            htslib = line.split()[-1]
+    return {'version_line': lines[0].strip(), 'version': tokens[1], 'htslib': htslib}
+
+
+def parse_usage_options(usage):
+    """:return: the sorted options listed by the usage of a samtools subcommand, None if it isn't a usage"""
+    if 'Usage' not in usage:
+        return None
+    return sorted(set(re.findall(r'(?<![\w-])(-@|-[A-Za-z](?![\w-])|--[a-z][a-z0-9-]+)', usage)))
+
+
+def _run_probe(args):
+    proc = subprocess.run(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                          universal_newlines=True, timeout=PROBE_TIMEOUT)
+    return proc.returncode, proc.stdout
+
+
+def probe_samtools(samtools_path):
+    """
+    Runs samtools --version and the usage of the PROBED_COMMANDS.
+    :return: dict of the capabilities of the samtools: its version_line, version (and version_numbers), htslib
+             version, the options of each probed subcommand (options, None when unknown) and the CRAM versions
+             it decodes (cram_versions)
+    :raises RuntimeError: if samtools --version fails
+    """
+    try:
+        returncode, output = _run_probe([samtools_path, '--version'])
+    except (OSError, subprocess.SubprocessError) as e:
+        raise RuntimeError("Can't run %s --version: %s" % (samtools_path, e))
+    if returncode != 0:
+        raise RuntimeError("%s --version exited with %s: %s" % (samtools_path, returncode, output))
+    capabilities = parse_version_output(output)
+    capabilities['version_numbers'] = parse_version_numbers(capabilities['version'])
+    capabilities['options'] = {}
+    for command in PROBED_COMMANDS:
+        try:
+            capabilities['options'][command] = parse_usage_options(_run_probe([samtools_path, command, '--help'])[1])
+        except (OSError, subprocess.SubprocessError) as e:
+            logging.warning("Can't get the usage of samtools %s: %s" % (command, e))
+            capabilities['options'][command] = None
+    htslib_numbers = parse_version_numbers(capabilities['htslib']) or capabilities['version_numbers']
+    capabilities['cram_versions'] = [version for version, since in CRAM_VERSIONS
+                                     if htslib_numbers and htslib_numbers[:2] >= since]
+    return capabilities
+
+
+def _binary_identity(samtools_path):
+    st = os.stat(samtools_path)
+    return '%s:%s:%s' % (samtools_path, st.st_mtime_ns, st.st_size)
+
+
+def _read_cached(cache_fpath):
+    try:
+        with open(cache_fpath) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _write_cached(cache_fpath, capabilities):
+    try:
+        os.makedirs(os.path.dirname(cache_fpath), exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(cache_fpath), delete=False) as f:
+            json.dump(capabilities, f, indent=2)
+        os.replace(f.name, cache_fpath)
+    except (IOError, OSError) as e:
+        logging.warning("Can't save the capabilities of samtools to %s: %s" % (cache_fpath, e))
+
+
+def samtools_capabilities(samtools='samtools', cache_dir=None):
+    """
+    The capabilities of the samtools found in the PATH (see probe_samtools), probed only once per binary:
+    they are kept in memory and in <cache_dir>/<hash of the resolved path, mtime and size of the binary>.json,
+    so the probe runs again only when samtools is replaced.
+    :param cache_dir: by default default_capabilities_cache_dir()
+    :raises RuntimeError: if samtools isn't found or can't be run
+    """
+    found = shutil.which(samtools)
+    if not found:
+        raise RuntimeError("Can't find %s in the PATH" % samtools)
+    samtools_path = os.path.realpath(found)
+    identity = _binary_identity(samtools_path)
+    with _probed_lock:
+        if identity in _probed:
+            return _probed[identity]
+        cache_dir = cache_dir or default_capabilities_cache_dir()
+        cache_fpath = os.path.join(cache_dir, hashlib.sha1(identity.encode()).hexdigest() + '.json')
+        capabilities = _read_cached(cache_fpath)
+        if capabilities is None:
+            capabilities = probe_samtools(samtools_path)
+            capabilities['identity'] = identity
+            _write_cached(cache_fpath, capabilities)
+        _probed[identity] = capabilities
+        return capabilities
+
+
+def check_samtools_version(capabilities, min_version=MIN_SAMTOOLS_VERSION):
+    """:raises ValueError: if the samtools version is older than min_version, or can't be parsed"""
+    numbers = capabilities.get('version_numbers')
+    if not numbers:
+        raise ValueError("Can't parse the samtools version: %s" % capabilities.get('version'))
+    if tuple(numbers[:len(min_version)]) < tuple(min_version):
+        raise ValueError("You need to use at least samtools version %s, found: %s" %
+                         ('.'.join(str(nr) for nr in min_version), capabilities['version']))
+
+
+def supports_option(command, option):
+    """
+    :return: False if the usage of the samtools subcommand is known and doesn't list the option, True otherwise,
+             e.g. when samtools can't be probed
+    """
+    try:
+        options = samtools_capabilities()['options'].get(command)
+    except RuntimeError:
+        return True
+    return options is None or option in options
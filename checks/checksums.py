@@ -0,0 +1,143 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import zlib
+import binascii
+
+from checks import streaming
+from checks.stats_checks import RunSamtoolsCommands
+
+CHUNK_SIZE = 4 * 1024 * 1024
+UNMAPPED_CONTIG = '*'
+NO_READ_GROUP = ''
+
+# The 4 bit codes of the bases in BAM (seq_nt16 in htslib) as hexadecimal digits, so that a SAM sequence is packed
+# as in BAM by a single translate and unhexlify. Any other character is N, as in htslib.
+_SEQ_TO_HEX = bytearray(b'f' * 256)
+for _code, _base in enumerate('=ACMGRSVTWYHKDBN'):
+    _SEQ_TO_HEX[ord(_base)] = _SEQ_TO_HEX[ord(_base.lower())] = ord('%x' % _code)
+_SEQ_TO_HEX = bytes(_SEQ_TO_HEX)
+# The SAM base qualities (Phred+33) as they are stored in BAM
+_QUAL_TO_PHRED = bytes((i - 33) % 256 for i in range(256))
+
+
+def checksum_line(sums):
+    """:return: the CHK line of samtools stats for the sums of CRC32s of the names, sequences and qualities"""
+    return "CHK\t%08x\t%08x\t%08x" % tuple(sums)
+
+
+class SamChecksums(streaming.StreamConsumer):
+    """
+    Computes the same checksums as samtools stats (the CHK line) out of SAM output, in one pass,
+    together with the checksums of each read group and of each contig.
+    As samtools stats does, it sums (32bit overflow) for all the reads the CRC32 of the name,
+    of the sequence packed 4 bits a base as in BAM, and of the first (length + 1) / 2 base qualities
+    as stored in BAM (samtools stats' checksum only covers that many bytes).
+    The output is consumed in chunks of bytes, only the last, partial line of a chunk being kept in between,
+    and the sums of a chunk are kept in local variables and added to those of the read groups and contigs once
+    per chunk.
+    """
+    def __init__(self):
+        self.checksums = [0, 0, 0]
+        self.reads = 0
+        self.by_read_group = {}
+        self.by_contig = {}
+        self._partial_line = b''
+
+    def consume(self, chunk):
+        lines = (self._partial_line + chunk).split(b'\n')
+        self._partial_line = lines.pop()
+        self._add_lines(lines)
+
+    def finish(self):
+        if self._partial_line:
+            self._add_lines([self._partial_line])
+            self._partial_line = b''
+
+    def abort(self):
+        self._partial_line = b''
+
+    def _add_lines(self, lines):
+        crc32, unhexlify = zlib.crc32, binascii.unhexlify
+        group_sums = {}
+        reads = 0
+        for line in lines:
+            fields = line.split(b'\t', 11)
+            if len(fields) < 11 or line.startswith(b'@'):
+                continue
+            reads += 1
+            name_crc, seq_crc, qual_crc = crc32(fields[0]), 0, 0
+            seq = fields[9]
+            if seq != b'*':
+                hexed = seq.translate(_SEQ_TO_HEX)
+                seq_crc = crc32(unhexlify(hexed + b'0' if len(hexed) % 2 else hexed))
+                half_length = (len(seq) + 1) // 2
+                qual = fields[10]
+                qual_crc = crc32(b'\xff' * half_length if qual == b'*' else qual[:half_length].translate(_QUAL_TO_PHRED))
+            read_group = b''
+            if len(fields) == 12:
+                start = fields[11].find(b'RG:Z:')
+                if start == 0 or start > 0 and fields[11][start - 1] == 9:
+                    end = fields[11].find(b'\t', start)
+                    read_group = fields[11][start + 5:end if end >= 0 else None]
+            key = (read_group, fields[2])
+            sums = group_sums.get(key)
+            if sums is None:
+                sums = group_sums[key] = [0, 0, 0]
+            sums[0] += name_crc
+            sums[1] += seq_crc
+            sums[2] += qual_crc
+        self.reads += reads
+        for (read_group, contig), sums in group_sums.items():
+            for totals in (self.checksums, self.by_read_group.setdefault(read_group.decode(), [0, 0, 0]),
+                           self.by_contig.setdefault(contig.decode(), [0, 0, 0])):
+                for i in range(3):
+                    totals[i] = (totals[i] + sums[i]) & 0xffffffff
+
+    def checksum_line(self):
+        return checksum_line(self.checksums)
+
+
+def compute_checksums(fpath, threads=None, cancellation=None, chunk_size=CHUNK_SIZE):
+    """
+    Decodes a file with samtools view, computing the checksums of its reads as samtools stats does,
+    overall, per read group and per contig.
+    :return: SamChecksums
+    """
+    checksums = SamChecksums()
+    RunSamtoolsCommands.stream_samtools_view_output(fpath, [checksums], chunk_size, threads, cancellation)
+    return checksums
+
+
+def compare_checksums(checksums_b, checksums_c):
+    """
+    Compares the checksums of the reads of a BAM and a CRAM, per read group and per contig.
+    :return: list of errors, one for each read group and each contig whose checksums differ, empty if none do
+    """
+    errors = []
+    for breakdown, attribute in (('read group', 'by_read_group'), ('contig', 'by_contig')):
+        sums_b, sums_c = getattr(checksums_b, attribute), getattr(checksums_c, attribute)
+        for key in sorted(set(sums_b) | set(sums_c)):
+            chk_b = checksum_line(sums_b[key]) if key in sums_b else None
+            chk_c = checksum_line(sums_c[key]) if key in sums_c else None
+            if chk_b != chk_c:
+                errors.append("STATS SEQUENCE CHECKSUM DIFFERENT for %s %s: %s and %s" %
+                              (breakdown, key or '(none)', chk_b, chk_c))
+    return errors
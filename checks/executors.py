@@ -0,0 +1,285 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import sys
+import json
+import math
+import time
+import shlex
+import pickle
+import logging
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from checks import batch
+from checks import cache
+from checks import resources
+from checks import watchdog
+from checks.journal import VerificationJournal, verification_scope
+
+DEFAULT_PAIRS_PER_ELEMENT = 10
+DEFAULT_MEMORY_MB = 4000
+
+# The default maximum size of a job array, both for LSF (MAX_JOB_ARRAY_SIZE) and Slurm (MaxArraySize)
+MAX_ARRAY_SIZE = 1000
+
+JOURNAL_FNAME = 'journal.db'
+
+# How many times the pairs with a process killed for stalling (see watchdog.Watchdog) are submitted again
+DEFAULT_STALLED_RETRIES = 1
+
+# Outcome recorded in the journal for the pairs of a job array until their element verifies them
+SUBMITTED = 'submitted'
+
+_PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class LocalExecutor:
+    """Verifies the pairs on a pool of processes of this host, see batch.run_batch."""
+
+    def __init__(self, history=None):
+        """:param history: resources.ResourceHistory recording the usage of the stages of the pairs"""
+        self.history = history
+
+    def run(self, pairs, output_dir, jobs=None, compare_kwargs=None, log_dir=None, journal=None):
+        return batch.run_batch(pairs, output_dir, jobs, compare_kwargs, log_dir, journal, self.history)
+
+
+class JobArrayExecutor:
+    """
+    Verifies the pairs with a single job array submitted to a cluster scheduler, instead of a job per pair:
+    each element of the array verifies a chunk of pairs one after the other, in one interpreter, recording
+    their results in a journal shared by all the elements, from which they are collected when the array is done.
+    The subclasses give the command submitting the array for their scheduler.
+
+    With a resources.ResourceHistory, the memory, threads and walltime of the pairs are predicted from the usage
+    recorded for earlier pairs, and the pairs are submitted as one job array per class of resources, the small
+    pairs being packed together in the same elements (see resources.pack_pairs). The pairs the history can't
+    predict are submitted with the default resources.
+
+    The pairs whose verification stalled (or timed out) are submitted again in a new job array, likely to run
+    on other hosts than the ones the stalled processes were on.
+    """
+    # Environment variable with the index of the array element, and the index of the first element
+    index_variable = None
+    first_index = 0
+
+    def __init__(self, pairs_per_element=DEFAULT_PAIRS_PER_ELEMENT, memory_mb=DEFAULT_MEMORY_MB, queue=None,
+                 submit_options=None, history=None, element_minutes=resources.DEFAULT_ELEMENT_MINUTES,
+                 stalled_retries=DEFAULT_STALLED_RETRIES):
+        """
+        :param pairs_per_element: the number of pairs verified by each element of the array, increased if needed
+                                  to keep the array within MAX_ARRAY_SIZE elements
+        :param memory_mb: the memory reserved for each element
+        :param queue: the queue (LSF) or partition (Slurm) the array is submitted to
+        :param submit_options: other options of the submission command, as a string
+        :param history: resources.ResourceHistory predicting the resources of the pairs, and recording their usage
+        :param element_minutes: the walltime up to which pairs with predicted resources are packed in an element
+        :param stalled_retries: how many times the stalled pairs are submitted again
+        """
+        self.pairs_per_element = pairs_per_element
+        self.memory_mb = memory_mb
+        self.queue = queue
+        self.submit_options = submit_options
+        self.history = history
+        self.element_minutes = element_minutes
+        self.stalled_retries = stalled_retries
+
+    def submit_command(self, job_name, elements_nr, jobs, threads, command, logs_dir, memory_mb=None,
+                       walltime_minutes=None):
+        """
+        :param jobs: the maximum number of elements running at the same time, if any
+        :param command: the command run by each element, as a string
+        :param logs_dir: directory for the output of each element
+        :param memory_mb: the memory reserved for each element, by default the memory_mb of the executor
+        :param walltime_minutes: the run time limit of each element, if any
+        :return: the command submitting the array and waiting for all its elements to finish, as a list
+        """
+        raise NotImplementedError
+
+    def run(self, pairs, output_dir, jobs=None, compare_kwargs=None, log_dir=None, journal=None):
+        """
+        Same as batch.run_batch, jobs being the maximum number of array elements running at the same time.
+        When no journal is given, the elements record the results in <output_dir>/journal.db. As the elements
+        write the journal from their own hosts, a given journal must be opened with cache.SHARED_JOURNAL_MODE.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+        start = time.time()
+        journal = journal or VerificationJournal(os.path.join(output_dir, JOURNAL_FNAME),
+                                                 journal_mode=cache.SHARED_JOURNAL_MODE)
+        remaining = batch.pairs_to_verify(pairs, journal, compare_kwargs)
+        compare_kwargs = compare_kwargs or {}
+        results = {}
+        to_submit = remaining
+        for attempt in range(self.stalled_retries + 1):
+            if attempt:
+                logging.warning("Submitting again the %s pairs whose verification stalled" % len(to_submit))
+            for result in self._run_arrays(to_submit, output_dir, jobs, compare_kwargs, log_dir, journal):
+                results[(result['bam'], result['cram'])] = result
+                if self.history and result.get('telemetry') and result['status'] != watchdog.STALLED:
+                    self.history.record(result['telemetry'])
+                logging.info("%s and %s: %s" % (result['bam'], result['cram'], result['status']))
+            to_submit = [pair for pair in to_submit if results[pair]['status'] == watchdog.STALLED]
+            if not to_submit:
+                break
+        return batch.write_summary(output_dir, len(pairs), [results[pair] for pair in remaining],
+                                   len(pairs) - len(remaining), start)
+
+    def _run_arrays(self, pairs, output_dir, jobs, compare_kwargs, log_dir, journal):
+        """:return: the results of the pairs, collected from the journal once all their job arrays are done"""
+        arrays = self.plan_arrays(pairs, compare_kwargs.get('threads'))
+        if arrays:
+            array_jobs = max(1, jobs // len(arrays)) if jobs else None
+            with ThreadPoolExecutor(max_workers=len(arrays)) as pool:
+                list(pool.map(lambda array: self._run_array(array, output_dir, array_jobs, compare_kwargs, log_dir,
+                                                            journal), arrays))
+        return [self._collect_result(bam_path, cram_path, output_dir, journal) for bam_path, cram_path in pairs]
+
+    def plan_arrays(self, pairs, threads=None):
+        """
+        :param threads: the threads of each pair, the most requested for the pairs with predicted resources
+        :return: list of dicts, one per job array, with the memory_mb, threads and walltime_minutes of its elements
+                 and the elements, as lists of pairs
+        """
+        predictions = {}
+        if self.history:
+            predictions = {pair: self.history.predict_pair(*pair, max_threads=threads) for pair in pairs}
+        arrays = []
+        unpredicted = [pair for pair in pairs if not predictions.get(pair)]
+        if unpredicted:
+            pairs_per_element = max(self.pairs_per_element, math.ceil(len(unpredicted) / MAX_ARRAY_SIZE))
+            arrays.append({'memory_mb': self.memory_mb, 'threads': threads, 'walltime_minutes': None,
+                           'elements': [unpredicted[i:i + pairs_per_element]
+                                        for i in range(0, len(unpredicted), pairs_per_element)]})
+        packed = resources.pack_pairs({pair: prediction for pair, prediction in predictions.items() if prediction},
+                                      self.element_minutes)
+        for array in packed:
+            for i in range(0, len(array['elements']), MAX_ARRAY_SIZE):
+                arrays.append(dict(array, elements=array['elements'][i:i + MAX_ARRAY_SIZE]))
+        return arrays
+
+    def _run_array(self, array, output_dir, jobs, compare_kwargs, log_dir, journal):
+        job_name = 'bam2cram-check-%s-%s-%s' % (os.getpid(), int(time.time()), threading.get_ident())
+        array_fpath = os.path.join(output_dir, job_name + '.array')
+        if array['threads']:
+            compare_kwargs = dict(compare_kwargs, threads=array['threads'])
+        pairs = [pair for element in array['elements'] for pair in element]
+        with open(array_fpath, 'wb') as f:
+            pickle.dump({'elements': array['elements'], 'output_dir': output_dir, 'log_dir': log_dir,
+                         'compare_kwargs': batch.with_journal(compare_kwargs, journal), 'journal': journal,
+                         'scope': verification_scope(compare_kwargs),
+                         'index_variable': self.index_variable, 'first_index': self.first_index}, f)
+        for bam_path, cram_path in pairs:
+            journal.record_pair(bam_path, cram_path, {'status': SUBMITTED, 'errors': [], 'duration': None})
+        command = ' '.join(shlex.quote(arg) for arg in [sys.executable, '-m', 'checks.executors', array_fpath])
+        submit_command = self.submit_command(job_name, len(array['elements']), jobs, array['threads'], command,
+                                             log_dir or output_dir, array['memory_mb'], array['walltime_minutes'])
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [_PACKAGE_DIR, os.environ.get('PYTHONPATH')])))
+        logging.info("Submitting %s pairs as a job array of %s elements: %s" %
+                     (len(pairs), len(array['elements']), ' '.join(submit_command)))
+        try:
+            process = subprocess.run(submit_command, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                     universal_newlines=True)
+        finally:
+            os.remove(array_fpath)
+        if process.returncode != 0:
+            logging.error("The job array %s exited with %s: %s" % (job_name, process.returncode, process.stdout))
+
+    @staticmethod
+    def _collect_result(bam_path, cram_path, output_dir, journal):
+        recorded = journal.get_pair(bam_path, cram_path)
+        if not recorded or recorded['status'] == SUBMITTED:
+            return {'bam': bam_path, 'cram': cram_path, 'status': 'failed', 'errors':
+                    ["No result recorded for the pair, the job array element verifying it didn't finish"]}
+        result = dict(recorded)
+        try:
+            with open(os.path.join(output_dir, batch.pair_name(bam_path, cram_path) + '.json')) as f:
+                result['telemetry'] = json.load(f).get('telemetry')
+        except (IOError, OSError, ValueError) as e:
+            logging.warning("Can't read the result of %s and %s: %s" % (bam_path, cram_path, e))
+        return result
+
+
+class LSFExecutor(JobArrayExecutor):
+    index_variable = 'LSB_JOBINDEX'
+    first_index = 1
+
+    def submit_command(self, job_name, elements_nr, jobs, threads, command, logs_dir, memory_mb=None,
+                       walltime_minutes=None):
+        memory_mb = memory_mb or self.memory_mb
+        array = '%s[1-%s]%s' % (job_name, elements_nr, '%%%s' % jobs if jobs else '')
+        args = ['bsub', '-K', '-J', array, '-o', os.path.join(logs_dir, job_name + '.%I.out'),
+                '-n', str(threads or 1), '-M', str(memory_mb),
+                '-R', 'span[hosts=1] select[mem>%s] rusage[mem=%s]' % (memory_mb, memory_mb)]
+        if walltime_minutes:
+            args.extend(['-W', str(walltime_minutes)])
+        if self.queue:
+            args.extend(['-q', self.queue])
+        return args + shlex.split(self.submit_options or '') + [command]
+
+
+class SlurmExecutor(JobArrayExecutor):
+    index_variable = 'SLURM_ARRAY_TASK_ID'
+    first_index = 0
+
+    def submit_command(self, job_name, elements_nr, jobs, threads, command, logs_dir, memory_mb=None,
+                       walltime_minutes=None):
+        args = ['sbatch', '--wait', '--job-name=%s' % job_name,
+                '--array=0-%s%s' % (elements_nr - 1, '%%%s' % jobs if jobs else ''),
+                '--output=%s' % os.path.join(logs_dir, job_name + '.%a.out'),
+                '--cpus-per-task=%s' % (threads or 1), '--mem=%sM' % (memory_mb or self.memory_mb)]
+        if walltime_minutes:
+            args.append('--time=%s' % walltime_minutes)
+        if self.queue:
+            args.append('--partition=%s' % self.queue)
+        return args + shlex.split(self.submit_options or '') + ['--wrap=%s' % command]
+
+
+EXECUTORS = {'local': LocalExecutor, 'lsf': LSFExecutor, 'slurm': SlurmExecutor}
+
+
+def run_array_element(array_fpath, index=None):
+    """
+    Verifies the chunk of pairs of an element of a job array submitted by a JobArrayExecutor,
+    one after the other, recording their results in the journal of the array.
+    :param index: the index of the element, counted from 0; by default taken from the environment
+    """
+    with open(array_fpath, 'rb') as f:
+        array = pickle.load(f)
+    if index is None:
+        index = int(os.environ[array['index_variable']]) - array['first_index']
+    lane = array['elements'][index]
+    for i, (bam_path, cram_path) in enumerate(lane):
+        log_fpath = os.path.join(array['log_dir'], batch.pair_name(bam_path, cram_path) + '.log') \
+            if array['log_dir'] else None
+        next_pair = lane[i + 1] if i + 1 < len(lane) else None
+        result = batch.verify_pair(bam_path, cram_path, array['compare_kwargs'], log_fpath, next_pair)
+        batch.write_pair_result(array['output_dir'], result)
+        array['journal'].record_pair(bam_path, cram_path, result, array['scope'])
+        logging.info("%s and %s: %s" % (bam_path, cram_path, result['status']))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(asctime)s %(message)s')
+    run_array_element(sys.argv[1])
@@ -0,0 +1,133 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import json
+import time
+import logging
+
+from checks import cache
+from checks.stats_checks import TIERS
+
+
+def verification_scope(compare_kwargs=None):
+    """
+    :param compare_kwargs: the keyword arguments of CompareStatsForFiles.verify_bam_and_cram the pairs are verified with
+    :return: dict of what is checked with these arguments: the tiers, whether all the sections of the stats are
+             compared and with which tolerances, and whether the digests of the files are computed
+    """
+    compare_kwargs = compare_kwargs or {}
+    all_sections = bool(compare_kwargs.get('all_sections'))
+    return {'tiers': sorted(compare_kwargs.get('tiers') or TIERS), 'all_sections': all_sections,
+            'stats_tolerances': (compare_kwargs.get('stats_tolerances') or {}) if all_sections else {},
+            'digests': bool(compare_kwargs.get('compute_digests'))}
+
+
+def scope_covers(recorded, wanted):
+    """:return: True if a verification with the recorded scope checks at least all that the wanted scope does"""
+    if not recorded or not set(wanted['tiers']) <= set(recorded['tiers']):
+        return False
+    if wanted['digests'] and not recorded['digests']:
+        return False
+    if wanted['all_sections']:
+        if not recorded['all_sections']:
+            return False
+        # A section without tolerance is compared exactly
+        return all(tolerance <= wanted['stats_tolerances'].get(section, 0)
+                   for section, tolerance in recorded['stats_tolerances'].items())
+    return True
+
+
+class VerificationJournal(cache.SQLiteCache):
+    """
+    Durable record of the verification of a batch of pairs, kept in a SQLite database so that an interrupted
+    or partially failed batch can be resumed:
+    - the outcome, errors and duration of each pair, together with the identity of both files,
+      so a pair verified successfully is skipped as long as neither file changed.
+    - the output of each stage (flagstat, stats) completed for each file. The journal is also a StatsCache,
+      so when a pair is run again, the stages completed already are taken from it instead of decoding the files again.
+    """
+    def __init__(self, db_fpath, max_bytes=None, journal_mode=cache.LOCAL_JOURNAL_MODE):
+        super().__init__(db_fpath, max_bytes, journal_mode)
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS stages "
+                         "(key TEXT PRIMARY KEY, fpath TEXT, stage TEXT, finished REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS pairs "
+                         "(bam TEXT, cram TEXT, identity TEXT, outcome TEXT, errors TEXT, duration REAL, finished REAL, "
+                         "tier TEXT, scope TEXT, PRIMARY KEY (bam, cram))")
+            # The journals written before the tiers don't have the tier and the scope of the pairs
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(pairs)")]
+            for column in ('tier', 'scope'):
+                if column not in columns:
+                    conn.execute("ALTER TABLE pairs ADD COLUMN %s TEXT" % column)
+
+    def put_output(self, fpath, args_list, value):
+        key = cache.cache_key(fpath, args_list)
+        if not key or not value:
+            return
+        self.put(key, value)
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO stages (key, fpath, stage, finished) VALUES (?, ?, ?, ?)",
+                         (key, fpath, ' '.join(args_list), time.time()))
+
+    @staticmethod
+    def pair_identity(bam_path, cram_path):
+        """:return: the identity of the content of both files, or None if any of them can't be identified"""
+        try:
+            identity = {'bam': cache.file_identity(bam_path), 'cram': cache.file_identity(cram_path)}
+        except (IOError, OSError) as e:
+            logging.warning("Can't identify the files %s and %s: %s" % (bam_path, cram_path, e))
+            return None
+        return json.dumps(identity, sort_keys=True)
+
+    def record_pair(self, bam_path, cram_path, result, scope=None):
+        """
+        Records the result of a pair, as returned by batch.verify_pair.
+        :param scope: what the pair was verified for, as returned by verification_scope
+        """
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO pairs (bam, cram, identity, outcome, errors, duration, finished, "
+                         "tier, scope) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (bam_path, cram_path, self.pair_identity(bam_path, cram_path), result['status'],
+                          json.dumps(result['errors']), result.get('duration'), time.time(), result.get('tier'),
+                          json.dumps(scope) if scope else None))
+
+    def get_pair(self, bam_path, cram_path):
+        """:return: the last recorded result of the pair, as a dict, or None"""
+        with self._connection() as conn:
+            row = conn.execute("SELECT identity, outcome, errors, duration, tier, scope FROM pairs "
+                               "WHERE bam = ? AND cram = ?", (bam_path, cram_path)).fetchone()
+        if row is None:
+            return None
+        return {'bam': bam_path, 'cram': cram_path, 'identity': row[0], 'status': row[1],
+                'errors': json.loads(row[2]), 'duration': row[3], 'tier': row[4],
+                'scope': json.loads(row[5]) if row[5] else None}
+
+    def is_verified(self, bam_path, cram_path, scope=None):
+        """
+        :param scope: what the pair is to be verified for, as returned by verification_scope, by default everything
+                      verify_bam_and_cram checks with its default arguments
+        :return: True if the pair has passed a verification covering the scope, and none of the files has changed since
+        """
+        recorded = self.get_pair(bam_path, cram_path)
+        if not recorded or recorded['status'] != 'passed' or not recorded['identity']:
+            return False
+        if not scope_covers(recorded['scope'], scope or verification_scope()):
+            return False
+        return recorded['identity'] == self.pair_identity(bam_path, cram_path)
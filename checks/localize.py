@@ -0,0 +1,209 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from checks import utils
+from checks import streaming
+from checks import capabilities
+from checks.stats_checks import RunSamtoolsCommands, HandleSamtoolsStats
+
+# The mismatching regions are split until they are at most this long, before comparing their reads
+DEFAULT_MIN_REGION_SIZE = 10000
+# The number of parts a mismatching region is split into at each step
+DEFAULT_SPLIT_FACTOR = 4
+# The maximum number of differing reads kept for each file of each region
+DEFAULT_MAX_READS = 20
+# The reads of a longer region (e.g. a whole contig, when its parts have the same checksums) are compared
+# in parts of this size, as all the reads of a region being compared are kept in memory
+DEFAULT_MAX_COMPARED_REGION_SIZE = 1000000
+UNMAPPED_REGION = '*'
+
+
+class ReadCollector(streaming.StreamConsumer):
+    """
+    Counts the reads of samtools view output by what the CHK line of samtools stats is computed from
+    (the name, the sequence and the base qualities) together with the flag, keeping one SAM line for each.
+    """
+    def __init__(self):
+        self.counts = Counter()
+        self.lines = {}
+
+    def consume(self, line):
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) < 11:
+            return
+        key = (fields[0], fields[1], fields[9], fields[10])
+        self.counts[key] += 1
+        self.lines.setdefault(key, line.rstrip('\n'))
+
+
+def region_text(region):
+    """:param region: (contig, start, end) tuple, 1-based and inclusive, or UNMAPPED_REGION"""
+    if region == UNMAPPED_REGION:
+        return UNMAPPED_REGION
+    return utils.samtools_region(*region)
+
+
+def split_region(region, parts):
+    """:return: list of up to parts (contig, start, end) tuples covering the region given as parameter"""
+    contig, start, end = region
+    step = max(1, -(-(end - start + 1) // parts))
+    return [(contig, sub_start, min(sub_start + step - 1, end)) for sub_start in range(start, end + 1, step)]
+
+
+def get_contig_regions(bam_path, cram_path):
+    """
+    :return: list of (contig, 1, length) tuples for the contigs of the @SQ lines of the headers of either file
+             (samtools idxstats reading the whole of a CRAM), followed by UNMAPPED_REGION
+    """
+    contigs = {}
+    for fpath in (bam_path, cram_path):
+        for contig, length in HandleSamtoolsStats.get_header_contigs(fpath):
+            contigs[contig] = max(contigs.get(contig, 0), length)
+    return [(contig, 1, length) for contig, length in contigs.items()] + [UNMAPPED_REGION]
+
+
+def get_region_checksum(fpath, region):
+    """
+    :return: the CHK line of samtools stats for the reads starting in the region given as parameter,
+             so that the checksums of adjacent regions add up to that of the region they split
+    """
+    checksum = streaming.ChecksumExtractor()
+    min_pos = region[1] if region != UNMAPPED_REGION and region[1] > 1 else None
+    RunSamtoolsCommands.stream_samtools_stats_output_for_region(fpath, region_text(region), [checksum], min_pos)
+    return checksum.checksum
+
+
+def _find_mismatching_regions(bam_path, cram_path, regions, executor):
+    tasks = [(fpath, region) for region in regions for fpath in (bam_path, cram_path)]
+    checksums = list(executor.map(lambda task: get_region_checksum(*task), tasks))
+    mismatching = []
+    for i, region in enumerate(regions):
+        if checksums[2 * i] != checksums[2 * i + 1]:
+            logging.info("The checksums of %s differ: %s and %s" % (region_text(region), checksums[2 * i],
+                                                                   checksums[2 * i + 1]))
+            mismatching.append(region)
+    return mismatching
+
+
+def compare_reads_of_region(bam_path, cram_path, region, max_reads=DEFAULT_MAX_READS):
+    """
+    Compares the reads of the BAM and the CRAM starting in a (small) region.
+    :return: dict with the region, the number of reads of each file not in the other, and up to max_reads
+             SAM lines of these reads per file
+    """
+    collectors = {}
+    min_pos = region[1] if region[1] > 1 else None
+    for fpath in (bam_path, cram_path):
+        collectors[fpath] = ReadCollector()
+        RunSamtoolsCommands.stream_samtools_view_output_for_region(fpath, region_text(region),
+                                                                   [collectors[fpath]], min_pos)
+    only_in_bam = collectors[bam_path].counts - collectors[cram_path].counts
+    only_in_cram = collectors[cram_path].counts - collectors[bam_path].counts
+    return {'region': region_text(region),
+            'only_in_bam_count': sum(only_in_bam.values()),
+            'only_in_cram_count': sum(only_in_cram.values()),
+            'only_in_bam': [collectors[bam_path].lines[key] for key in list(only_in_bam)[:max_reads]],
+            'only_in_cram': [collectors[cram_path].lines[key] for key in list(only_in_cram)[:max_reads]]}
+
+
+def compare_reads_of_large_region(bam_path, cram_path, region, max_reads=DEFAULT_MAX_READS,
+                                  max_region_size=DEFAULT_MAX_COMPARED_REGION_SIZE, executor=None):
+    """
+    Like compare_reads_of_region, comparing the reads in parts of at most max_region_size bases.
+    :param executor: if given, the parts are compared in its threads
+    :return: list of the dicts returned by compare_reads_of_region for the parts where the reads differ,
+             or only the dict of the first part if they don't differ anywhere
+    """
+    def compare(part):
+        return compare_reads_of_region(bam_path, cram_path, part, max_reads)
+    parts = split_region(region, -(-(region[2] - region[1] + 1) // max_region_size))
+    results = list(executor.map(compare, parts) if executor else map(compare, parts))
+    differences = [result for result in results if result['only_in_bam_count'] or result['only_in_cram_count']]
+    return differences or results[:1]
+
+
+def localize_checksum_differences(bam_path, cram_path, min_region_size=DEFAULT_MIN_REGION_SIZE,
+                                  split_factor=DEFAULT_SPLIT_FACTOR, max_workers=None, max_reads=DEFAULT_MAX_READS,
+                                  max_compared_region_size=DEFAULT_MAX_COMPARED_REGION_SIZE):
+    """
+    Finds where the reads of an indexed BAM and CRAM differ, when the CHK lines of their samtools stats are different.
+    The checksums are computed per contig for both files in parallel, and then only the contigs whose checksums
+    differ are split in split_factor parts, and so on, until the mismatching regions are at most min_region_size
+    long. After the first pass over the contigs, the decoding is proportional to the size of the damaged regions.
+    Finally the reads of each of these regions are compared.
+    The unmapped reads without coordinates can't be split, so if their checksums differ,
+    it's only reported (without comparing the reads).
+    The reads are assigned to the region they start in with samtools view -e, so this needs samtools >= 1.12.
+    :param max_workers: the maximum number of samtools processes running at the same time (default: the number of CPUs)
+    :param max_compared_region_size: the regions whose parts have the same checksums are compared in parts of this size
+    :return: list of dicts, one for each mismatching region, as returned by compare_reads_of_region,
+             with None for the read counts and empty lists for the reads of the unmapped region
+    """
+    for fpath in (bam_path, cram_path):
+        if utils.is_irods_path(fpath) or not os.path.isfile(fpath) or not utils.find_index_file(fpath):
+            raise ValueError("Can't localize the differences of a file that isn't local and indexed: %s" % fpath)
+    if not capabilities.supports_option('view', '-e'):
+        raise ValueError("Can't localize the differences with this samtools: splitting the regions needs "
+                         "samtools view -e (samtools >= 1.12)")
+    differences = []
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        regions = _find_mismatching_regions(bam_path, cram_path, get_contig_regions(bam_path, cram_path), executor)
+        while regions:
+            small_regions, regions_to_split = [], []
+            for region in regions:
+                if region == UNMAPPED_REGION:
+                    differences.append({'region': UNMAPPED_REGION, 'only_in_bam_count': None,
+                                        'only_in_cram_count': None, 'only_in_bam': [], 'only_in_cram': []})
+                elif region[2] - region[1] + 1 <= min_region_size:
+                    small_regions.append(region)
+                else:
+                    regions_to_split.append(region)
+            for region_differences in executor.map(
+                    lambda region: compare_reads_of_large_region(bam_path, cram_path, region, max_reads,
+                                                                 max_compared_region_size), small_regions):
+                differences.extend(region_differences)
+            subregions = {region: split_region(region, split_factor) for region in regions_to_split}
+            regions = _find_mismatching_regions(bam_path, cram_path, [subregion for parts in subregions.values()
+                                                                      for subregion in parts], executor)
+            # The differences of a region could cancel out in the sums of its parts:
+            for region, parts in subregions.items():
+                if not set(parts) & set(regions):
+                    differences.extend(compare_reads_of_large_region(bam_path, cram_path, region, max_reads,
+                                                                     max_compared_region_size, executor))
+    return differences
+
+
+def format_differences(differences):
+    """:return: list of error lines describing the differences found by localize_checksum_differences"""
+    errors = []
+    for difference in differences:
+        if difference['only_in_bam_count'] is None:
+            errors.append("STATS SEQUENCE CHECKSUM DIFFERENT for the unmapped reads without coordinates")
+            continue
+        errors.append("STATS SEQUENCE CHECKSUM DIFFERENT in %s: %s reads only in the BAM and %s only in the CRAM" %
+                      (difference['region'], difference['only_in_bam_count'], difference['only_in_cram_count']))
+        errors.extend("BAM only: %s" % line for line in difference['only_in_bam'])
+        errors.extend("CRAM only: %s" % line for line in difference['only_in_cram'])
+    return errors
@@ -0,0 +1,165 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import gzip
+import json
+import hashlib
+import logging
+import tempfile
+
+REF_CACHE_ENV_VAR = 'BAM2CRAM_REF_CACHE'
+DEFAULT_REF_CACHE_DIR = os.path.join('~', '.cache', 'bam2cram-check', 'ref_cache')
+# The layout of the REF_CACHE of htslib: the first two characters of the MD5, the next two, then the rest
+REF_CACHE_LAYOUT = '%2s/%2s/%s'
+# Characters that aren't part of the sequence when computing its MD5, as in the SAM spec (the M5 tag of @SQ)
+_NON_SEQUENCE_BYTES = bytes(range(33)) + bytes(range(127, 256))
+
+
+def default_ref_cache_dir():
+    """The reference cache directory given in the BAM2CRAM_REF_CACHE environment variable, if set, otherwise the
+    DEFAULT_REF_CACHE_DIR in the home directory."""
+    return os.path.expanduser(os.environ.get(REF_CACHE_ENV_VAR) or DEFAULT_REF_CACHE_DIR)
+
+
+def ref_cache_path(cache_dir, md5):
+    """:return: the path of the sequence with the MD5 given as parameter, in the REF_CACHE layout"""
+    return os.path.join(cache_dir, md5[:2], md5[2:4], md5[4:])
+
+
+def _open_fasta(fasta_fpath):
+    if fasta_fpath.endswith('.gz'):
+        return gzip.open(fasta_fpath, 'rb')
+    return open(fasta_fpath, 'rb')
+
+
+def _index_fpath(cache_dir, fasta_fpath):
+    """The file listing the sequences already added to the cache from this FASTA, as it is now."""
+    fasta_stat = os.stat(fasta_fpath)
+    key = '%s:%s:%s' % (os.path.abspath(fasta_fpath), fasta_stat.st_mtime_ns, fasta_stat.st_size)
+    return os.path.join(cache_dir, 'fasta', hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+
+def _read_index(index_fpath, cache_dir):
+    try:
+        with open(index_fpath) as f:
+            sequences = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if all(os.path.isfile(ref_cache_path(cache_dir, md5)) for md5 in sequences.values()):
+        return sequences
+    return None
+
+
+def _add_sequences(fasta_fpath, cache_dir):
+    """
+    Reads the FASTA line by line, writing each sequence upper case and without line breaks
+    in the cache, under its MD5. The sequences already in the cache are left as they are.
+    :return: dict of sequence name -> MD5
+    """
+    sequences = {}
+    name, md5, tmp_f = None, None, None
+
+    def finish_sequence():
+        tmp_f.close()
+        digest = md5.hexdigest()
+        fpath = ref_cache_path(cache_dir, digest)
+        if os.path.isfile(fpath):
+            os.remove(tmp_f.name)
+        else:
+            os.makedirs(os.path.dirname(fpath), exist_ok=True)
+            os.replace(tmp_f.name, fpath)
+        sequences[name] = digest
+
+    with _open_fasta(fasta_fpath) as fasta:
+        try:
+            for line in fasta:
+                if line.startswith(b'>'):
+                    if tmp_f:
+                        finish_sequence()
+                    tokens = line[1:].split(None, 1)
+                    name = tokens[0].decode() if tokens else ''
+                    md5 = hashlib.md5()
+                    tmp_f = tempfile.NamedTemporaryFile(dir=cache_dir, prefix='.tmp', delete=False)
+                elif tmp_f:
+                    bases = line.translate(None, _NON_SEQUENCE_BYTES).upper()
+                    md5.update(bases)
+                    tmp_f.write(bases)
+            if tmp_f:
+                finish_sequence()
+                tmp_f = None
+        finally:
+            if tmp_f and not tmp_f.closed:
+                tmp_f.close()
+                os.remove(tmp_f.name)
+    return sequences
+
+
+def populate_ref_cache(fasta_fpath, cache_dir):
+    """
+    Adds the sequences of a FASTA file (optionally gzipped) to a reference cache in the REF_CACHE layout
+    of htslib, keyed by their MD5, which is what the M5 tags of the @SQ lines of a CRAM header refer to.
+    The FASTA is read only the first time: the sequences it has are recorded in the cache, and it's read again
+    only if it changes or if some of its sequences have been removed from the cache.
+    :param fasta_fpath: the path to the FASTA file
+    :param cache_dir: the directory of the reference cache
+    :return: dict of sequence name -> MD5
+    """
+    os.makedirs(os.path.join(cache_dir, 'fasta'), exist_ok=True)
+    index_fpath = _index_fpath(cache_dir, fasta_fpath)
+    sequences = _read_index(index_fpath, cache_dir)
+    if sequences is not None:
+        logging.info("The sequences of %s are already in the reference cache %s" % (fasta_fpath, cache_dir))
+        return sequences
+    logging.info("Adding the sequences of %s to the reference cache %s" % (fasta_fpath, cache_dir))
+    sequences = _add_sequences(fasta_fpath, cache_dir)
+    with tempfile.NamedTemporaryFile('w', dir=cache_dir, prefix='.tmp', delete=False) as index_f:
+        json.dump(sequences, index_f)
+    os.replace(index_f.name, index_fpath)
+    return sequences
+
+
+def use_ref_cache(cache_dir):
+    """
+    Sets up the environment of this process, and so of every samtools process it starts, to look up the references
+    of CRAM files only in the cache given as parameter (REF_PATH and REF_CACHE), so that decoding a CRAM never waits
+    on downloading a reference, and fails straight away if its reference isn't in the cache.
+    """
+    layout = os.path.join(os.path.abspath(cache_dir), REF_CACHE_LAYOUT)
+    os.environ['REF_PATH'] = layout
+    os.environ['REF_CACHE'] = layout
+
+
+def extract_reference_md5s(header):
+    """:return: dict of sequence name -> MD5 (the M5 tag) of the @SQ lines of a SAM header which have one"""
+    md5s = {}
+    for line in header.split('\n'):
+        if not line.startswith('@SQ'):
+            continue
+        tags = dict(token.split(':', 1) for token in line.split('\t')[1:] if ':' in token)
+        if 'M5' in tags:
+            md5s[tags.get('SN')] = tags['M5'].lower()
+    return md5s
+
+
+def missing_references(header, cache_dir):
+    """:return: list of the names of the sequences of a SAM header whose M5 isn't in the reference cache"""
+    return [name for name, md5 in extract_reference_md5s(header).items()
+            if not os.path.isfile(ref_cache_path(cache_dir, md5))]
@@ -0,0 +1,206 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import math
+import heapq
+import sqlite3
+import threading
+import time
+
+from checks import utils
+
+# The stages whose usage is modelled, against the size and the format of the file
+MODELLED_STAGES = ('quickcheck', 'flagstat', 'stats')
+# The number of observations of a stage, for a format, needed before predicting its usage,
+# and the number of the most recent ones the model is fitted to
+MIN_OBSERVATIONS = 3
+MAX_OBSERVATIONS = 1000
+
+# Memory of the Python process verifying the pair, buffers of the streamed files included
+PROCESS_MEMORY_MB = 200
+MIN_MEMORY_MB = 500
+# The memory requests are rounded up to multiples of this, which also makes the classes of pairs
+# submitted as the same job array
+MEMORY_STEP_MB = 1000
+MEMORY_MARGIN = 1.25
+WALLTIME_MARGIN = 1.5
+
+# The small pairs are packed in the same job array element, until it runs for this long
+DEFAULT_ELEMENT_MINUTES = 30
+
+
+def file_format(fpath):
+    """:return: the format of the file, from its extension: bam, cram..."""
+    return os.path.splitext(fpath)[1].lstrip('.').lower()
+
+
+def fit_linear(points):
+    """
+    Least squares fit of y = intercept + slope * x to the points, the slope being at least 0.
+    :param points: list of (x, y) tuples
+    :return: (intercept, slope, max_residual) tuple, max_residual being the most a point is above the line
+    """
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    variance_x = sum((x - mean_x) ** 2 for x, _ in points)
+    covariance = sum((x - mean_x) * (y - mean_y) for x, y in points)
+    slope = max(0.0, covariance / variance_x) if variance_x else 0.0
+    intercept = mean_y - slope * mean_x
+    max_residual = max(y - intercept - slope * x for x, y in points)
+    return intercept, slope, max(0.0, max_residual)
+
+
+def predict_linear(model, x):
+    """:return: the upper bound predicted by a model from fit_linear for x"""
+    intercept, slope, max_residual = model
+    return max(0.0, intercept + slope * x + max_residual)
+
+
+class ResourceHistory:
+    """
+    History of the usage of the stages of the verifications (duration, CPU time and peak memory of the samtools
+    processes) against the size and the format of the files, kept in a SQLite database.
+    A linear model per stage and format, fitted to the history, predicts the resources a pair needs.
+    """
+    def __init__(self, db_fpath):
+        self.db_fpath = db_fpath
+        self._local = threading.local()
+        self._models = {}
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS observations "
+                         "(stage TEXT, format TEXT, size INTEGER, duration REAL, cpu_seconds REAL, max_rss_mb REAL, "
+                         "recorded REAL)")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_fpath, timeout=60)
+            self._local.conn = conn
+        return conn
+
+    def record(self, telemetry):
+        """
+        Records the usage of the modelled stages of a verification which ran samtools on a local file.
+        :param telemetry: the telemetry of the verification, as returned by telemetry.Telemetry.as_dict
+        """
+        rows = []
+        for record in telemetry.get('stages', []):
+            if record['stage'] not in MODELLED_STAGES or not record['processes'] or \
+                    utils.is_irods_path(record['file']):
+                continue
+            try:
+                size = os.path.getsize(record['file'])
+            except OSError:
+                continue
+            cpu_seconds = sum(proc['user_cpu'] + proc['system_cpu'] for proc in record['processes'])
+            max_rss_mb = max(proc['max_rss_mb'] for proc in record['processes'])
+            rows.append((record['stage'], file_format(record['file']), size, record['duration'], cpu_seconds,
+                         max_rss_mb, time.time()))
+        if rows:
+            with self._connection() as conn:
+                conn.executemany("INSERT INTO observations VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self._models.clear()
+
+    def observations(self, stage, fmt):
+        """:return: the most recent observations of a stage for a format, as (size, duration, cpu, rss) tuples"""
+        with self._connection() as conn:
+            return conn.execute("SELECT size, duration, cpu_seconds, max_rss_mb FROM observations "
+                                "WHERE stage = ? AND format = ? ORDER BY recorded DESC LIMIT ?",
+                                (stage, fmt, MAX_OBSERVATIONS)).fetchall()
+
+    def model(self, stage, fmt):
+        """:return: the (duration, cpu_seconds, max_rss_mb) models of a stage for a format, None if not enough
+        observations"""
+        if (stage, fmt) not in self._models:
+            observations = self.observations(stage, fmt)
+            if len(observations) < MIN_OBSERVATIONS:
+                self._models[(stage, fmt)] = None
+            else:
+                self._models[(stage, fmt)] = tuple(fit_linear([(row[0], row[i]) for row in observations])
+                                                   for i in (1, 2, 3))
+        return self._models[(stage, fmt)]
+
+    def predict_pair(self, bam_path, cram_path, max_threads=None):
+        """
+        Predicts the resources for verifying a pair. The stages of both files are assumed to run
+        at the same time, and those of a file one after the other: the memory of a file is that of its most
+        demanding stage, and the memory of the pair the sum of those of both files.
+        :param max_threads: the most threads requested
+        :return: dict with the memory_mb, threads and walltime_minutes of the pair, or None when the sizes
+                 of the files are unknown or the history doesn't have the stats stage of their formats
+        """
+        memory_mb, cpu_seconds, seconds = PROCESS_MEMORY_MB, 0.0, 0.0
+        for fpath in (bam_path, cram_path):
+            if utils.is_irods_path(fpath):
+                return None
+            try:
+                size = os.path.getsize(fpath)
+            except OSError:
+                return None
+            fmt = file_format(fpath)
+            if self.model('stats', fmt) is None:
+                return None
+            file_seconds, file_memory_mb = 0.0, 0.0
+            for stage in MODELLED_STAGES:
+                model = self.model(stage, fmt)
+                if model is None:
+                    continue
+                duration_model, cpu_model, rss_model = model
+                file_seconds += predict_linear(duration_model, size)
+                cpu_seconds += predict_linear(cpu_model, size)
+                file_memory_mb = max(file_memory_mb, predict_linear(rss_model, size))
+            seconds = max(seconds, file_seconds)
+            memory_mb += file_memory_mb
+        threads = max(1, math.ceil(cpu_seconds / seconds)) if seconds else 1
+        return {'memory_mb': max(MIN_MEMORY_MB, int(math.ceil(memory_mb * MEMORY_MARGIN))),
+                'threads': min(threads, max_threads) if max_threads else threads,
+                'walltime_minutes': max(1, int(math.ceil(seconds * WALLTIME_MARGIN / 60)))}
+
+
+def pack_pairs(predictions, max_minutes=DEFAULT_ELEMENT_MINUTES):
+    """
+    Groups the pairs by the memory and threads they need, then packs the pairs of each group in job array elements:
+    the longest pairs first, each in the element with the least work, as long as it stays within max_minutes,
+    otherwise in a new element.
+    :param predictions: dict of (bam_path, cram_path) tuple -> resources, as returned by predict_pair
+    :return: list of dicts, one per job array, with the memory_mb, threads and walltime_minutes of its elements
+             and the elements, as lists of pairs
+    """
+    groups = {}
+    for pair, prediction in predictions.items():
+        memory_mb = int(math.ceil(prediction['memory_mb'] / MEMORY_STEP_MB)) * MEMORY_STEP_MB
+        groups.setdefault((memory_mb, prediction['threads']), []).append(pair)
+    arrays = []
+    for (memory_mb, threads), pairs in sorted(groups.items()):
+        elements = []
+        heap = []
+        for pair in sorted(pairs, key=lambda pair: -predictions[pair]['walltime_minutes']):
+            minutes = predictions[pair]['walltime_minutes']
+            if heap and heap[0][0] + minutes <= max_minutes:
+                element_minutes, i = heapq.heappop(heap)
+            else:
+                element_minutes, i = 0, len(elements)
+                elements.append([])
+            elements[i].append(pair)
+            heapq.heappush(heap, (element_minutes + minutes, i))
+        arrays.append({'memory_mb': memory_mb, 'threads': threads,
+                       'walltime_minutes': max(minutes for minutes, _ in heap), 'elements': elements})
+    return arrays
@@ -0,0 +1,220 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import time
+import zlib
+import queue
+import shlex
+import hashlib
+import logging
+import threading
+import subprocess
+from contextlib import ExitStack
+
+from checks import utils
+from checks import cancellation as pair_cancellation
+from checks import telemetry
+
+# The command writing a file to its stdout, {path} being replaced by the path of the file (without irods:)
+DEFAULT_FETCH_COMMAND = 'iget {path} -'
+FETCH_COMMAND_ENV_VAR = 'BAM2CRAM_FETCH_COMMAND'
+# The command streaming a local file, for reading it only once while computing its digests
+LOCAL_FETCH_COMMAND = 'cat {path}'
+
+# At most MAX_BUFFERED_CHUNKS chunks of CHUNK_SIZE bytes are read ahead of the consumers of a stream
+CHUNK_SIZE = 1024 * 1024
+MAX_BUFFERED_CHUNKS = 64
+
+
+def fetch_command_args(fpath, fetch_command=None):
+    """
+    :param fetch_command: the command template, by default the one in the BAM2CRAM_FETCH_COMMAND environment
+                          variable, if set, otherwise DEFAULT_FETCH_COMMAND
+    :return: the args list of the command fetching the file given as parameter
+    """
+    template = fetch_command or os.environ.get(FETCH_COMMAND_ENV_VAR) or DEFAULT_FETCH_COMMAND
+    path = fpath[len('irods:'):] if utils.is_irods_path(fpath) else fpath
+    return [token.replace('{path}', path) for token in shlex.split(template)]
+
+
+class StreamedInput:
+    """
+    Streams a file that isn't on a local filesystem (e.g. an iRODS object) from the stdout of a fetch command
+    to the stdin of one or more processes, so that the file is transferred only once and never staged on disk.
+    The fetch command can be started before the consumers are known (prefetching): it then reads ahead only
+    up to max_buffered_chunks chunks, and waits for the consumers to catch up.
+    The consumers all get the whole stream, so the slowest of them sets the pace of the transfer.
+    If compute_digests is set before start, the MD5, the CRC32 and the size of the file are computed
+    on the chunks as they are handed over.
+    """
+    def __init__(self, fpath, fetch_command=None, chunk_size=CHUNK_SIZE, max_buffered_chunks=MAX_BUFFERED_CHUNKS,
+                 compute_digests=False):
+        self.fpath = fpath
+        self.args_list = fetch_command_args(fpath, fetch_command)
+        self.chunk_size = chunk_size
+        self.compute_digests = compute_digests
+        self._md5 = hashlib.md5()
+        self._crc32 = 0
+        self._size = 0
+        self._chunks = queue.Queue(maxsize=max_buffered_chunks)
+        self._sinks = []
+        self._proc = None
+        self._threads = []
+        self._stderr_chunks = []
+        self._exit_stack = ExitStack()
+        self._cancellation = None
+
+    def _start_thread(self, target):
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def start_fetching(self):
+        """Starts the fetch command, if not started already."""
+        if self._proc:
+            return
+        logging.info("Fetching %s with: %s" % (self.fpath, self.args_list))
+        self._started = time.monotonic()
+        self._proc = subprocess.Popen(self.args_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self._start_thread(self._read_chunks)
+        self._start_thread(lambda: self._stderr_chunks.append(self._proc.stderr.read()))
+
+    def _read_chunks(self):
+        try:
+            while True:
+                chunk = self._proc.stdout.read(self.chunk_size)
+                if not chunk:
+                    break
+                self._chunks.put(chunk)
+        finally:
+            self._chunks.put(None)
+
+    def open_sink(self):
+        """
+        Adds a consumer of the stream. It needs to be called before start.
+        :return: file object to be given as stdin to the process consuming the stream
+        """
+        read_fd, write_fd = os.pipe()
+        self._sinks.append(os.fdopen(write_fd, 'wb'))
+        return os.fdopen(read_fd, 'rb')
+
+    def start(self, cancellation=None):
+        """
+        Starts handing the stream over to the consumers.
+        :param cancellation: cancellation.Cancellation terminating the fetch command when set
+        """
+        self.start_fetching()
+        self._cancellation = cancellation
+        self._exit_stack.enter_context(pair_cancellation.registered(cancellation, self._proc))
+        self._start_thread(self._distribute_chunks)
+
+    @staticmethod
+    def _close_sink(sink):
+        try:
+            sink.close()
+        except OSError:
+            pass
+
+    def _distribute_chunks(self):
+        sinks = list(self._sinks)
+        while True:
+            chunk = self._chunks.get()
+            if chunk is None:
+                break
+            if self.compute_digests:
+                self._md5.update(chunk)
+                self._crc32 = zlib.crc32(chunk, self._crc32)
+                self._size += len(chunk)
+            for sink in list(sinks):
+                try:
+                    sink.write(chunk)
+                except OSError:
+                    # The consumer has exited, its own exit code tells why:
+                    sinks.remove(sink)
+                    self._close_sink(sink)
+        for sink in sinks:
+            self._close_sink(sink)
+
+    def _wait_for_fetch_command(self):
+        for thread in self._threads:
+            thread.join()
+        self._proc.stdout.close()
+        self._proc.stderr.close()
+        returncode = telemetry.wait(self._proc, self._started)
+        self._exit_stack.close()
+        return b''.join(self._stderr_chunks).decode(errors='replace'), returncode
+
+    def wait(self):
+        """Waits until the whole file has been handed over to the consumers, raising RuntimeError if the fetch failed."""
+        stderr, returncode = self._wait_for_fetch_command()
+        utils.log_error(self.args_list, stderr, returncode)
+        watchdog_error = pair_cancellation.watchdog_error(self._cancellation, self._proc)
+        if watchdog_error:
+            raise RuntimeError(watchdog_error)
+        if stderr or returncode != 0:
+            raise RuntimeError("ERROR running process: %s, error = %s and exit code = %s" %
+                               (self.args_list, stderr, returncode))
+
+    def digests(self):
+        """:return: dict with the md5 and the crc32 (as hex strings) and the size of the file, once it's streamed"""
+        return {'md5': self._md5.hexdigest(), 'crc32': '%08x' % self._crc32, 'size': self._size}
+
+    def discard(self):
+        """Stops the fetch command of a stream which won't be consumed."""
+        if not self._proc:
+            return
+        self._proc.kill()
+        while self._chunks.get() is not None:
+            pass
+        for sink in self._sinks:
+            self._close_sink(sink)
+        self._wait_for_fetch_command()
+
+
+_prefetched = {}
+_prefetched_lock = threading.Lock()
+
+
+def prefetch(fpath, fetch_command=None):
+    """Starts fetching a file which will be needed soon, e.g. one of the next pair to be verified by this process."""
+    with _prefetched_lock:
+        if fpath in _prefetched:
+            return
+        streamed_input = StreamedInput(fpath, fetch_command)
+        streamed_input.start_fetching()
+        _prefetched[fpath] = streamed_input
+
+
+def open_input(fpath, fetch_command=None, compute_digests=False):
+    """:return: a StreamedInput for the file, the prefetched one if there is one"""
+    with _prefetched_lock:
+        streamed_input = _prefetched.pop(fpath, None)
+    streamed_input = streamed_input or StreamedInput(fpath, fetch_command)
+    streamed_input.compute_digests = compute_digests
+    return streamed_input
+
+
+def discard_prefetched(keep=()):
+    """Stops the prefetched streams which haven't been used, except for the files in keep."""
+    with _prefetched_lock:
+        discarded = [_prefetched.pop(fpath) for fpath in list(_prefetched) if fpath not in keep]
+    for streamed_input in discarded:
+        streamed_input.discard()
@@ -1,31 +1,248 @@
 import os
+import gzip
+import json
 import subprocess
 import logging
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from checks import utils
-import sys
+from checks import streaming
+from checks import threads as samtools_threads
+from checks import capabilities
+from checks import cancellation as pair_cancellation
+from checks import sources
+from checks import telemetry as stage_telemetry
+from checks import stats_model
+from checks import watchdog
+
+# The SN fields of samtools stats that hold the same counters as samtools flagstat does.
+# "supplementary alignments" is only output by newer versions of samtools.
+FLAGSTAT_EQUIVALENT_SN_FIELDS = ['raw total sequences', 'reads QC failed', 'non-primary alignments',
+                                 'supplementary alignments', 'reads duplicated', 'reads mapped',
+                                 'reads unmapped', 'reads paired', '1st fragments', 'last fragments',
+                                 'reads properly paired', 'reads mapped and paired',
+                                 'pairs on different chromosomes']
+
+# The SN fields of samtools stats that are counts, and so can be summed over disjoint sets of reads.
+ADDITIVE_SN_FIELDS = set(FLAGSTAT_EQUIVALENT_SN_FIELDS) | {'filtered sequences', 'sequences', 'reads MQ0',
+                                                          'total length', 'total first fragment length',
+                                                          'total last fragment length', 'bases mapped',
+                                                          'bases mapped (cigar)', 'bases trimmed',
+                                                          'bases duplicated', 'mismatches', 'inward oriented pairs',
+                                                          'outward oriented pairs', 'pairs with other orientation'}
+
+# The threads of the samtools view | samtools stats pipeline of a shard, which has a process for each
+SHARD_PIPELINE_THREADS = 2
+
+# The verification tiers, from the cheapest to the most expensive:
+# header - compares the @SQ and @RG lines of the headers
+# index - compares the mapped and unmapped counts per contig, taken from the indexes (samtools idxstats)
+# full - compares quickcheck, flagstat and the stats checksums, decoding the files
+TIER_HEADER = 'header'
+TIER_INDEX = 'index'
+TIER_FULL = 'full'
+TIERS = [TIER_HEADER, TIER_INDEX, TIER_FULL]
+
 
 class RunSamtoolsCommands:
     @classmethod
-    def _run_subprocess(cls, args_list):
-        proc = subprocess.run(args_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-        utils.log_error(args_list, proc.stderr, proc.returncode)
-        if proc.stderr or proc.returncode != 0:
-            raise RuntimeError("ERROR running process: %s, error = %s and exit code = %s" % (args_list, proc.stderr, proc.returncode))
-        return proc.stdout
+    def _run_subprocess(cls, args_list, cancellation=None, stdin=None):
+        """
+        :param cancellation: cancellation.Cancellation terminating the process when set
+        :param stdin: optional file object to be used as the stdin of the process, closed once the process has started
+        """
+        if cancellation is None and stdin is None and stage_telemetry.current_stage() is None:
+            proc = subprocess.run(args_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            stdout, stderr, returncode = proc.stdout, proc.stderr, proc.returncode
+        else:
+            started = time.monotonic()
+            proc = subprocess.Popen(args_list, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    universal_newlines=True,
+                                    start_new_session=pair_cancellation.own_session(cancellation))
+            if stdin is not None:
+                stdin.close()
+            with pair_cancellation.registered(cancellation, proc):
+                stderr_chunks = []
+                stderr_reader = threading.Thread(target=lambda: stderr_chunks.append(proc.stderr.read()))
+                stderr_reader.start()
+                try:
+                    stdout = proc.stdout.read()
+                finally:
+                    stderr_reader.join()
+                    proc.stdout.close()
+                    proc.stderr.close()
+                    returncode = stage_telemetry.wait(proc, started)
+                stderr = ''.join(stderr_chunks)
+        utils.log_error(args_list, stderr, returncode)
+        watchdog_error = pair_cancellation.watchdog_error(cancellation, proc)
+        if watchdog_error:
+            raise RuntimeError(watchdog_error)
+        if stderr or returncode != 0:
+            raise RuntimeError("ERROR running process: %s, error = %s and exit code = %s" % (args_list, stderr, returncode))
+        return stdout
+
+    @classmethod
+    def _stream_subprocess(cls, args_list, consumers, stdin=None, finish_consumers=True, cancellation=None,
+                           chunk_size=None):
+        """
+        Runs a process and hands its stdout, line by line, to the consumers given as parameter,
+        without keeping the whole output in memory. stderr is drained at the same time by another thread,
+        so that a process writing a lot to stderr can't block on a full pipe.
+        :param args_list: the command to run
+        :param consumers: list of streaming.StreamConsumer
+        :param stdin: optional file object (e.g. the stdout of another process) to be used as the stdin of the process.
+                      It is closed once the process has started, so that the writer gets a broken pipe
+                      if the process exits before reading everything.
+        :param finish_consumers: if False, finishing the consumers is left to the caller
+        :param cancellation: cancellation.Cancellation terminating the process when set
+        :param chunk_size: if given, the output is read as bytes and handed to the consumers in chunks of this size,
+                           instead of line by line
+        """
+        started = time.monotonic()
+        proc = subprocess.Popen(args_list, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                universal_newlines=not chunk_size,
+                                start_new_session=pair_cancellation.own_session(cancellation))
+        if stdin is not None:
+            stdin.close()
+        stderr_chunks = []
+        stderr_reader = threading.Thread(target=lambda: stderr_chunks.append(proc.stderr.read()))
+        stderr_reader.start()
+        with pair_cancellation.registered(cancellation, proc):
+            try:
+                if chunk_size:
+                    streaming.feed_chunks(proc.stdout, consumers, chunk_size)
+                else:
+                    streaming.feed_lines(proc.stdout, consumers)
+            except BaseException:
+                proc.kill()
+                for consumer in consumers:
+                    consumer.abort()
+                raise
+            finally:
+                proc.stdout.close()
+                stderr_reader.join()
+                proc.stderr.close()
+                returncode = stage_telemetry.wait(proc, started)
+                stderr = b''.join(stderr_chunks).decode(errors='replace') if chunk_size else ''.join(stderr_chunks)
+        if stderr or returncode != 0:
+            for consumer in consumers:
+                consumer.abort()
+        utils.log_error(args_list, stderr, returncode)
+        watchdog_error = pair_cancellation.watchdog_error(cancellation, proc)
+        if watchdog_error:
+            raise RuntimeError(watchdog_error)
+        if stderr or returncode != 0:
+            raise RuntimeError("ERROR running process: %s, error = %s and exit code = %s" % (args_list, stderr, returncode))
+        if finish_consumers:
+            for consumer in consumers:
+                consumer.finish()
+
+    @classmethod
+    def _stream_pipeline(cls, upstream_args_list, args_list, consumers, cancellation=None):
+        """
+        Runs upstream_args_list | args_list, streaming the output of the last process to the consumers.
+        Both processes need to exit cleanly for the output to be considered valid.
+        """
+        started = time.monotonic()
+        upstream = subprocess.Popen(upstream_args_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    start_new_session=pair_cancellation.own_session(cancellation))
+        upstream_stderr = []
+        stderr_reader = threading.Thread(target=lambda: upstream_stderr.append(upstream.stderr.read()))
+        stderr_reader.start()
+        with pair_cancellation.registered(cancellation, upstream):
+            try:
+                cls._stream_subprocess(args_list, consumers, stdin=upstream.stdout, finish_consumers=False,
+                                       cancellation=cancellation)
+            except BaseException:
+                upstream.kill()
+                raise
+            finally:
+                upstream.stdout.close()
+                stderr_reader.join()
+                upstream.stderr.close()
+                returncode = stage_telemetry.wait(upstream, started)
+        stderr = b''.join(upstream_stderr).decode(errors='replace')
+        utils.log_error(upstream_args_list, stderr, returncode)
+        watchdog_error = pair_cancellation.watchdog_error(cancellation, upstream)
+        if stderr or returncode != 0:
+            for consumer in consumers:
+                consumer.abort()
+            if watchdog_error:
+                raise RuntimeError(watchdog_error)
+            raise RuntimeError("ERROR running process: %s, error = %s and exit code = %s" %
+                               (upstream_args_list, stderr, returncode))
+        for consumer in consumers:
+            consumer.finish()
+
+    @classmethod
+    def run_samtools_quickcheck(cls, fpath, cancellation=None):
+        return cls._run_subprocess(['samtools', 'quickcheck', '-v', fpath], cancellation)
+
+    @classmethod
+    def get_samtools_flagstat_output(cls, fpath, threads=None, cancellation=None, stdin=None):
+        """
+        :param threads: the total number of threads samtools may use, None for not setting it
+        :param cancellation: cancellation.Cancellation terminating samtools when set
+        :param stdin: the file object to read the data from, when fpath is '-'
+        """
+        threads_args = samtools_threads.samtools_threads_args(threads, 'flagstat')
+        return cls._run_subprocess(['samtools', 'flagstat'] + threads_args + [fpath], cancellation, stdin)
+
+    @classmethod
+    def stream_samtools_stats_output(cls, fpath, consumers, threads=None, cancellation=None, stdin=None):
+        threads_args = samtools_threads.samtools_threads_args(threads, 'stats')
+        return cls._stream_subprocess(['samtools', 'stats'] + threads_args + [fpath], consumers, stdin=stdin,
+                                      cancellation=cancellation)
 
     @classmethod
-    def run_samtools_quickcheck(cls, fpath):
-        return cls._run_subprocess(['samtools', 'quickcheck', '-v', fpath])
+    def stream_samtools_stats_output_for_region(cls, fpath, region, consumers, min_pos=None, threads=None,
+                                                cancellation=None):
+        """
+        Runs samtools stats on the reads of a region of an indexed file.
+        :param region: a region in samtools format, or '*' for the unmapped reads without coordinates
+        :param min_pos: if given, only the reads starting at or after this (1-based) position are kept,
+                        so that a read overlapping two adjacent chunks is counted only once
+        :param threads: the number of threads of the pipeline: samtools stats (reading the region uncompressed)
+                        takes one of them and samtools view decodes the region with the others
+        """
+        view_threads = threads - 1 if threads else None
+        view_args = ['samtools', 'view', '-u'] + samtools_threads.samtools_threads_args(view_threads, 'view')
+        if min_pos:
+            view_args.extend(['-e', 'pos >= %s' % min_pos])
+        view_args.extend([fpath, region])
+        return cls._stream_pipeline(view_args, ['samtools', 'stats', '-'], consumers, cancellation)
 
     @classmethod
-    def get_samtools_flagstat_output(cls, fpath):
-        return cls._run_subprocess(['samtools', 'flagstat', fpath])
+    def stream_samtools_view_output_for_region(cls, fpath, region, consumers, min_pos=None, cancellation=None):
+        """
+        Streams the reads of a region of an indexed file, as SAM lines without the header.
+        :param min_pos: if given, only the reads starting at or after this (1-based) position are kept
+        """
+        view_args = ['samtools', 'view']
+        if min_pos:
+            view_args.extend(['-e', 'pos >= %s' % min_pos])
+        view_args.extend([fpath, region])
+        return cls._stream_subprocess(view_args, consumers, cancellation=cancellation)
 
     @classmethod
-    def get_samtools_stats_output(cls, fpath):
-        return cls._run_subprocess(['samtools', 'stats', fpath])
+    def stream_samtools_view_output(cls, fpath, consumers, chunk_size, threads=None, cancellation=None):
+        """
+        Streams all the reads of a file as SAM, without the header, in chunks of bytes.
+        :param chunk_size: the size of the chunks handed to the consumers, which get the lines split across chunks
+        """
+        view_args = ['samtools', 'view'] + samtools_threads.samtools_threads_args(threads, 'view') + [fpath]
+        return cls._stream_subprocess(view_args, consumers, cancellation=cancellation, chunk_size=chunk_size)
+
+    @classmethod
+    def get_samtools_idxstats_output(cls, fpath, cancellation=None):
+        return cls._run_subprocess(['samtools', 'idxstats', fpath], cancellation)
+
+    @classmethod
+    def get_samtools_header_output(cls, fpath, cancellation=None):
+        return cls._run_subprocess(['samtools', 'view', '-H', fpath], cancellation)
 
     @classmethod
     def get_samtools_version_output(cls):
@@ -36,16 +253,42 @@ class HandleSamtoolsStats:
 
     @classmethod
     def _get_stats(cls, stats_fpath):
+        """
+        Reads a stats file line by line, keeping only the CHK line and the SN section in memory.
+        :return: the compact stats text, as returned by streaming.summary_stats_text, or None if there's no file
+        """
         if stats_fpath and os.path.isfile(stats_fpath):
-            return utils.read_from_file(stats_fpath)
+            checksum, summary = streaming.ChecksumExtractor(), streaming.SummaryNumbersParser()
+            with open(stats_fpath) as f:
+                streaming.feed_lines(f, [checksum, summary])
+            return streaming.summary_stats_text(checksum.checksum, summary.summary)
         return None
 
 
     @classmethod
-    def _generate_stats(cls, data_fpath):
-        if not data_fpath or not os.path.isfile(data_fpath):
+    def _generate_stats(cls, data_fpath, sidecar_fpath=None, allocator=None, cancellation=None, stdin=None,
+                        threads=None):
+        """
+        Runs samtools stats on a file, streaming its output so that only the CHK line and the SN section
+        are kept in memory.
+        :param data_fpath: the file to generate the stats for
+        :param sidecar_fpath: if given, the full samtools stats output is written to this file as it is generated
+        :param allocator: threads.ThreadAllocator deciding how many threads samtools may use
+        :param cancellation: cancellation.Cancellation terminating samtools when set
+        :param stdin: if given, the data of the file is read from this file object (e.g. a sources.StreamedInput sink)
+        :param threads: if given, the threads samtools may use, allocated already, instead of taking them from allocator
+        :return: the compact stats text, as returned by streaming.summary_stats_text
+        """
+        if stdin is None and (not data_fpath or not os.path.isfile(data_fpath)):
             raise ValueError("Can't generate stats from a non-existing file: %s" % str(data_fpath))
-        return RunSamtoolsCommands.get_samtools_stats_output(data_fpath)
+        checksum, summary = streaming.ChecksumExtractor(), streaming.SummaryNumbersParser()
+        consumers = [checksum, summary]
+        if sidecar_fpath:
+            consumers.append(streaming.SidecarWriter(sidecar_fpath))
+        with samtools_threads.allocated_threads(None if threads else allocator, data_fpath) as allocated:
+            RunSamtoolsCommands.stream_samtools_stats_output(data_fpath if stdin is None else '-', consumers,
+                                                             threads or allocated, cancellation, stdin)
+        return streaming.summary_stats_text(checksum.checksum, summary.summary)
 
 
     @classmethod
@@ -55,32 +298,148 @@ class HandleSamtoolsStats:
         return False
 
     @classmethod
-    def fetch_stats(cls, fpath, stats_fpath):
+    def fetch_stats(cls, fpath, stats_fpath, shard_stats=False, chunk_size=None, allocator=None, cache=None,
+                    cancellation=None):
+        """
+        Reads the stats from the cache or from stats_fpath if they are up to date, otherwise generates them.
+        :param shard_stats: if True and the file is indexed, the stats are generated in parallel
+                            per contig (or per chunk of chunk_size) and merged, and they are not saved to stats_fpath
+        :param allocator: threads.ThreadAllocator deciding how many threads each samtools process may use
+        :param cache: cache.StatsCache to look the stats up in first and to store them in
+        :param cancellation: cancellation.Cancellation terminating the samtools processes when set
+        """
         if not fpath or not os.path.isfile(fpath):
             raise ValueError("You need to give a valid file path if you want the stats")
+        sharded = shard_stats and utils.find_index_file(fpath)
+        cache_args = ['stats', 'sharded'] if sharded else ['stats']
+        if cache:
+            stats = cache.get_output(fpath, cache_args)
+            if stats:
+                return stats
         if os.path.isfile(stats_fpath) and not cls._is_stats_file_older_than_data(fpath, stats_fpath) and \
                 utils.can_read_file(stats_fpath):
             stats = HandleSamtoolsStats._get_stats(stats_fpath)
             logging.info("Reading stats from file %s" % stats_fpath)
+        elif sharded:
+            logging.info("Generating sharded stats for file %s" % fpath)
+            stats = HandleSamtoolsStats.generate_sharded_stats(fpath, chunk_size, allocator=allocator,
+                                                               cancellation=cancellation)
         else:
-            stats = HandleSamtoolsStats._generate_stats(fpath)
+            if os.path.isfile(stats_fpath):
+                sidecar_fpath = None
+                if cls._is_stats_file_older_than_data(fpath, stats_fpath):
+                    logging.warning("The stats file is older than the actual file, you need to remove/update it. "
+                                    "Regenerating the stats, but without saving.")
+            else:
+                sidecar_fpath = stats_fpath if utils.check_path_writable(stats_fpath) else None
             logging.info("Generating stats for file %s" % fpath)
-            if os.path.isfile(stats_fpath) and cls._is_stats_file_older_than_data(fpath, stats_fpath):
-                logging.warning("The stats file is older than the actual file, you need to remove/update it. "
-                                "Regenerating the stats, but without saving.")
+            stats = HandleSamtoolsStats._generate_stats(fpath, sidecar_fpath, allocator, cancellation)
+        if cache:
+            cache.put_output(fpath, cache_args, stats)
         return stats
 
     @classmethod
-    def persist_stats(cls, stats, stats_fpath):
-        if not stats or not stats_fpath:
-            raise ValueError("You must provide both stats and stats file path for saving the stats to a file."
-                         " Received stats = %s and stats fpath = %s" % (str(stats), str(stats_fpath)))
-        if not os.path.isfile(stats_fpath):
-            logging.info("Persisting the stats to disk")
-            return utils.write_to_file(stats_fpath, stats)
-        else:
-            logging.info("Skipping persist_stats to disk, apparently there is a valid stats file there already.")
-        return False
+    def get_header_contigs(cls, fpath, cancellation=None):
+        """
+        :param cancellation: cancellation.Cancellation terminating samtools when set, or by its watchdog
+        :return: list of (contig, length) tuples of the @SQ lines of the header of the file, in their order.
+                 They are read from the header, as samtools idxstats reads all the data of a CRAM (the CRAI
+                 doesn't have the read counts).
+        """
+        header = RunSamtoolsCommands.get_samtools_header_output(fpath, cancellation)
+        return [(sq['SN'], int(sq['LN'])) for sq in CompareStatsForFiles._extract_header_records(header, '@SQ')
+                if 'SN' in sq and 'LN' in sq]
+
+    @classmethod
+    def get_shard_regions(cls, fpath, chunk_size=None):
+        """
+        Splits an indexed file into regions: one per reference contig, or, if chunk_size is given,
+        fixed size chunks of each contig. The unmapped reads without coordinates are always the last shard.
+        The chunks need samtools view -e (samtools >= 1.12), to count the reads overlapping two chunks only once;
+        with an older samtools, the file is split per contig instead.
+        :return: list of (region, min_pos) tuples, min_pos being the position from which a read
+                 is counted in that region, or None if all the reads of the region are counted
+        """
+        if chunk_size and not capabilities.supports_option('view', '-e'):
+            logging.warning("samtools view doesn't support -e (samtools >= 1.12 does), so %s is split per contig "
+                            "instead of in chunks of %s" % (fpath, chunk_size))
+            chunk_size = None
+        regions = []
+        for contig, length in cls.get_header_contigs(fpath):
+            if not chunk_size or length <= chunk_size:
+                regions.append((utils.samtools_region(contig), None))
+                continue
+            for start in range(1, length + 1, chunk_size):
+                end = min(start + chunk_size - 1, length)
+                regions.append((utils.samtools_region(contig, start, end), start if start > 1 else None))
+        regions.append(('*', None))
+        return regions
+
+    @classmethod
+    def _generate_stats_for_region(cls, fpath, region, min_pos, allocator=None, cancellation=None):
+        if cancellation and cancellation.is_set():
+            raise RuntimeError("Cancelled generating the stats of %s for region %s" % (fpath, region))
+        checksum, summary = streaming.ChecksumExtractor(), streaming.SummaryNumbersParser()
+        with samtools_threads.allocated_threads(allocator, fpath, SHARD_PIPELINE_THREADS,
+                                                SHARD_PIPELINE_THREADS) as threads:
+            RunSamtoolsCommands.stream_samtools_stats_output_for_region(fpath, region, [checksum, summary], min_pos,
+                                                                        threads, cancellation)
+        return streaming.summary_stats_text(checksum.checksum, summary.summary)
+
+    @classmethod
+    def generate_sharded_stats(cls, fpath, chunk_size=None, max_workers=None, allocator=None, cancellation=None):
+        """
+        Generates the stats of an indexed file by running samtools stats on each shard (contig or chunk)
+        in parallel, and merging the results.
+        :param fpath: the path to an indexed BAM or CRAM file
+        :param chunk_size: if given, the contigs are split in chunks of this size
+        :param max_workers: the maximum number of shards processed at the same time, by default as many as fit in
+                            the thread budget of the allocator or the number of CPUs
+        :param allocator: threads.ThreadAllocator deciding how many threads each shard's samtools may use
+        :param cancellation: cancellation.Cancellation terminating all the shards' processes when set
+        :return: the merged stats, as compact stats text
+        """
+        if not fpath or not os.path.isfile(fpath):
+            raise ValueError("Can't generate stats from a non-existing file: %s" % str(fpath))
+        if not utils.find_index_file(fpath):
+            raise ValueError("Can't generate sharded stats for a file without an index: %s" % fpath)
+        regions = cls.get_shard_regions(fpath, chunk_size)
+        logging.info("Generating stats for file %s in %s shards" % (fpath, len(regions)))
+        if not max_workers:
+            max_workers = max(1, (allocator.total_threads if allocator else os.cpu_count()) // SHARD_PIPELINE_THREADS)
+        stage = stage_telemetry.current_stage()
+
+        def generate_stats_for_region(region):
+            with stage_telemetry.resumed_stage(stage):
+                return cls._generate_stats_for_region(fpath, *region, allocator, cancellation)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            shard_stats = list(executor.map(generate_stats_for_region, regions))
+        return cls.merge_stats(shard_stats)
+
+    @classmethod
+    def merge_stats(cls, stats_list):
+        """
+        Merges the stats of disjoint sets of reads into the stats of their union. The CHK columns are sums of CRC32s
+        (32bit overflow), which don't depend on the order of the reads, so the merged CHK is the same as the one
+        samtools stats would output for all the reads. Only the SN fields that can be merged are kept.
+        :param stats_list: list of stats texts
+        :return: the merged stats, as compact stats text
+        """
+        checksum_sums = [0, 0, 0]
+        summary = {}
+        for stats in stats_list:
+            chk = cls.extract_seq_checksum_from_stats(stats)
+            if not chk:
+                raise ValueError("Can't merge stats without a CHK line")
+            for i, value in enumerate(chk.split()[1:4]):
+                checksum_sums[i] = (checksum_sums[i] + int(value, 16)) & 0xffffffff
+            for field, value in cls.extract_summary_numbers_from_stats(stats).items():
+                if field in ADDITIVE_SN_FIELDS:
+                    summary[field] = summary.get(field, 0) + int(value)
+                elif field == 'maximum length':
+                    summary[field] = max(summary.get(field, 0), int(value))
+        checksum = "CHK\t%08x\t%08x\t%08x" % tuple(checksum_sums)
+        return streaming.summary_stats_text(checksum, summary)
 
     @classmethod
     def extract_seq_checksum_from_stats(cls, stats: str) -> str:
@@ -89,6 +448,40 @@ class HandleSamtoolsStats:
                 return line
         return None
 
+    @classmethod
+    def extract_summary_numbers_from_stats(cls, stats: str) -> dict:
+        """
+        Parses the SN (Summary Numbers) section of samtools stats output.
+        :param stats: samtools stats output
+        :return: dict of SN field name (without the trailing colon) -> value as string
+        """
+        summary = {}
+        for line in stats.split('\n'):
+            if not line.startswith('SN\t'):
+                continue
+            tokens = line.split('\t')
+            if len(tokens) < 3:
+                continue
+            summary[tokens[1].rstrip(':')] = tokens[2]
+        return summary
+
+    @classmethod
+    def extract_flagstat_counts_from_stats(cls, stats: str) -> dict:
+        """
+        Builds a flagstat-equivalent summary out of the SN section of samtools stats output,
+        so that the flagstat comparison doesn't need a separate samtools flagstat decode of the file.
+        :param stats: samtools stats output
+        :return: dict of counter name -> int, or None if there is no SN section in the stats
+        """
+        summary = cls.extract_summary_numbers_from_stats(stats)
+        if not summary:
+            return None
+        counts = {}
+        for field in FLAGSTAT_EQUIVALENT_SN_FIELDS:
+            if field in summary:
+                counts[field] = int(summary[field])
+        return counts
+
 
 class HandleSamtoolsVersion:
 
@@ -126,7 +519,7 @@ class HandleSamtoolsVersion:
         minor_nr_1 = minor_vs_nr.split('.', 1)[0]
         if not minor_nr_1.isdigit():
             raise ValueError("Can't parse samtools version string.")
-        if int(minor_nr_1[0]) < 3:
+        if int(minor_nr_1) < 3:
             raise ValueError("You need to use at least samtools version 1.3.")
 
     @classmethod
@@ -147,6 +540,8 @@ class CompareStatsForFiles:
         if not flagstat_c or not flagstat_b:
             errors.append("At least one of the flagstats is missing")
             return errors
+        if isinstance(flagstat_b, dict) and isinstance(flagstat_c, dict):
+            return cls._compare_flagstat_counts(flagstat_b, flagstat_c)
         if flagstat_b != flagstat_c:
             logging.error("FLAGSTAT DIFFERENT:\n %s then:\n %s " % (flagstat_b, flagstat_c))
             errors.append("FLAGSTAT DIFFERENT:\n %s then:\n %s " % (flagstat_b, flagstat_c))
@@ -154,6 +549,68 @@ class CompareStatsForFiles:
             logging.info("Flagstats are equal.")
         return errors
 
+    @classmethod
+    def _compare_flagstat_counts(cls, counts_b, counts_c):
+        errors = []
+        for field in sorted(set(counts_b) | set(counts_c)):
+            if counts_b.get(field) != counts_c.get(field):
+                errors.append("FLAGSTAT DIFFERENT for %s: %s and %s" % (field, counts_b.get(field), counts_c.get(field)))
+                logging.error("FLAGSTAT DIFFERENT for %s: %s and %s" % (field, counts_b.get(field), counts_c.get(field)))
+        if not errors:
+            logging.info("Flagstats are equal.")
+        return errors
+
+    @classmethod
+    def _extract_header_records(cls, header, record_type, tags=None):
+        """
+        :param record_type: e.g. '@SQ'
+        :param tags: the tags to keep for each record, None for all of them
+        :return: list of dicts tag -> value, one per record of the given type, in the order they are in the header
+        """
+        records = []
+        for line in header.splitlines():
+            tokens = line.split('\t')
+            if tokens[0] != record_type:
+                continue
+            record = dict(token.split(':', 1) for token in tokens[1:] if ':' in token)
+            if tags:
+                record = {tag: value for tag, value in record.items() if tag in tags}
+            records.append(record)
+        return records
+
+    @classmethod
+    def compare_headers(cls, header_b, header_c):
+        """
+        Compares the reference sequences (@SQ names and lengths) and the read groups (@RG) of 2 headers.
+        The other @SQ tags (M5, UR...) are left out, as they are often added when converting to CRAM.
+        """
+        errors = []
+        sq_b = cls._extract_header_records(header_b, '@SQ', ['SN', 'LN'])
+        sq_c = cls._extract_header_records(header_c, '@SQ', ['SN', 'LN'])
+        if sq_b != sq_c:
+            errors.append("HEADER @SQ DIFFERENT: %s and %s" % (sq_b, sq_c))
+            logging.error("HEADER @SQ DIFFERENT: %s and %s" % (sq_b, sq_c))
+        rg_b = sorted(cls._extract_header_records(header_b, '@RG'), key=lambda rg: rg.get('ID', ''))
+        rg_c = sorted(cls._extract_header_records(header_c, '@RG'), key=lambda rg: rg.get('ID', ''))
+        if rg_b != rg_c:
+            errors.append("HEADER @RG DIFFERENT: %s and %s" % (rg_b, rg_c))
+            logging.error("HEADER @RG DIFFERENT: %s and %s" % (rg_b, rg_c))
+        return errors
+
+    @classmethod
+    def compare_idxstats(cls, idxstats_b, idxstats_c):
+        """Compares the mapped and unmapped read counts per contig, as output by samtools idxstats."""
+        errors = []
+        counts_b = {line.split('\t')[0]: line.split('\t')[1:] for line in idxstats_b.splitlines() if line}
+        counts_c = {line.split('\t')[0]: line.split('\t')[1:] for line in idxstats_c.splitlines() if line}
+        for contig in sorted(set(counts_b) | set(counts_c)):
+            if counts_b.get(contig) != counts_c.get(contig):
+                errors.append("IDXSTATS DIFFERENT for %s: %s and %s" % (contig, counts_b.get(contig),
+                                                                        counts_c.get(contig)))
+                logging.error("IDXSTATS DIFFERENT for %s: %s and %s" % (contig, counts_b.get(contig),
+                                                                        counts_c.get(contig)))
+        return errors
+
     @classmethod
     def compare_stats_by_sequence_checksum(cls, stats_b, stats_c):
         errors = []
@@ -177,7 +634,7 @@ class CompareStatsForFiles:
 
 
     @classmethod
-    def compare_bam_and_cram_by_statistics(cls, bam_path, cram_path):
+    def _check_file_paths(cls, bam_path, cram_path):
         errors = []
         # Check that it's a valid file path
         if not bam_path or (not utils.is_irods_path(bam_path) and not os.path.isfile(bam_path)):
@@ -195,80 +652,538 @@ class CompareStatsForFiles:
             errors.append("Can't read file %s" % cram_path)
         if errors:
             logging.error("There are problems reading the files: %s" % errors)
-            return errors
-
-        # # Checking on samtools version:
-        # version_output = RunSamtoolsCommands.get_samtools_version_output()
-        # try:
-        #     HandleSamtoolsVersion.check_samtools_version(version_output)
-        # except ValueError as e:
-        #     errors.append(str(e))
-        #     return errors
+        return errors
 
-        # Quickcheck the files before anything:
+    @classmethod
+    def _check_samtools_version(cls):
+        """
+        Checks the version of samtools, from the capabilities probed once per samtools binary.
+        :return: list of errors, empty if the version is recent enough or samtools can't be probed,
+                 in which case running it fails anyway
+        """
         try:
-            RunSamtoolsCommands.run_samtools_quickcheck(bam_path)
+            capabilities.check_samtools_version(capabilities.samtools_capabilities())
+        except ValueError as e:
+            logging.error(str(e))
+            return [str(e)]
         except RuntimeError as e:
-            errors.append(str(e))
+            logging.warning("Can't check the version of samtools: %s" % e)
+        return []
 
-        try:
-            RunSamtoolsCommands.run_samtools_quickcheck(cram_path)
-        except RuntimeError as e:
-            errors.append(str(e))
+    @classmethod
+    def _run_on_both_files(cls, func, bam_path, cram_path, telemetry=None, stage_name=None):
+        """
+        Runs func on both files at the same time.
+        :param telemetry: telemetry.Telemetry recording each run as a stage called stage_name
+        :return: (output for the BAM, output for the CRAM, errors)
+        """
+        def run(fpath):
+            with stage_telemetry.stage(telemetry, fpath, stage_name):
+                return func(fpath)
+        errors = []
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(run, bam_path), executor.submit(run, cram_path)]
+        outputs = []
+        for future in futures:
+            try:
+                outputs.append(future.result())
+            except RuntimeError as e:
+                outputs.append(None)
+                errors.append(str(e))
+        return outputs[0], outputs[1], errors
+
+    @classmethod
+    def compare_headers_of_files(cls, bam_path, cram_path, telemetry=None, cancellation=None):
+        """:param cancellation: cancellation.Cancellation for the samtools processes, with their watchdog"""
+        if utils.is_irods_path(bam_path) or utils.is_irods_path(cram_path):
+            logging.info("Skipping the header comparison, at least one of %s and %s is in iRODS" %
+                         (bam_path, cram_path))
+            return []
+        header_b, header_c, errors = cls._run_on_both_files(
+            lambda fpath: RunSamtoolsCommands.get_samtools_header_output(fpath, cancellation), bam_path, cram_path,
+            telemetry, 'header')
         if errors:
-            logging.error("There are problems running quickcheck on the files you've given: %s" % errors)
             return errors
+        return cls.compare_headers(header_b, header_c)
 
-        # Calculate and compare flagstat:
+    @classmethod
+    def _read_crai_ref_ids(cls, index_fpath):
+        """:return: the set of the ids of the reference contigs (-1 for the unmapped reads) of the slices of a CRAI"""
         try:
-            flagstat_b = RunSamtoolsCommands.get_samtools_flagstat_output(bam_path)
-        except RuntimeError as e:
-            errors.append(str(e))
+            with gzip.open(index_fpath, 'rt') as f:
+                return {int(line.split('\t')[0]) for line in f if line.strip()}
+        except (IOError, OSError, ValueError) as e:
+            raise RuntimeError("Can't read the index %s: %s" % (index_fpath, e))
+
+    @classmethod
+    def get_contigs_with_reads(cls, fpath, cancellation=None):
+        """
+        Lists the contigs with reads of an indexed file out of its index only. For a BAM, they're the contigs
+        samtools idxstats counts reads for. A CRAI has no read counts (samtools idxstats reads the whole CRAM),
+        so for a CRAM they're the contigs of the slices the CRAI lists, named after the @SQ lines of the header.
+        :param cancellation: cancellation.Cancellation for the samtools processes, whose watchdog also gives up
+                             on reading the CRAI after the timeout of the index stage (or the stall timeout)
+        :return: set of contig names, '*' standing for the unmapped reads without coordinates
+        """
+        index_fpath = utils.find_index_file(fpath)
+        if index_fpath and index_fpath.endswith('.crai'):
+            contigs = [contig for contig, _ in HandleSamtoolsStats.get_header_contigs(fpath, cancellation)]
+            ref_ids = watchdog.run_within_timeout(lambda: cls._read_crai_ref_ids(index_fpath), cancellation,
+                                                  watchdog.INDEX_STAGE, "reading %s" % index_fpath)
+            return {'*' if ref_id == -1 else contigs[ref_id] for ref_id in ref_ids if -1 <= ref_id < len(contigs)}
+        contigs = set()
+        for line in RunSamtoolsCommands.get_samtools_idxstats_output(fpath, cancellation).splitlines():
+            tokens = line.split('\t')
+            if len(tokens) >= 4 and (int(tokens[2]) or int(tokens[3])):
+                contigs.add(tokens[0])
+        return contigs
+
+    @classmethod
+    def compare_contigs_with_reads(cls, contigs_b, contigs_c):
+        """Compares the contigs with reads of 2 files, as returned by get_contigs_with_reads."""
+        if contigs_b == contigs_c:
+            return []
+        error = "INDEX CONTIGS DIFFERENT: contigs with reads only in the BAM: %s, only in the CRAM: %s" % \
+                (sorted(contigs_b - contigs_c), sorted(contigs_c - contigs_b))
+        logging.error(error)
+        return [error]
+
+    @classmethod
+    def compare_idxstats_of_files(cls, bam_path, cram_path, telemetry=None, cancellation=None):
+        """
+        Compares the indexes of the files: the read counts per contig of samtools idxstats if both files have
+        a BAM index, otherwise (i.e. for a CRAM) only which contigs have reads, see get_contigs_with_reads.
+        :param cancellation: cancellation.Cancellation for the samtools processes, with their watchdog
+        """
+        if utils.is_irods_path(bam_path) or utils.is_irods_path(cram_path) or \
+                not utils.find_index_file(bam_path) or not utils.find_index_file(cram_path):
+            logging.info("Skipping the index comparison, at least one of %s and %s isn't indexed" %
+                         (bam_path, cram_path))
+            return []
+        if any(utils.find_index_file(fpath).endswith('.crai') for fpath in (bam_path, cram_path)):
+            contigs_b, contigs_c, errors = cls._run_on_both_files(
+                lambda fpath: cls.get_contigs_with_reads(fpath, cancellation), bam_path, cram_path, telemetry, 'index')
+            if errors:
+                return errors
+            return cls.compare_contigs_with_reads(contigs_b, contigs_c)
+        idxstats_b, idxstats_c, errors = cls._run_on_both_files(
+            lambda fpath: RunSamtoolsCommands.get_samtools_idxstats_output(fpath, cancellation), bam_path, cram_path,
+            telemetry, 'idxstats')
+        if errors:
+            return errors
+        return cls.compare_idxstats(idxstats_b, idxstats_c)
+
+    @classmethod
+    def verify_bam_and_cram(cls, bam_path, cram_path, tiers=None, compute_digests=False, **compare_kwargs):
+        """
+        Verifies a BAM and a CRAM going up a ladder of checks, from the cheapest to the most expensive,
+        and stopping at the first one that finds a difference.
+        :param tiers: list of the tiers to go through, out of TIERS, by default all of them: the header and index
+                      checks cost a few seconds, and spare decoding the pairs they find different.
+                      E.g. [TIER_HEADER, TIER_INDEX] for a quick triage, without decoding the files.
+        :param compute_digests: if True, the digests of the files are computed while they are checked, in TIER_FULL
+        :param compare_kwargs: the keyword arguments for compare_bam_and_cram_by_statistics, for TIER_FULL
+        :return: dict with the errors (empty list if the files are equivalent), the last tier reached,
+                 the telemetry of the stages run, as returned by telemetry.Telemetry.as_dict, and the digests
+                 of the files (see compare_bam_and_cram_by_statistics), None if not computed
+        """
+        tiers = tiers or TIERS
+        unknown_tiers = [tier for tier in tiers if tier not in TIERS]
+        if unknown_tiers:
+            raise ValueError("Unknown verification tiers: %s, the tiers are: %s" % (unknown_tiers, TIERS))
+        telemetry = compare_kwargs.setdefault('telemetry', stage_telemetry.Telemetry())
+        if compute_digests:
+            compare_kwargs.setdefault('digests', {})
+        digests = compare_kwargs.get('digests')
+        errors = cls._check_file_paths(bam_path, cram_path)
+        if errors:
+            return {'errors': errors, 'tier': None, 'telemetry': telemetry.as_dict(), 'digests': digests}
+        # The cheap tiers are under the same timeouts as TIER_FULL, a hung filesystem blocking them as well
+        cancellation = pair_cancellation.Cancellation(cls._watchdog(compare_kwargs.get('stage_timeouts'),
+                                                                    compare_kwargs.get('stall_timeout')))
+        tier_checks = {TIER_HEADER: lambda b, c: cls.compare_headers_of_files(b, c, telemetry, cancellation),
+                       TIER_INDEX: lambda b, c: cls.compare_idxstats_of_files(b, c, telemetry, cancellation),
+                       TIER_FULL: lambda b, c: cls.compare_bam_and_cram_by_statistics(b, c, **compare_kwargs)}
+        tier = None
+        for tier in sorted(tiers, key=TIERS.index):
+            logging.info("Verifying %s and %s, tier: %s" % (bam_path, cram_path, tier))
+            errors = tier_checks[tier](bam_path, cram_path)
+            if errors:
+                break
+        return {'errors': errors, 'tier': tier, 'telemetry': telemetry.as_dict(), 'digests': digests}
 
+    @classmethod
+    def _run_streamed_checks_on_file(cls, fpath, cancellation, single_decode=False, allocator=None, cache=None,
+                                     fail_fast=False, on_flagstat=None, fetch_command=None, telemetry=None,
+                                     digests=None, stats_fpath=None):
+        """
+        Like _run_checks_on_file, for a file that isn't on a local filesystem (e.g. in iRODS): the file is streamed
+        once from the fetch command to samtools flagstat and samtools stats, running at the same time.
+        There's no quickcheck, as it needs to seek to the end of the file; a truncated stream makes flagstat
+        and stats fail instead. An error of the fetch command is reported as a quickcheck error.
+        :param digests: if given, a dict getting the digests of the file (see sources.StreamedInput.digests),
+                        computed on the stream, under the path of the file
+        :param stats_fpath: for a local file, the path where its stats are saved as samtools stats outputs them,
+                            if there isn't a stats file there already and the path is writable
+        """
+        result = {'quickcheck_errors': [], 'flagstat': None, 'flagstat_errors': [],
+                  'stats': None, 'stats_errors': []}
+        if not single_decode and cache:
+            result['flagstat'] = cache.get_output(fpath, ['flagstat'])
+        if cache:
+            result['stats'] = cache.get_output(fpath, ['stats'])
+        needs_digests = digests is not None
+        if needs_digests and cache:
+            cached_digests = cache.get_output(fpath, ['digests'])
+            if cached_digests:
+                digests[fpath] = json.loads(cached_digests)
+                needs_digests = False
+        needs_flagstat = not single_decode and not result['flagstat']
+        if not needs_flagstat and result['flagstat'] and on_flagstat:
+            on_flagstat(fpath, result['flagstat'])
+        if (needs_flagstat or not result['stats'] or needs_digests) and not cancellation.is_set():
+            # The consumers of the stream get their threads all at once: one waiting for threads wouldn't read
+            # its share of the stream, and would block the others, which get the whole stream too, with it.
+            with samtools_threads.allocated_threads(allocator, fpath) as threads:
+                flagstat_threads, stats_threads = samtools_threads.split_threads(threads, 2) \
+                    if needs_flagstat and not result['stats'] else (threads, threads)
+                source = sources.open_input(fpath, fetch_command, needs_digests)
+                flagstat_stdin = source.open_sink() if needs_flagstat else None
+                stats_stdin = source.open_sink() if not result['stats'] else None
+
+                def run_flagstat():
+                    try:
+                        with stage_telemetry.stage(telemetry, fpath, 'flagstat'):
+                            result['flagstat'] = RunSamtoolsCommands.get_samtools_flagstat_output(
+                                '-', flagstat_threads, cancellation, flagstat_stdin)
+                    except RuntimeError as e:
+                        if not cancellation.is_set():
+                            result['flagstat_errors'].append(str(e))
+                            if fail_fast:
+                                cancellation.set()
+                        return
+                    if cache:
+                        cache.put_output(fpath, ['flagstat'], result['flagstat'])
+                    if allocator:
+                        allocator.stage_done(fpath)
+                    if on_flagstat:
+                        on_flagstat(fpath, result['flagstat'])
+
+                def run_stats():
+                    sidecar_fpath = None
+                    if stats_fpath and not os.path.isfile(stats_fpath) and utils.check_path_writable(stats_fpath):
+                        sidecar_fpath = stats_fpath
+                    try:
+                        with stage_telemetry.stage(telemetry, fpath, 'stats'):
+                            result['stats'] = HandleSamtoolsStats._generate_stats(fpath, sidecar_fpath=sidecar_fpath,
+                                                                                  cancellation=cancellation,
+                                                                                  stdin=stats_stdin,
+                                                                                  threads=stats_threads)
+                    except RuntimeError as e:
+                        if not cancellation.is_set():
+                            result['stats_errors'].append(str(e))
+                            if fail_fast:
+                                cancellation.set()
+                        return
+                    if cache:
+                        cache.put_output(fpath, ['stats'], result['stats'])
+
+                source.start(cancellation)
+                with ThreadPoolExecutor(max_workers=2) as executor:
+                    if flagstat_stdin:
+                        executor.submit(run_flagstat)
+                    if stats_stdin:
+                        executor.submit(run_stats)
+                    try:
+                        with stage_telemetry.stage(telemetry, fpath, 'fetch'):
+                            source.wait()
+                        if needs_digests:
+                            digests[fpath] = source.digests()
+                            if cache:
+                                cache.put_output(fpath, ['digests'], json.dumps(digests[fpath]))
+                    except RuntimeError as e:
+                        if not cancellation.is_set():
+                            result['quickcheck_errors'].append(str(e))
+                            cancellation.set()
+        if allocator:
+            allocator.file_done(fpath)
+        if single_decode and result['stats']:
+            result['flagstat'] = HandleSamtoolsStats.extract_flagstat_counts_from_stats(result['stats'])
+        return result
+
+    @classmethod
+    def _run_checks_on_file(cls, fpath, stats_fpath, cancellation, single_decode=False, shard_stats=False,
+                            chunk_size=None, allocator=None, cache=None, fail_fast=False, on_flagstat=None,
+                            fetch_command=None, telemetry=None, digests=None):
+        """
+        Runs quickcheck, flagstat and stats on one file, one after the other. It is meant to be run
+        as one of the two independent pipelines (BAM and CRAM) of a comparison, so it only collects
+        the outputs and the errors of each stage, the comparison is done by the caller.
+        :param fpath: the path to the BAM or CRAM file
+        :param stats_fpath: the path where the stats for this file would be stored
+        :param cancellation: cancellation.Cancellation shared with the other pipeline, set when the pair has failed,
+                             which terminates the samtools processes still running. The errors of the processes
+                             terminated this way are not reported, as they are only a consequence of the cancellation.
+        :param single_decode: if True, the flagstat counters are taken from the stats output
+                              instead of running samtools flagstat on the file
+        :param shard_stats: if True, the stats of indexed files are generated per contig (or chunk) in parallel
+        :param chunk_size: the size of the chunks the contigs are split in when sharding the stats
+        :param allocator: threads.ThreadAllocator sharing the thread budget between the samtools processes
+        :param cache: cache.StatsCache for the flagstat and stats outputs
+        :param fail_fast: if True, an error in any stage cancels the pair
+        :param on_flagstat: function called with (fpath, flagstat) as soon as the flagstat of the file is available
+        :param fetch_command: the command template for streaming iRODS files, see sources.fetch_command_args
+        :param telemetry: telemetry.Telemetry recording the time taken by each stage and the usage of its processes
+        :param digests: if given, a dict getting the digests of the file, under its path. The file is then read
+                        only once after quickcheck, streamed to flagstat and stats while computing its digests.
+        :return: dict with the outputs and the errors of each stage
+        """
+        if utils.is_irods_path(fpath):
+            return cls._run_streamed_checks_on_file(fpath, cancellation, single_decode, allocator, cache, fail_fast,
+                                                    on_flagstat, fetch_command, telemetry, digests)
+        result = {'quickcheck_errors': [], 'flagstat': None, 'flagstat_errors': [],
+                  'stats': None, 'stats_errors': []}
         try:
-            flagstat_c = RunSamtoolsCommands.get_samtools_flagstat_output(cram_path)
-        except RuntimeError as e:
-            errors.append(str(e))
+            try:
+                with stage_telemetry.stage(telemetry, fpath, 'quickcheck'):
+                    RunSamtoolsCommands.run_samtools_quickcheck(fpath, cancellation)
+            except RuntimeError as e:
+                if not cancellation.is_set():
+                    result['quickcheck_errors'].append(str(e))
+                    cancellation.set()
+                return result
+            if digests is not None:
+                return cls._run_streamed_checks_on_file(fpath, cancellation, single_decode, allocator, cache,
+                                                        fail_fast, on_flagstat, sources.LOCAL_FETCH_COMMAND, telemetry,
+                                                        digests, stats_fpath)
 
-        if not errors:
-            errors.extend(cls.compare_flagstats(flagstat_b, flagstat_c))
-        else:
-            logging.error("THere are problems running flagstat on the files you've given: %s" % errors)
+            if cancellation.is_set():
+                return result
+            if not single_decode:
+                try:
+                    result['flagstat'] = cache.get_output(fpath, ['flagstat']) if cache else None
+                    if not result['flagstat']:
+                        with stage_telemetry.stage(telemetry, fpath, 'flagstat'), \
+                                samtools_threads.allocated_threads(allocator, fpath) as threads:
+                            result['flagstat'] = RunSamtoolsCommands.get_samtools_flagstat_output(fpath, threads,
+                                                                                                  cancellation)
+                        if cache:
+                            cache.put_output(fpath, ['flagstat'], result['flagstat'])
+                except RuntimeError as e:
+                    if cancellation.is_set():
+                        return result
+                    result['flagstat_errors'].append(str(e))
+                    if fail_fast:
+                        cancellation.set()
+                        return result
+                if allocator:
+                    allocator.stage_done(fpath)
+                if on_flagstat and result['flagstat']:
+                    on_flagstat(fpath, result['flagstat'])
+
+            if cancellation.is_set():
+                return result
+            try:
+                with stage_telemetry.stage(telemetry, fpath, 'stats'):
+                    result['stats'] = HandleSamtoolsStats.fetch_stats(fpath, stats_fpath, shard_stats, chunk_size,
+                                                                      allocator, cache, cancellation)
+            except (ValueError, RuntimeError) as e:
+                if cancellation.is_set():
+                    return result
+                result['stats_errors'].append(str(e))
+                if fail_fast:
+                    cancellation.set()
+            if single_decode and result['stats']:
+                result['flagstat'] = HandleSamtoolsStats.extract_flagstat_counts_from_stats(result['stats'])
+            return result
+        finally:
+            if allocator:
+                allocator.file_done(fpath)
+
+    @classmethod
+    def compare_bam_and_cram_by_statistics(cls, bam_path, cram_path, single_decode=False, shard_stats=False,
+                                           chunk_size=None, threads=None, cache=None, fail_fast=False,
+                                           fetch_command=None, telemetry=None, all_sections=False,
+                                           stats_tolerances=None, digests=None, stage_timeouts=None,
+                                           stall_timeout=None):
+        """
+        Compares a BAM and a CRAM file by running quickcheck, flagstat and stats on both.
+        :param bam_path: the path to the BAM file
+        :param cram_path: the path to the CRAM file
+        :param single_decode: if True, each file is decoded only once, by samtools stats,
+                              and the flagstat counters are compared based on its SN section
+        :param shard_stats: if True, samtools stats is run in parallel per contig of indexed files
+        :param chunk_size: if given together with shard_stats, the contigs are split in chunks of this size
+        :param threads: the total number of threads shared by all the samtools processes running for the 2 files,
+                        None for leaving the number of threads of each process to samtools
+        :param cache: cache.StatsCache keeping the flagstat and stats outputs of files already seen
+        :param fail_fast: if True, as soon as a stage fails or the flagstats differ, the samtools processes
+                          still running for the pair are terminated and the pair is reported as failed
+        :param fetch_command: the command template writing an iRODS file to stdout, {path} being replaced
+                              by the iRODS path; the iRODS files are streamed from it to samtools,
+                              see sources.fetch_command_args for the default
+        :param telemetry: telemetry.Telemetry recording the time taken by each stage of each file,
+                          including the cache reads and writes, and the resource usage of the samtools processes
+        :param all_sections: if True, all the sections of the stats files saved next to the files are compared too
+                             (see stats_model.compare_stats_files), not only the checksums
+        :param stats_tolerances: dict of stats section -> maximum relative difference of its values,
+                                 for all_sections
+        :param digests: if given, a dict getting the MD5, CRC32 and size of each file under its path
+                        (see sources.StreamedInput.digests). They are computed while the file is streamed to
+                        flagstat and stats, so that it is read only once, and kept in the cache.
+        :param stage_timeouts: dict of stage (quickcheck, flagstat, stats, view or fetch) -> the seconds after which
+                               its processes are killed, their error starting with TIMEOUT
+        :param stall_timeout: the seconds after which a process whose I/O doesn't progress is killed,
+                              its error starting with STALLED (see watchdog.Watchdog)
+        :return: list of errors, empty if the files are equivalent
+        """
+        errors = cls._check_file_paths(bam_path, cram_path)
+        if errors:
+            return errors
+        if telemetry and cache:
+            cache = stage_telemetry.TimedCache(cache, telemetry)
 
-        # Calculate and compare stats:
+        errors = cls._check_samtools_version()
+        if errors:
+            return errors
+
+        # Run quickcheck, flagstat and stats on both files at the same time,
+        # the results are joined only for the comparison:
         stats_fpath_b = bam_path + ".stats"
         stats_fpath_c = cram_path + ".stats"
-        stats_b, stats_c = None, None
-        try:
-            stats_b = HandleSamtoolsStats.fetch_stats(bam_path, stats_fpath_b)
-        except (ValueError, RuntimeError) as e:
-            errors.append(str(e))
+        cancellation = pair_cancellation.Cancellation(cls._watchdog(stage_timeouts, stall_timeout))
+        on_flagstat = None
+        if fail_fast and not single_decode:
+            flagstats = {}
+            flagstats_lock = threading.Lock()
 
-        try:
-            stats_c = HandleSamtoolsStats.fetch_stats(cram_path, stats_fpath_c)
-        except (ValueError, RuntimeError) as e:
-            errors.append(str(e))
+            def on_flagstat(fpath, flagstat):
+                with flagstats_lock:
+                    flagstats[fpath] = flagstat
+                    if len(flagstats) == 2 and flagstats[bam_path] != flagstats[cram_path]:
+                        logging.error("The flagstats of %s and %s differ, cancelling the rest of the checks" %
+                                      (bam_path, cram_path))
+                        cancellation.set()
+        allocator = None
+        if threads:
+            allocator = samtools_threads.ThreadAllocator(threads)
+            for fpath in (bam_path, cram_path):
+                size = os.path.getsize(fpath) if not utils.is_irods_path(fpath) else 1
+                allocator.register(fpath, size, 1 if single_decode else 2)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            future_b = executor.submit(cls._run_checks_on_file, bam_path, stats_fpath_b, cancellation, single_decode,
+                                       shard_stats, chunk_size, allocator, cache, fail_fast, on_flagstat, fetch_command,
+                                       telemetry, digests)
+            future_c = executor.submit(cls._run_checks_on_file, cram_path, stats_fpath_c, cancellation, single_decode,
+                                       shard_stats, chunk_size, allocator, cache, fail_fast, on_flagstat, fetch_command,
+                                       telemetry, digests)
+            result_b = future_b.result()
+            result_c = future_c.result()
+
+        errors.extend(cls._compare_file_results(result_b, result_c))
+        # The stats files are only written while samtools stats runs on a whole file (see fetch_stats): the stats
+        # kept in memory, in the cache or merged from shards are only the CHK line and the SN section.
+        if result_b['quickcheck_errors'] or result_c['quickcheck_errors'] or shard_stats:
+            return errors
+        if all_sections:
+            errors.extend(stats_model.compare_stats_files(stats_fpath_b, stats_fpath_c, stats_tolerances,
+                                                          (bam_path, cram_path)))
+        return errors
 
+    @classmethod
+    def compare_bam_and_crams_by_statistics(cls, bam_path, cram_paths, single_decode=False, shard_stats=False,
+                                            chunk_size=None, threads=None, cache=None, fetch_command=None,
+                                            telemetry=None, all_sections=False, stats_tolerances=None,
+                                            digests=None, stage_timeouts=None, stall_timeout=None):
+        """
+        Compares a BAM file with several CRAM files made out of it, e.g. with different CRAM versions or options.
+        The BAM is checked (quickcheck, flagstat and stats) only once, at the same time as the CRAMs,
+        and its results are compared with those of each CRAM.
+        The other parameters are the same as for compare_bam_and_cram_by_statistics (there's no fail_fast,
+        as a CRAM failing doesn't stop the checks of the others).
+        :param cram_paths: the paths to the CRAM files
+        :return: dict of CRAM path -> list of errors, empty if the CRAM is equivalent to the BAM
+        """
+        version_errors = cls._check_samtools_version()
+        if version_errors:
+            return {cram_path: list(version_errors) for cram_path in cram_paths}
+        all_errors = {cram_path: cls._check_file_paths(bam_path, cram_path) for cram_path in cram_paths}
+        cram_paths = [cram_path for cram_path in cram_paths if not all_errors[cram_path]]
+        if not cram_paths:
+            return all_errors
+        if telemetry and cache:
+            cache = stage_telemetry.TimedCache(cache, telemetry)
+        fpaths = [bam_path] + cram_paths
+        # Each file has its own cancellation, as a CRAM failing doesn't make the others fail,
+        # but they are all cancelled if the BAM fails its quickcheck:
+        pair_watchdog = cls._watchdog(stage_timeouts, stall_timeout)
+        cancellations = {fpath: pair_cancellation.Cancellation(pair_watchdog) for fpath in fpaths}
+        allocator = None
+        if threads:
+            allocator = samtools_threads.ThreadAllocator(threads)
+            for fpath in fpaths:
+                size = os.path.getsize(fpath) if not utils.is_irods_path(fpath) else 1
+                allocator.register(fpath, size, 1 if single_decode else 2)
+
+        def cancel_all_if_bam_failed(future):
+            if future.result()['quickcheck_errors']:
+                for cancellation in cancellations.values():
+                    cancellation.set()
+        with ThreadPoolExecutor(max_workers=len(fpaths)) as executor:
+            futures = {fpath: executor.submit(cls._run_checks_on_file, fpath, fpath + ".stats", cancellations[fpath],
+                                              single_decode, shard_stats, chunk_size, allocator, cache, False, None,
+                                              fetch_command, telemetry, digests)
+                       for fpath in fpaths}
+            futures[bam_path].add_done_callback(cancel_all_if_bam_failed)
+            results = {fpath: future.result() for fpath, future in futures.items()}
+
+        result_b = results[bam_path]
+        for cram_path in cram_paths:
+            logging.info("Comparing %s and %s" % (bam_path, cram_path))
+            all_errors[cram_path] = cls._compare_file_results(result_b, results[cram_path])
+        if all_sections and not result_b['quickcheck_errors'] and not shard_stats:
+            for cram_path in cram_paths:
+                if not results[cram_path]['quickcheck_errors']:
+                    all_errors[cram_path].extend(stats_model.compare_stats_files(
+                        bam_path + ".stats", cram_path + ".stats", stats_tolerances, (bam_path, cram_path)))
+        return all_errors
+
+    @classmethod
+    def _watchdog(cls, stage_timeouts=None, stall_timeout=None):
+        """:return: watchdog.Watchdog for the processes of a verification, None if there's no timeout"""
+        if not stage_timeouts and stall_timeout is None:
+            return None
+        return watchdog.Watchdog(stage_timeouts, stall_timeout)
+
+    @classmethod
+    def _compare_file_results(cls, result_b, result_c):
+        """
+        Compares the results of _run_checks_on_file for a BAM and a CRAM.
+        :return: list of errors, empty if the files are equivalent
+        """
+        errors = []
+        # Quickcheck the files before anything:
+        errors.extend(result_b['quickcheck_errors'])
+        errors.extend(result_c['quickcheck_errors'])
+        if errors:
+            logging.error("There are problems running quickcheck on the files you've given: %s" % errors)
+            return errors
+
+        # Compare flagstat:
+        errors.extend(result_b['flagstat_errors'])
+        errors.extend(result_c['flagstat_errors'])
+        if not errors:
+            errors.extend(cls.compare_flagstats(result_b['flagstat'], result_c['flagstat']))
+        else:
+            logging.error("THere are problems running flagstat on the files you've given: %s" % errors)
+
+        # Compare stats:
+        stats_b, stats_c = result_b['stats'], result_c['stats']
+        errors.extend(result_b['stats_errors'])
+        errors.extend(result_c['stats_errors'])
         if not errors and stats_b and stats_c:
             errors.extend(cls.compare_stats_by_sequence_checksum(stats_b, stats_c))
         else:
             errors.append("Can't compare samtools stats.")
             logging.error("For some reason I can't compare samtools stats for your files.")
-
-        # Persist stats:
-        try:
-            if stats_b and not utils.is_irods_path(bam_path):
-                HandleSamtoolsStats.persist_stats(stats_b, stats_fpath_b)
-        except IOError as e:
-            errors.append("Can't save stats to disk for %s file" % bam_path)
-            logging.error("Can't save stats to disk for %s file" % bam_path)
-
-        try:
-            if stats_c and not utils.is_irods_path(cram_path):
-                HandleSamtoolsStats.persist_stats(stats_c, stats_fpath_c)
-        except IOError as e:
-            errors.append("Can't save stats to disk for %s file" % cram_path)
-            logging.error("Can't save stats to disk for %s file" % cram_path)
         return errors
-
-
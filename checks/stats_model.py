@@ -0,0 +1,213 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import math
+import logging
+from array import array
+
+from checks import utils
+
+# The sections compared elsewhere (CHK by CompareStatsForFiles.compare_stats_by_sequence_checksum)
+IGNORED_SECTIONS = {'CHK'}
+# The maximum number of differing rows of a section listed in the errors
+MAX_REPORTED_ROWS = 5
+
+
+def _to_number(token):
+    try:
+        return float(token)
+    except ValueError:
+        return math.nan
+
+
+class StatsSection:
+    """
+    A section of samtools stats output (e.g. FFQ, RL, COV), as a list of row keys (the first column: a cycle,
+    a length, a coverage range...) and one array of doubles with the values of the other columns of all the rows,
+    the row boundaries being kept in a second array, as the rows of a section don't all have the same width.
+    The SN section has the field names as keys, and the values that aren't numbers are NaN.
+    """
+    def __init__(self, name, keys, values, offsets):
+        self.name = name
+        self.keys = keys
+        self.values = values
+        self.offsets = offsets
+
+    @classmethod
+    def from_lines(cls, name, lines):
+        keys, values, offsets = [], array('d'), array('L', [0])
+        for line in lines:
+            tokens = line.split('\t')
+            try:
+                row = list(map(float, tokens[2:]))
+            except ValueError:
+                row = []
+                for token in tokens[2:]:
+                    if token.startswith('#'):
+                        break
+                    row.append(_to_number(token))
+            keys.append(tokens[1].rstrip(':') if len(tokens) > 1 else '')
+            values.extend(row)
+            offsets.append(len(values))
+        return cls(name, keys, values, offsets)
+
+    def row(self, i):
+        return self.values[self.offsets[i]:self.offsets[i + 1]]
+
+    def rows(self):
+        """:return: dict of row key -> array of the values of the row"""
+        return {key: self.row(i) for i, key in enumerate(self.keys)}
+
+
+class SamtoolsStats:
+    """
+    The sections of samtools stats output. The lines are only split by section when the stats are read,
+    a section's values being parsed into arrays the first time the section is used.
+    """
+    def __init__(self, lines_by_section):
+        self._lines_by_section = lines_by_section
+        self._section_names = list(lines_by_section)
+        self._sections = {}
+
+    @classmethod
+    def parse(cls, lines):
+        """:param lines: the stats output, as text or an iterable of lines (e.g. an open file)"""
+        if isinstance(lines, str):
+            lines = lines.split('\n')
+        lines_by_section = {}
+        for line in lines:
+            if not line or line.startswith('#'):
+                continue
+            name, _, _ = line.partition('\t')
+            lines_by_section.setdefault(name, []).append(line.rstrip('\n'))
+        return cls(lines_by_section)
+
+    @classmethod
+    def from_file(cls, stats_fpath):
+        with open(stats_fpath) as f:
+            return cls.parse(f)
+
+    @property
+    def section_names(self):
+        return list(self._section_names)
+
+    def section(self, name):
+        """:return: StatsSection, or None if there is no such section"""
+        if name not in self._sections:
+            if name not in self._lines_by_section:
+                return None
+            self._sections[name] = StatsSection.from_lines(name, self._lines_by_section.pop(name))
+        return self._sections[name]
+
+
+def _values_differ(values_b, values_c, tolerance):
+    if len(values_b) != len(values_c):
+        return True
+    for value_b, value_c in zip(values_b, values_c):
+        if value_b == value_c or (math.isnan(value_b) and math.isnan(value_c)):
+            continue
+        if not tolerance or abs(value_b - value_c) > tolerance * max(abs(value_b), abs(value_c)):
+            return True
+    return False
+
+
+def _format_row(values):
+    return "[%s]" % ', '.join('%g' % value for value in values)
+
+
+def compare_sections(section_b, section_c, tolerance=0):
+    """
+    Compares a section of the stats of a BAM and of a CRAM.
+    :param tolerance: the maximum relative difference between two values, 0 for equal values
+    :return: list of errors, empty if the sections are the same
+    """
+    name = section_b.name
+    if section_b.keys == section_c.keys and section_b.offsets == section_c.offsets and \
+            section_b.values == section_c.values:
+        return []
+    rows_b, rows_c = section_b.rows(), section_c.rows()
+    errors = []
+    only_b = [key for key in section_b.keys if key not in rows_c]
+    only_c = [key for key in section_c.keys if key not in rows_b]
+    if only_b or only_c:
+        errors.append("STATS %s DIFFERENT: rows %s only in the BAM and %s only in the CRAM" %
+                      (name, only_b[:MAX_REPORTED_ROWS], only_c[:MAX_REPORTED_ROWS]))
+    differing = [key for key in section_b.keys if key in rows_c and _values_differ(rows_b[key], rows_c[key],
+                                                                                    tolerance)]
+    for key in differing[:MAX_REPORTED_ROWS]:
+        errors.append("STATS %s DIFFERENT for %s: %s and %s" % (name, key, _format_row(rows_b[key]),
+                                                                _format_row(rows_c[key])))
+    if len(differing) > MAX_REPORTED_ROWS:
+        errors.append("STATS %s DIFFERENT for %s more rows" % (name, len(differing) - MAX_REPORTED_ROWS))
+    return errors
+
+
+def compare_stats(stats_b, stats_c, tolerances=None, sections=None):
+    """
+    Compares all the sections of the stats of a BAM and of a CRAM, except for the IGNORED_SECTIONS.
+    :param stats_b: SamtoolsStats of the BAM
+    :param stats_c: SamtoolsStats of the CRAM
+    :param tolerances: dict of section name -> maximum relative difference of its values, 0 for the sections
+                       not in it (e.g. {'GCD': 0.01})
+    :param sections: if given, only these sections are compared
+    :return: list of errors, empty if all the sections are the same
+    """
+    tolerances = tolerances or {}
+    errors = []
+    names_b = [name for name in stats_b.section_names if name not in IGNORED_SECTIONS and
+               (sections is None or name in sections)]
+    names_c = [name for name in stats_c.section_names if name not in IGNORED_SECTIONS and
+               (sections is None or name in sections)]
+    for name in names_b:
+        if name not in names_c:
+            errors.append("STATS %s section only in the BAM" % name)
+            continue
+        errors.extend(compare_sections(stats_b.section(name), stats_c.section(name), tolerances.get(name, 0)))
+    errors.extend("STATS %s section only in the CRAM" % name for name in names_c if name not in names_b)
+    for error in errors:
+        logging.error(error)
+    return errors
+
+
+def compare_stats_files(stats_fpath_b, stats_fpath_c, tolerances=None, data_fpaths=None):
+    """
+    Compares all the sections of two samtools stats files, when they both have more than the CHK and SN sections
+    kept in memory by the checks (i.e. they are full samtools stats outputs).
+    :param data_fpaths: (BAM, CRAM) paths the stats files were generated from, stats files older than them aren't
+                        compared (the same check as when they are read instead of running samtools stats)
+    :return: list of errors, empty if all the sections are the same or the files aren't full stats outputs
+    """
+    if not os.path.isfile(stats_fpath_b) or not os.path.isfile(stats_fpath_c):
+        logging.warning("No stats files to compare all the sections of: %s and %s, comparing only the checksums" %
+                        (stats_fpath_b, stats_fpath_c))
+        return []
+    for data_fpath, stats_fpath in zip(data_fpaths or (), (stats_fpath_b, stats_fpath_c)):
+        if os.path.isfile(data_fpath) and utils.compare_mtimestamp(data_fpath, stats_fpath) >= 0:
+            logging.warning("The stats file %s is older than %s, comparing only the checksums" %
+                            (stats_fpath, data_fpath))
+            return []
+    stats_b, stats_c = SamtoolsStats.from_file(stats_fpath_b), SamtoolsStats.from_file(stats_fpath_c)
+    compact_sections = {'CHK', 'SN'}
+    if set(stats_b.section_names) <= compact_sections or set(stats_c.section_names) <= compact_sections:
+        logging.warning("The stats files %s and %s don't have all the sections, comparing only the summary numbers" %
+                        (stats_fpath_b, stats_fpath_c))
+        return compare_stats(stats_b, stats_c, tolerances, sections=compact_sections)
+    return compare_stats(stats_b, stats_c, tolerances)
@@ -0,0 +1,124 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import logging
+import threading
+
+
+class StreamConsumer:
+    """
+    Base class for the incremental consumers of a samtools output stream.
+    Each line of output is handed to consume() as soon as it is read, finish() is called
+    once the process has ended successfully, and abort() if it has failed.
+    """
+    def consume(self, line):
+        raise NotImplementedError()
+
+    def finish(self):
+        pass
+
+    def abort(self):
+        pass
+
+
+class ChecksumExtractor(StreamConsumer):
+    """Keeps the CHK line of samtools stats output."""
+    def __init__(self):
+        self.checksum = None
+
+    def consume(self, line):
+        if self.checksum is None and line.startswith('CHK'):
+            self.checksum = line.rstrip('\n')
+
+
+class SummaryNumbersParser(StreamConsumer):
+    """Parses the SN (Summary Numbers) lines of samtools stats output into a dict."""
+    def __init__(self):
+        self.summary = {}
+
+    def consume(self, line):
+        if not line.startswith('SN\t'):
+            return
+        tokens = line.rstrip('\n').split('\t')
+        if len(tokens) >= 3:
+            self.summary[tokens[1].rstrip(':')] = tokens[2]
+
+
+class SidecarWriter(StreamConsumer):
+    """
+    Writes the output to a file as it is read. The output goes first to a temporary file
+    which is moved in place only when the process has ended successfully, so a failed
+    or interrupted run never leaves a partial file behind.
+    """
+    def __init__(self, fpath):
+        self.fpath = fpath
+        self.tmp_fpath = "%s.%s.%s.tmp" % (fpath, os.getpid(), threading.get_ident())
+        self._file = None
+
+    def consume(self, line):
+        if self._file is None:
+            self._file = open(self.tmp_fpath, 'w')
+        self._file.write(line)
+
+    def finish(self):
+        if self._file is None:
+            return
+        self._file.close()
+        os.replace(self.tmp_fpath, self.fpath)
+        logging.info("Persisted the stats to disk in %s" % self.fpath)
+
+    def abort(self):
+        if self._file is None:
+            return
+        self._file.close()
+        try:
+            os.remove(self.tmp_fpath)
+        except OSError:
+            pass
+
+
+def feed_lines(lines, consumers):
+    for line in lines:
+        for consumer in consumers:
+            consumer.consume(line)
+
+
+def feed_chunks(stream, consumers, chunk_size):
+    """Hands a binary stream to the consumers in chunks of up to chunk_size bytes."""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        for consumer in consumers:
+            consumer.consume(chunk)
+
+
+def summary_stats_text(checksum, summary):
+    """
+    Builds a compact samtools stats text out of the CHK line and the SN fields,
+    which is all the comparison needs to keep in memory.
+    """
+    lines = []
+    if checksum:
+        lines.append(checksum)
+    for field, value in summary.items():
+        lines.append("SN\t%s:\t%s" % (field, value))
+    return '\n'.join(lines) + '\n'
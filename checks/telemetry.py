@@ -0,0 +1,138 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+_current = threading.local()
+_lock = threading.Lock()
+
+
+class Telemetry:
+    """
+    Collects the timings of the stages of a verification (quickcheck, flagstat, stats, cache reads and writes...)
+    for each file, together with the resource usage of the processes run by each stage.
+    A stage is entered with the stage() context manager, and the processes waited for with wait()
+    by the same thread (or by a thread that has resumed the stage) are recorded in it.
+    """
+    def __init__(self):
+        self.stages = []
+        self._start = time.monotonic()
+
+    @contextmanager
+    def stage(self, fpath, name):
+        record = {'file': fpath, 'stage': name, 'start': round(time.monotonic() - self._start, 6),
+                  'duration': None, 'processes': []}
+        start = time.monotonic()
+        try:
+            with resumed_stage(record):
+                yield record
+        finally:
+            record['duration'] = time.monotonic() - start
+            with _lock:
+                self.stages.append(record)
+
+    def as_dict(self):
+        """:return: the stages, sorted by start time, and the totals needed for sizing the jobs"""
+        with _lock:
+            stages = sorted(self.stages, key=lambda record: record['start'])
+        processes = [proc for record in stages for proc in record['processes']]
+        return {'stages': stages,
+                'duration': time.monotonic() - self._start,
+                'cpu_seconds': sum(proc['user_cpu'] + proc['system_cpu'] for proc in processes),
+                'max_rss_mb': max([proc['max_rss_mb'] for proc in processes] or [0]),
+                'read_bytes': sum(proc['read_bytes'] for proc in processes)}
+
+
+def current_stage():
+    """:return: the stage the current thread is in, None if it isn't in any"""
+    return getattr(_current, 'record', None)
+
+
+@contextmanager
+def resumed_stage(record):
+    """Makes the current thread record its processes in the stage given, e.g. for a thread working on shards."""
+    previous = current_stage()
+    _current.record = record
+    try:
+        yield record
+    finally:
+        _current.record = previous
+
+
+@contextmanager
+def stage(telemetry, fpath, name):
+    """Like Telemetry.stage, doing nothing if there isn't any telemetry."""
+    if telemetry is None:
+        yield None
+    else:
+        with telemetry.stage(fpath, name) as record:
+            yield record
+
+
+def _exit_code(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def wait(proc, started=None):
+    """
+    Waits for a process to end, like proc.wait(), recording its resource usage (from wait4) in the current stage.
+    The read bytes are the blocks the process read from the disks (ru_inblock), so they leave out the page cache.
+    :param started: time.monotonic() when the process was started, for recording its wall time
+    :return: the exit code of the process
+    """
+    try:
+        _, status, rusage = os.wait4(proc.pid, 0)
+    except ChildProcessError:
+        # Already waited for, e.g. by the poll() of a cancellation:
+        return proc.wait()
+    proc.returncode = _exit_code(status)
+    record = current_stage()
+    if record is not None:
+        with _lock:
+            record['processes'].append({'args': [str(arg) for arg in proc.args],
+                                        'exit_code': proc.returncode,
+                                        'wall_time': time.monotonic() - started if started else None,
+                                        'user_cpu': rusage.ru_utime,
+                                        'system_cpu': rusage.ru_stime,
+                                        'max_rss_mb': rusage.ru_maxrss / 1024.0,
+                                        'read_bytes': rusage.ru_inblock * 512})
+    return proc.returncode
+
+
+class TimedCache:
+    """Wraps a cache.StatsCache, recording each read and write as a cache_read or cache_write stage."""
+    def __init__(self, stats_cache, telemetry):
+        self.cache = stats_cache
+        self.telemetry = telemetry
+
+    def get_output(self, fpath, args_list):
+        with self.telemetry.stage(fpath, 'cache_read') as record:
+            output = self.cache.get_output(fpath, args_list)
+            record['hit'] = output is not None
+            return output
+
+    def put_output(self, fpath, args_list, output):
+        with self.telemetry.stage(fpath, 'cache_write'):
+            return self.cache.put_output(fpath, args_list, output)
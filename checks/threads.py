@@ -0,0 +1,128 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+from checks import capabilities
+
+
+def default_thread_budget():
+    """
+    The number of threads a run is allowed to use when none is given explicitly:
+    the number of slots reserved for the job, when running under LSF, otherwise None (no -@ given to samtools).
+    """
+    slots = os.environ.get('LSB_DJOB_NUMPROC')
+    if slots and slots.isdigit() and int(slots) > 0:
+        return int(slots)
+    return None
+
+
+def samtools_threads_args(threads, command=None):
+    """
+    :param threads: the total number of threads a samtools process may use, including its main thread
+    :param command: the samtools subcommand; if given, -@ is only passed when the installed samtools supports it
+    :return: the -@ argument for the process, which takes the number of *additional* threads
+    """
+    if threads and threads > 1 and (command is None or capabilities.supports_option(command, '-@')):
+        return ['-@', str(threads - 1)]
+    return []
+
+
+class ThreadAllocator:
+    """
+    Shares a budget of threads between the samtools processes of a run that are running at the same time.
+    Each file is registered with its size and the number of decoding stages (samtools processes) it still has to go
+    through. When a process starts, it gets a share of the free threads proportional to the remaining work of its file
+    (size x stages left), so that a bigger file gets more threads, and when the other file is done, the remaining one
+    gets the whole budget. The sum of the threads given out never goes above the budget: a process waits
+    for at least one thread to be freed if none is free.
+    """
+    def __init__(self, total_threads):
+        if not total_threads or total_threads < 1:
+            raise ValueError("The thread budget must be at least 1, received: %s" % total_threads)
+        self.total_threads = total_threads
+        self._free = total_threads
+        self._remaining_work = {}
+        self._condition = threading.Condition()
+
+    def register(self, fpath, size, stages):
+        with self._condition:
+            self._remaining_work[fpath] = [max(size, 1), stages]
+
+    def stage_done(self, fpath):
+        with self._condition:
+            if fpath in self._remaining_work:
+                self._remaining_work[fpath][1] = max(self._remaining_work[fpath][1] - 1, 0)
+
+    def file_done(self, fpath):
+        with self._condition:
+            self._remaining_work.pop(fpath, None)
+
+    def _share(self, fpath):
+        weights = {f: size * stages for f, (size, stages) in self._remaining_work.items() if stages > 0}
+        total_weight = sum(weights.values())
+        if fpath not in weights or not total_weight:
+            return self._free
+        return max(1, int(self.total_threads * weights[fpath] / total_weight))
+
+    @contextmanager
+    def allocate(self, fpath, max_threads=None, min_threads=1):
+        """
+        Context manager giving the number of threads a samtools process on fpath may use while it runs.
+        :param max_threads: upper limit for the threads given, e.g. 1 for each of many processes working
+                            on shards of the same file, which get their parallelism from running at the same time
+        :param min_threads: the threads to wait for before starting, e.g. 2 for a pipeline of 2 samtools processes,
+                            at most the whole budget
+        """
+        min_threads = min(min_threads, self.total_threads)
+        with self._condition:
+            while self._free < min_threads:
+                self._condition.wait()
+            threads = max(min(self._share(fpath), self._free, max_threads or self.total_threads), min_threads)
+            self._free -= threads
+        try:
+            yield threads
+        finally:
+            with self._condition:
+                self._free += threads
+                self._condition.notify_all()
+
+
+def split_threads(threads, parts):
+    """
+    Splits threads allocated at once between processes which run at the same time, e.g. the consumers of a stream,
+    each getting at least one.
+    :return: list of the threads of each process, all None if threads is None (no thread control)
+    """
+    if not threads:
+        return [threads] * parts
+    return [max(1, threads // parts + (1 if i >= parts - threads % parts else 0)) for i in range(parts)]
+
+
+@contextmanager
+def allocated_threads(allocator, fpath, max_threads=None, min_threads=1):
+    """Like ThreadAllocator.allocate, but gives None (no thread control) if there isn't any allocator."""
+    if allocator is None:
+        yield None
+    else:
+        with allocator.allocate(fpath, max_threads, min_threads) as threads:
+            yield threads
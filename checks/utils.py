@@ -65,6 +65,37 @@ def is_irods_path(path):
     return path.startswith('irods:')
 
 
+# The extensions of the indexes of each type of file
+INDEX_EXTENSIONS = {'.bam': ('.bai', '.csi'), '.cram': ('.crai',)}
+
+
+def find_index_file(fpath):
+    """
+    Looks for the index of a BAM (.bai or .csi) or CRAM (.crai) file, named either <file>.<ext> or
+    <file without extension>.<ext>. Only the indexes of its type are looked for, as a BAM and a CRAM
+    with the same name can be next to each other, e.g. a.bam with a.bai and a.cram with a.crai.
+    :return: the path to the index, or None if there isn't any
+    """
+    root, file_ext = os.path.splitext(fpath)
+    for ext in INDEX_EXTENSIONS.get(file_ext.lower(), ('.bai', '.csi', '.crai')):
+        for index_fpath in (fpath + ext, root + ext):
+            if os.path.isfile(index_fpath):
+                return index_fpath
+    return None
+
+
+def samtools_region(contig, start=None, end=None):
+    """
+    :return: the region in samtools format for the whole contig, or for the interval of it between start and end,
+             the contig being in braces if its name has a ':' (e.g. HLA-A*01:01:01:01), not to be taken for an interval
+    """
+    if ':' in contig:
+        contig = '{%s}' % contig
+    if start is None:
+        return contig
+    return "%s:%s-%s" % (contig, start, end)
+
+
 def compare_mtimestamp(fpath1, fpath2):
     if not fpath2 or not fpath1:
         raise ValueError("Both parameters neeed to be not None")
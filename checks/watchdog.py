@@ -0,0 +1,198 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import time
+import signal
+import logging
+import weakref
+import threading
+
+# How often the watched processes are checked, in seconds
+DEFAULT_POLL_INTERVAL = 1.0
+
+# The stage of a process which isn't a samtools command, e.g. iget streaming a file from iRODS
+FETCH_STAGE = 'fetch'
+# The stage of the reading of a CRAI by the index tier, which is done in process
+INDEX_STAGE = 'index'
+
+# The status of a pair whose verification had a process killed by the watchdog: it isn't known to differ,
+# so it can be verified again, e.g. on another host
+STALLED = 'stalled'
+
+STALLED_ERROR = "STALLED running process: %s, no progress for %s seconds"
+TIMEOUT_ERROR = "TIMEOUT running process: %s, killed after %s seconds"
+
+
+def process_stage(args_list):
+    """:return: the stage a command belongs to: the samtools subcommand (e.g. stats), or FETCH_STAGE"""
+    args_list = [str(arg) for arg in args_list]
+    if len(args_list) > 1 and os.path.basename(args_list[0]) == 'samtools':
+        return args_list[1]
+    return FETCH_STAGE
+
+
+def read_progress(pid):
+    """
+    :return: a counter which grows as long as the process does something: the bytes it read and wrote
+             (rchar and wchar of /proc/<pid>/io, including the pipes), or its CPU ticks if its I/O counters
+             can't be read. None if neither can be read (e.g. not on Linux), the process can't be seen as stalled then.
+    """
+    try:
+        with open('/proc/%s/io' % pid) as f:
+            counters = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(counters['rchar']) + int(counters['wchar'])
+    except (IOError, OSError, KeyError, ValueError):
+        pass
+    try:
+        with open('/proc/%s/stat' % pid) as f:
+            # The fields after the command name, which can contain spaces, starting at the state (field 3):
+            fields = f.read().rpartition(')')[2].split()
+        return int(fields[11]) + int(fields[12])
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+
+def kill_process_group(proc):
+    """Kills the process with SIGKILL, together with its process group if it leads one (see own_session)."""
+    try:
+        if os.getpgid(proc.pid) == proc.pid:
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def run_within_timeout(func, cancellation, stage, description):
+    """
+    Runs a function which can block outside of any process, e.g. reading a file on a hung NFS mount, giving up
+    on it after the timeout of its stage (or else the stall timeout) of the watchdog of the cancellation, if any.
+    A thread can't be killed, so the function is left running in a daemon thread then.
+    :param description: what the function does, for the error
+    :raises RuntimeError: with TIMEOUT_ERROR, if the function runs for longer than the timeout
+    """
+    pair_watchdog = cancellation.watchdog if cancellation is not None else None
+    timeout = pair_watchdog.stage_timeouts.get(stage, pair_watchdog.stall_timeout) if pair_watchdog else None
+    if timeout is None:
+        return func()
+    outcome = {}
+
+    def run():
+        try:
+            outcome['value'] = func()
+        except Exception as e:
+            outcome['error'] = e
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        error = TIMEOUT_ERROR % (description, timeout)
+        logging.error(error)
+        raise RuntimeError(error)
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['value']
+
+
+def is_stalled(errors):
+    """:return: True if the errors include a process killed by a watchdog, i.e. the files weren't fully checked"""
+    return any(error.startswith(('STALLED ', 'TIMEOUT ')) for error in errors)
+
+
+class Watchdog:
+    """
+    Watches the processes of a verification from a single thread, killing (with their process group) those
+    that run longer than the timeout of their stage, or whose I/O counters don't move for stall_timeout seconds,
+    e.g. samtools blocked on a hung NFS mount or iget on an unresponsive iRODS server. The reason a process
+    was killed is kept, for the caller to report it instead of its exit code.
+    """
+
+    def __init__(self, stage_timeouts=None, stall_timeout=None, poll_interval=DEFAULT_POLL_INTERVAL):
+        """
+        :param stage_timeouts: dict of stage (see process_stage) -> maximum wall time of its processes, in seconds
+        :param stall_timeout: the seconds after which a process without progress (see read_progress) is killed
+        :param poll_interval: how often the processes are checked, in seconds
+        """
+        self.stage_timeouts = dict(stage_timeouts or {})
+        self.stall_timeout = stall_timeout
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._watched = {}
+        self._errors = weakref.WeakKeyDictionary()
+        self._thread = None
+
+    def watch(self, proc):
+        """Starts watching a running process."""
+        now = time.monotonic()
+        stage = process_stage(proc.args)
+        with self._lock:
+            self._watched[proc] = {'stage': stage, 'timeout': self.stage_timeouts.get(stage), 'started': now,
+                                   'progress': read_progress(proc.pid), 'progressed': now}
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def unwatch(self, proc):
+        """Stops watching a process, to be called once it has been waited for."""
+        with self._lock:
+            self._watched.pop(proc, None)
+
+    def error(self, proc):
+        """:return: the error of the process if it was killed by the watchdog, None otherwise"""
+        with self._lock:
+            return self._errors.get(proc)
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                if not self._watched:
+                    self._thread = None
+                    return
+                watched = list(self._watched.items())
+            for proc, state in watched:
+                error = self.check(proc, state, time.monotonic())
+                if not error:
+                    continue
+                with self._lock:
+                    # Not killing a process which has been waited for meanwhile, its pid could have been reused:
+                    if self._watched.pop(proc, None) is None:
+                        continue
+                    self._errors[proc] = error
+                    logging.error("Killing the process group of %s: %s" % (proc.args, error))
+                    kill_process_group(proc)
+
+    def check(self, proc, state, now):
+        """
+        Updates the progress of a watched process.
+        :param state: the dict kept for the process since it's watched
+        :return: the error if the process needs to be killed, None otherwise
+        """
+        if state['timeout'] is not None and now - state['started'] > state['timeout']:
+            return TIMEOUT_ERROR % (proc.args, state['timeout'])
+        if self.stall_timeout is None:
+            return None
+        progress = read_progress(proc.pid)
+        if progress is None or progress != state['progress']:
+            state['progress'], state['progressed'] = progress, now
+        elif now - state['progressed'] > self.stall_timeout:
+            return STALLED_ERROR % (proc.args, self.stall_timeout)
+        return None
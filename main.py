@@ -20,20 +20,169 @@ This file has been created on Feb 10, 2016.
 """
 import os
 import sys
+import json
 import argparse
 import logging
-from checks.stats_checks import RunSamtoolsCommands, CompareStatsForFiles
+from concurrent.futures import ThreadPoolExecutor
+from checks.stats_checks import RunSamtoolsCommands, CompareStatsForFiles, TIERS
 from checks import utils
+from checks import threads
+from checks import cache
+from checks import telemetry
+from checks import reference
+from checks import localize
+from checks import checksums
+from checks import batch
+
+
+def add_comparison_args(parser):
+    """Adds the arguments controlling how a BAM and a CRAM are compared, shared by all the entry points."""
+    parser.add_argument('--single-decode', action='store_true', dest='single_decode',
+                        help="Decode each file only once, comparing the flagstat counters from samtools stats")
+    parser.add_argument('--shard-stats', action='store_true', dest='shard_stats',
+                        help="Run samtools stats in parallel per contig for indexed files")
+    parser.add_argument('--chunk-size', type=int, dest='chunk_size',
+                        help="Together with --shard-stats, split the contigs in chunks of this many bases")
+    parser.add_argument('--threads', type=int, default=threads.default_thread_budget(),
+                        help="Total number of threads shared by the samtools processes "
+                             "(by default the number of slots of the LSF job, if any)")
+    parser.add_argument('--fail-fast', action='store_true', dest='fail_fast',
+                        help="Stop all the samtools processes of a pair as soon as any check fails")
+    parser.add_argument('--tiers',
+                        help="Comma separated verification tiers to go through, stopping at the first difference, "
+                             "out of: %s (default: all of them). E.g. header,index for a quick check without "
+                             "decoding the files" % ','.join(TIERS))
+    parser.add_argument('--fetch-command', dest='fetch_command',
+                        help="Command writing an iRODS file to stdout, {path} being replaced by its path, used for "
+                             "streaming the irods: files to samtools (default: $BAM2CRAM_FETCH_COMMAND or "
+                             "'iget {path} -')")
+    parser.add_argument('--reference', help="FASTA file (optionally gzipped) of the reference of the CRAM files, "
+                                            "whose sequences are added to the reference cache, if not there already")
+    parser.add_argument('--ref-cache', dest='ref_cache',
+                        help="Directory of the reference cache the CRAM files are decoded with, used whenever "
+                             "this or --reference are given (default: $BAM2CRAM_REF_CACHE or %s)" %
+                             reference.DEFAULT_REF_CACHE_DIR)
+    parser.add_argument('--all-sections', action='store_true', dest='all_sections',
+                        help="Compare all the sections of the samtools stats outputs (SN, FFQ, LFQ, GCD, RL, COV...), "
+                             "not only the checksums")
+    parser.add_argument('--stats-tolerance', action='append', dest='stats_tolerances', metavar='SECTION=FRACTION',
+                        help="Maximum relative difference of the values of a stats section, with --all-sections, "
+                             "e.g. GCD=0.01 (can be given several times, the other sections must be equal)")
+    parser.add_argument('--digests', action='store_true',
+                        help="Compute the MD5 (and the CRC32 and size) of the files while checking them, reading each "
+                             "file only once: it is streamed to samtools flagstat and stats instead of being read "
+                             "by each of them")
+    parser.add_argument('--stage-timeout', action='append', dest='stage_timeouts', metavar='STAGE=SECONDS',
+                        help="Kill the processes of a stage (quickcheck, flagstat, stats, view, idxstats or fetch) "
+                             "running for longer than this, e.g. stats=7200, and give up reading a CRAI after the "
+                             "time of the index stage (can be given several times)")
+    parser.add_argument('--stall-timeout', type=float, dest='stall_timeout', metavar='SECONDS',
+                        help="Kill the processes whose I/O hasn't progressed for this long, e.g. blocked on a hung "
+                             "filesystem; the pair is reported as stalled, for the batches to verify it again")
+    parser.add_argument('--cache', help="Cache of the samtools outputs: a directory, or sqlite:<database file>")
+    parser.add_argument('--cache-max-mb', type=int, dest='cache_max_mb', help="Maximum size of the cache, in MB")
+
+
+def get_comparison_kwargs(args):
+    """:return: the keyword arguments for CompareStatsForFiles.verify_bam_and_cram"""
+    stats_cache = None
+    if args.cache:
+        max_bytes = args.cache_max_mb * 1024 * 1024 if args.cache_max_mb else None
+        stats_cache = cache.open_cache(args.cache, max_bytes)
+    stats_tolerances = {}
+    for tolerance in args.stats_tolerances or []:
+        section, _, fraction = tolerance.partition('=')
+        stats_tolerances[section] = float(fraction)
+    stage_timeouts = {}
+    for timeout in args.stage_timeouts or []:
+        stage, _, seconds = timeout.partition('=')
+        stage_timeouts[stage] = float(seconds)
+    return {'single_decode': args.single_decode, 'shard_stats': args.shard_stats, 'chunk_size': args.chunk_size,
+            'threads': args.threads, 'cache': stats_cache, 'fail_fast': args.fail_fast,
+            'tiers': args.tiers.split(',') if args.tiers else None, 'fetch_command': args.fetch_command,
+            'all_sections': args.all_sections,
+            'stats_tolerances': stats_tolerances, 'compute_digests': args.digests, 'stage_timeouts': stage_timeouts,
+            'stall_timeout': args.stall_timeout}
+
+
+def setup_reference(args):
+    """
+    Populates the reference cache from --reference and makes all the samtools processes decode the CRAM files
+    with it, if either --reference or --ref-cache are given.
+    :return: the directory of the reference cache, or None if the references are resolved as samtools does by default
+    """
+    if not args.reference and not args.ref_cache:
+        return None
+    cache_dir = os.path.expanduser(args.ref_cache) if args.ref_cache else reference.default_ref_cache_dir()
+    if args.reference:
+        reference.populate_ref_cache(args.reference, cache_dir)
+    reference.use_ref_cache(cache_dir)
+    return cache_dir
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument('-b', help="File path to the BAM file", required=True)
-    parser.add_argument('-c', help="File path to the CRAM file", required=True)
+    parser.add_argument('-b', help="File path to the BAM file")
+    parser.add_argument('-c', nargs='+', help="File path to the CRAM file, or to several CRAM files made out of "
+                                              "the same BAM, which is then checked only once")
+    parser.add_argument('--manifest', help="File with one pair per line, instead of -b and -c: the BAM and CRAM "
+                                           "paths separated by a tab, or a JSON object with the bam and cram paths, "
+                                           "optionally followed by the expected MD5s and sizes of the files")
+    parser.add_argument('--results', help="File path for the results of the pairs of the manifest, one JSON object "
+                                          "per line, written as soon as each pair is checked (default: stdout)")
+    parser.add_argument('-j', '--jobs', type=int, help="Number of pairs of the manifest checked at the same time "
+                                                       "(by default the number of CPUs divided by --threads)")
     parser.add_argument('-e', help="File path to the error file", required=False)
     parser.add_argument('--log', help="File path to the log file", required=False)
+    parser.add_argument('--telemetry', help="File path for the timings of the stages and the resource usage "
+                                            "of the samtools processes, as JSON", required=False)
+    add_comparison_args(parser)
+    parser.add_argument('--digests-output', dest='digests_output',
+                        help="File path for the digests of the files computed with --digests, as JSON")
+    parser.add_argument('--localize', action='store_true',
+                        help="If the stats checksums of indexed files differ, find the regions where they differ "
+                             "and report the reads of each file that aren't in the other there")
+    parser.add_argument('--breakdown', action='store_true',
+                        help="If the stats checksums differ, decode both files again computing the checksums "
+                             "of each read group and of each contig, and report those that differ")
     parser.add_argument('-v', action='count')
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.manifest:
+        if args.b or args.c:
+            parser.error("-b and -c can't be used with --manifest")
+        if args.localize or args.breakdown:
+            parser.error("--localize and --breakdown can't be used with --manifest")
+        return args
+    if not args.b or not args.c:
+        parser.error("-b and -c are required, unless a --manifest is given")
+    if len(args.c) > 1 and args.tiers:
+        parser.error("--tiers can't be used with several CRAM files")
+    return args
+
+
+def verify_manifest(args):
+    """
+    Verifies the pairs of the manifest in this process, writing the result of each pair as a line of JSON
+    as soon as it's done.
+    :return: the number of pairs that failed
+    """
+    setup_reference(args)
+    jobs = args.jobs or max(1, os.cpu_count() // (args.threads or 2))
+    output = open(args.results, 'w') if args.results else sys.stdout
+    total, failed = 0, 0
+    try:
+        for result in batch.verify_pairs(batch.iter_manifest(args.manifest), jobs, get_comparison_kwargs(args)):
+            output.write(json.dumps(result) + '\n')
+            output.flush()
+            total += 1
+            if result['errors']:
+                failed += 1
+            logging.info("%s and %s: %s" % (result['bam'], result['cram'], result['status']))
+    finally:
+        if args.results:
+            output.close()
+    logging.info("%s pairs checked: %s passed, %s failed" % (total, total - failed, failed))
+    return failed
 
 
 # To make the default logging to be stdout
@@ -42,20 +191,77 @@ def main():
     log_level = (logging.CRITICAL - 10 * args.v) if args.v else logging.INFO
     log_file = args.log if args.log else 'compare_b2c.log'
     logging.basicConfig(level=log_level, format='%(levelname)s - %(asctime)s %(message)s', filename=log_file)
-    if args.b and args.c:
+    if args.manifest:
+        if verify_manifest(args):
+            sys.exit(1)
+    elif args.b and args.c:
         bam_path = args.b
-        cram_path = args.c
+        cram_paths = args.c
 
         if not utils.is_irods_path(bam_path) and not os.path.isfile(bam_path):
             logging.error("This is not a file path: %s" % bam_path)
             #sys.exit(1)
             raise ValueError("This is not a file path: %s")
-        if not utils.is_irods_path(cram_path) and not os.path.isfile(cram_path):
-            logging.error("This is not a file path: %s" % cram_path)
-            #sys.exit(1)
-            raise ValueError("This is not a file path: %s")
+        for cram_path in cram_paths:
+            if not utils.is_irods_path(cram_path) and not os.path.isfile(cram_path):
+                logging.error("This is not a file path: %s" % cram_path)
+                #sys.exit(1)
+                raise ValueError("This is not a file path: %s")
+
+        ref_cache_dir = setup_reference(args)
+        for cram_path in cram_paths:
+            if ref_cache_dir and not utils.is_irods_path(cram_path):
+                try:
+                    header = RunSamtoolsCommands.get_samtools_header_output(cram_path)
+                except (RuntimeError, OSError) as e:
+                    logging.error("Can't read the header of %s: %s" % (cram_path, e))
+                    continue
+                missing = reference.missing_references(header, ref_cache_dir)
+                if missing:
+                    logging.warning("The references of %s for %s are not in the reference cache %s" %
+                                    (', '.join(missing), cram_path, ref_cache_dir))
 
-        errors = CompareStatsForFiles.compare_bam_and_cram_by_statistics(bam_path, cram_path)
+        if len(cram_paths) == 1:
+            verification = CompareStatsForFiles.verify_bam_and_cram(bam_path, cram_paths[0],
+                                                                    **get_comparison_kwargs(args))
+            errors = verification['errors']
+            logging.info("Verification tier reached: %s" % verification['tier'])
+            telemetry_summary = verification['telemetry']
+            file_digests = verification['digests']
+            checksums_differ = any(err.startswith("STATS SEQUENCE CHECKSUM DIFFERENT") for err in errors)
+            if args.breakdown and checksums_differ:
+                if utils.is_irods_path(bam_path) or utils.is_irods_path(cram_paths[0]):
+                    logging.error("Can't break down the checksums of iRODS files")
+                else:
+                    file_threads = args.threads // 2 if args.threads else None
+                    with ThreadPoolExecutor(max_workers=2) as executor:
+                        checksums_b, checksums_c = executor.map(
+                            lambda fpath: checksums.compute_checksums(fpath, file_threads), [bam_path, cram_paths[0]])
+                    errors.extend(checksums.compare_checksums(checksums_b, checksums_c))
+            if args.localize and checksums_differ:
+                try:
+                    differences = localize.localize_checksum_differences(bam_path, cram_paths[0],
+                                                                         max_workers=args.threads)
+                    errors.extend(localize.format_differences(differences))
+                except ValueError as e:
+                    logging.error("Can't localize the checksum differences: %s" % e)
+        else:
+            compare_kwargs = get_comparison_kwargs(args)
+            for arg in ('tiers', 'fail_fast'):
+                compare_kwargs.pop(arg)
+            compare_kwargs['telemetry'] = telemetry.Telemetry()
+            file_digests = compare_kwargs['digests'] = {} if compare_kwargs.pop('compute_digests') else None
+            all_errors = CompareStatsForFiles.compare_bam_and_crams_by_statistics(bam_path, cram_paths,
+                                                                                 **compare_kwargs)
+            errors = ["%s: %s" % (cram_path, err) for cram_path in cram_paths for err in all_errors[cram_path]]
+            telemetry_summary = compare_kwargs['telemetry'].as_dict()
+        if args.telemetry:
+            utils.write_to_file(args.telemetry, json.dumps(telemetry_summary, indent=2))
+        for fpath, digests in sorted((file_digests or {}).items()):
+            logging.info("MD5 of %s: %s (CRC32: %s, size: %s)" % (fpath, digests['md5'], digests['crc32'],
+                                                                 digests['size']))
+        if args.digests_output and file_digests is not None:
+            utils.write_to_file(args.digests_output, json.dumps(file_digests, indent=2))
         if errors:
             if args.e:
                 err_f = open(args.e, 'w')
@@ -0,0 +1,206 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import sys
+import time
+import asyncio
+from unittest import mock, IsolatedAsyncioTestCase
+from checks import async_checks
+from checks import streaming
+
+SLEEP_CMD = [sys.executable, '-c', 'import time; time.sleep(30)']
+
+
+class TestAsyncRunSamtoolsCommands(IsolatedAsyncioTestCase):
+
+    async def test_run_subprocess(self):
+        result = await async_checks.AsyncRunSamtoolsCommands._run_subprocess([sys.executable, '-c', 'print("out")'])
+        self.assertEqual(result, 'out\n')
+
+    async def test_run_subprocess_error(self):
+        with self.assertRaises(RuntimeError):
+            await async_checks.AsyncRunSamtoolsCommands._run_subprocess([sys.executable, '-c',
+                                                                         'import sys; sys.exit(1)'])
+
+    async def test_run_subprocess_timeout(self):
+        start = time.time()
+        with self.assertRaises(RuntimeError) as context:
+            await async_checks.AsyncRunSamtoolsCommands._run_subprocess(SLEEP_CMD, timeout=0.2)
+        self.assertTrue(str(context.exception).startswith('TIMEOUT'))
+        self.assertLess(time.time() - start, 10)
+
+    @mock.patch('checks.async_checks.asyncio.create_subprocess_exec')
+    async def test_run_subprocess_cancelled_kills_process(self, mock_exec):
+        procs = []
+
+        async def create_subprocess_exec(*args, **kwargs):
+            procs.append(await asyncio.subprocess.create_subprocess_exec(*args, **kwargs))
+            return procs[-1]
+        mock_exec.side_effect = create_subprocess_exec
+        task = asyncio.ensure_future(async_checks.AsyncRunSamtoolsCommands._run_subprocess(SLEEP_CMD))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertIsNotNone(procs[0].returncode)
+
+    async def test_stream_subprocess(self):
+        checksum, summary = streaming.ChecksumExtractor(), streaming.SummaryNumbersParser()
+        await async_checks.AsyncRunSamtoolsCommands._stream_subprocess(
+            [sys.executable, '-c', 'print("CHK\\t1\\t2\\t3\\nSN\\treads mapped:\\t10")'], [checksum, summary])
+        self.assertEqual(checksum.checksum, 'CHK\t1\t2\t3')
+        self.assertEqual(summary.summary, {'reads mapped': '10'})
+
+    async def test_stream_subprocess_error_aborts_consumers(self):
+        consumer = mock.Mock()
+        with self.assertRaises(RuntimeError):
+            await async_checks.AsyncRunSamtoolsCommands._stream_subprocess(
+                [sys.executable, '-c', 'import sys; print("CHK"); sys.exit(1)'], [consumer])
+        self.assertTrue(consumer.abort.called)
+        self.assertFalse(consumer.finish.called)
+
+
+class TestAsyncCompareStatsForFiles(IsolatedAsyncioTestCase):
+
+    @mock.patch('checks.async_checks.CompareStatsForFiles._check_file_paths', mock.Mock(return_value=[]))
+    @mock.patch('checks.async_checks.CompareStatsForFiles._check_samtools_version', mock.Mock(return_value=[]))
+    @mock.patch('checks.async_checks.AsyncRunSamtoolsCommands.get_samtools_stats_output')
+    @mock.patch('checks.async_checks.AsyncRunSamtoolsCommands.get_samtools_flagstat_output')
+    @mock.patch('checks.async_checks.AsyncRunSamtoolsCommands.run_samtools_quickcheck')
+    async def test_compare_bam_and_cram_by_statistics(self, mock_quickcheck, mock_flagstat, mock_stats):
+        mock_flagstat.return_value = 'flag'
+        mock_stats.side_effect = ['CHK\t1\t2\t3\n', 'CHK\t1\t2\t4\n']
+        result = await async_checks.AsyncCompareStatsForFiles.compare_bam_and_cram_by_statistics('some bam',
+                                                                                                 'some cram')
+        self.assertEqual(len(result), 1)
+        mock_flagstat.assert_called_with('some cram', None, None)
+
+    @mock.patch('checks.async_checks.CompareStatsForFiles._check_file_paths', mock.Mock(return_value=[]))
+    @mock.patch('checks.async_checks.CompareStatsForFiles._check_samtools_version', mock.Mock(return_value=[]))
+    @mock.patch('checks.async_checks.AsyncRunSamtoolsCommands.get_samtools_stats_output')
+    @mock.patch('checks.async_checks.AsyncRunSamtoolsCommands.get_samtools_flagstat_output')
+    @mock.patch('checks.async_checks.AsyncRunSamtoolsCommands.run_samtools_quickcheck')
+    async def test_compare_bam_and_cram_quickcheck_fails(self, mock_quickcheck, mock_flagstat, mock_stats):
+        mock_quickcheck.side_effect = [None, RuntimeError('quickcheck failed')]
+        mock_stats.return_value = 'CHK\t1\t2\t3\n'
+        result = await async_checks.AsyncCompareStatsForFiles.compare_bam_and_cram_by_statistics('some bam',
+                                                                                                 'some cram')
+        self.assertEqual(result, ['quickcheck failed'])
+
+    @mock.patch('checks.async_checks.CompareStatsForFiles._check_file_paths', mock.Mock(return_value=[]))
+    @mock.patch('checks.async_checks.CompareStatsForFiles._check_samtools_version', mock.Mock(return_value=[]))
+    @mock.patch('checks.async_checks.AsyncRunSamtoolsCommands.get_samtools_stats_output')
+    @mock.patch('checks.async_checks.AsyncRunSamtoolsCommands.run_samtools_quickcheck')
+    async def test_compare_bam_and_cram_quickcheck_fails_cancels_other_file(self, mock_quickcheck, mock_stats):
+        cancelled = []
+
+        async def get_samtools_stats_output(fpath, threads, timeout):
+            try:
+                await asyncio.sleep(30)
+            except asyncio.CancelledError:
+                cancelled.append(fpath)
+                raise
+
+        async def run_samtools_quickcheck(fpath, timeout):
+            if fpath == 'some cram':
+                await asyncio.sleep(0.1)
+                raise RuntimeError('quickcheck failed')
+        mock_quickcheck.side_effect = run_samtools_quickcheck
+        mock_stats.side_effect = get_samtools_stats_output
+        start = time.time()
+        result = await async_checks.AsyncCompareStatsForFiles.compare_bam_and_cram_by_statistics(
+            'some bam', 'some cram', single_decode=True)
+        self.assertEqual(result, ['quickcheck failed'])
+        self.assertEqual(cancelled, ['some bam'])
+        self.assertLess(time.time() - start, 10)
+
+    @mock.patch('checks.async_checks.CompareStatsForFiles._check_file_paths', mock.Mock(return_value=[]))
+    @mock.patch('checks.async_checks.CompareStatsForFiles._check_samtools_version')
+    @mock.patch('checks.async_checks.AsyncRunSamtoolsCommands.run_samtools_quickcheck')
+    async def test_compare_bam_and_cram_old_samtools(self, mock_quickcheck, mock_version):
+        mock_version.return_value = ['You need to use at least samtools version 1.3.']
+        result = await async_checks.AsyncCompareStatsForFiles.compare_bam_and_cram_by_statistics('some bam',
+                                                                                                 'some cram')
+        self.assertEqual(result, ['You need to use at least samtools version 1.3.'])
+        self.assertFalse(mock_quickcheck.called)
+
+
+class TestVerifyPairs(IsolatedAsyncioTestCase):
+
+    @mock.patch('checks.async_checks.AsyncCompareStatsForFiles.compare_bam_and_cram_by_statistics')
+    async def test_verify_pair(self, mock_compare):
+        mock_compare.return_value = ['FLAGSTAT DIFFERENT']
+        result = await async_checks.verify_pair('a.bam', 'a.cram', single_decode=True)
+        mock_compare.assert_called_once_with('a.bam', 'a.cram', single_decode=True)
+        self.assertEqual(result['status'], 'failed')
+        self.assertEqual(result['errors'], ['FLAGSTAT DIFFERENT'])
+
+    @mock.patch('checks.async_checks.AsyncCompareStatsForFiles.compare_bam_and_cram_by_statistics')
+    async def test_verify_pairs_bounded(self, mock_compare):
+        running = []
+        max_running = []
+
+        async def compare(bam_path, cram_path):
+            running.append(bam_path)
+            max_running.append(len(running))
+            await asyncio.sleep(0.01 if bam_path == 'a.bam' else 0.05)
+            running.remove(bam_path)
+            return [] if bam_path != 'c.bam' else ['some error']
+        mock_compare.side_effect = compare
+        pairs = [('%s.bam' % name, '%s.cram' % name) for name in 'abcdef']
+        results = [result async for result in async_checks.verify_pairs(pairs, max_concurrent=2)]
+        self.assertEqual(len(results), 6)
+        self.assertEqual(results[0]['bam'], 'a.bam')
+        self.assertEqual(max(max_running), 2)
+        self.assertEqual([result['bam'] for result in results if result['errors']], ['c.bam'])
+
+    @mock.patch('checks.async_checks.AsyncCompareStatsForFiles.compare_bam_and_cram_by_statistics')
+    async def test_verify_pairs_pulls_pairs_lazily(self, mock_compare):
+        pulled = []
+
+        def pairs():
+            for i in range(1000):
+                pulled.append(i)
+                yield 'bam%s' % i, 'cram%s' % i
+
+        async def compare(bam_path, cram_path):
+            return []
+        mock_compare.side_effect = compare
+        results = async_checks.verify_pairs(pairs(), max_concurrent=2)
+        await results.__anext__()
+        self.assertLessEqual(len(pulled), 3)
+        await results.aclose()
+
+    @mock.patch('checks.async_checks.AsyncCompareStatsForFiles.compare_bam_and_cram_by_statistics')
+    async def test_verify_pairs_closed_early(self, mock_compare):
+        cancelled = []
+
+        async def compare(bam_path, cram_path):
+            try:
+                await asyncio.sleep(0 if bam_path == 'a.bam' else 30)
+            except asyncio.CancelledError:
+                cancelled.append(bam_path)
+                raise
+            return []
+        mock_compare.side_effect = compare
+        results = async_checks.verify_pairs([('a.bam', 'a.cram'), ('b.bam', 'b.cram')])
+        self.assertEqual((await results.__anext__())['bam'], 'a.bam')
+        await results.aclose()
+        self.assertEqual(cancelled, ['b.bam'])
@@ -0,0 +1,196 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import json
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, TestCase
+from checks import batch
+
+
+class TestFindPairs(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.bam_dir = os.path.join(self.tmp_dir.name, 'bams')
+        self.cram_dir = os.path.join(self.tmp_dir.name, 'crams')
+        os.makedirs(self.bam_dir)
+        os.makedirs(self.cram_dir)
+        for fpath in ('bams/a.bam', 'bams/b.bam', 'bams/c.bam', 'bams/a.bai', 'crams/a.bam.cram', 'crams/b.cram'):
+            open(os.path.join(self.tmp_dir.name, fpath), 'w').close()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_find_pairs(self):
+        result = batch.find_pairs(self.bam_dir, self.cram_dir)
+        self.assertEqual(result, [(os.path.join(self.bam_dir, 'a.bam'), os.path.join(self.cram_dir, 'a.bam.cram')),
+                                  (os.path.join(self.bam_dir, 'b.bam'), os.path.join(self.cram_dir, 'b.cram'))])
+
+
+class TestReadManifest(TestCase):
+
+    def test_read_manifest(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.tsv') as manifest:
+            manifest.write("# bam\tcram\n/data/a.bam\t/data/a.cram\n\n/data/b.bam\t/data/b.cram\n")
+            manifest.flush()
+            result = batch.read_manifest(manifest.name)
+        self.assertEqual(result, [('/data/a.bam', '/data/a.cram'), ('/data/b.bam', '/data/b.cram')])
+
+    def test_read_manifest_missing_cram(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.tsv') as manifest:
+            manifest.write("/data/a.bam\n")
+            manifest.flush()
+            self.assertRaises(ValueError, batch.read_manifest, manifest.name)
+
+
+class TestIterManifest(TestCase):
+
+    def test_iter_manifest(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.tsv') as manifest:
+            manifest.write("/data/a.bam\t/data/a.cram\tcram_md5=abc\tbam_size=12\n"
+                           '{"bam": "/data/b.bam", "cram": "/data/b.cram", "bam_md5": "def"}\n'
+                           '{"bam": "/data/c.bam", "cram": "/data/c.cram", "expected": {"cram_size": 3}}\n')
+            manifest.flush()
+            result = list(batch.iter_manifest(manifest.name))
+        self.assertEqual(result, [{'bam': '/data/a.bam', 'cram': '/data/a.cram',
+                                   'expected': {'cram_md5': 'abc', 'bam_size': '12'}},
+                                  {'bam': '/data/b.bam', 'cram': '/data/b.cram', 'expected': {'bam_md5': 'def'}},
+                                  {'bam': '/data/c.bam', 'cram': '/data/c.cram', 'expected': {'cram_size': 3}}])
+
+    def test_iter_manifest_unknown_expected_value(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.tsv') as manifest:
+            manifest.write('{"bam": "/data/b.bam", "cram": "/data/b.cram", "reads": 10}\n')
+            manifest.flush()
+            self.assertRaises(ValueError, list, batch.iter_manifest(manifest.name))
+
+    def test_iter_manifest_invalid_json(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl') as manifest:
+            manifest.write('{"bam": "/data/b.bam", \n')
+            manifest.flush()
+            self.assertRaises(ValueError, list, batch.iter_manifest(manifest.name))
+
+    def test_check_expected(self):
+        result = {'bam': 'a.bam', 'cram': 'a.cram', 'digests': {'a.cram': {'md5': 'ABC', 'size': 12}}}
+        self.assertEqual(batch.check_expected(result, {'cram_md5': 'abc', 'cram_size': 12}), [])
+        self.assertEqual(batch.check_expected(result, {'cram_size': '13', 'bam_md5': 'abc'}),
+                         ["The md5 of a.bam wasn't computed, expected abc", "The size of a.cram is 12, expected 13"])
+
+
+class TestVerifyPairs(TestCase):
+
+    @mock.patch('checks.batch.CompareStatsForFiles.verify_bam_and_cram')
+    def test_verify_pairs(self, mock_compare):
+        mock_compare.side_effect = lambda bam_path, cram_path, **kwargs: {
+            'errors': [], 'tier': 'full', 'digests': {cram_path: {'md5': 'abc', 'size': 1}} if kwargs else None}
+        entries = [{'bam': 'a.bam', 'cram': 'a.cram'},
+                   {'bam': 'b.bam', 'cram': 'b.cram', 'expected': {'cram_md5': 'abc'}},
+                   {'bam': 'c.bam', 'cram': 'c.cram', 'expected': {'cram_md5': 'def'}}]
+        results = sorted(batch.verify_pairs(iter(entries), 2), key=lambda result: result['bam'])
+        self.assertEqual([result['status'] for result in results], ['passed', 'passed', 'failed'])
+        self.assertEqual(results[2]['errors'], ["The md5 of c.cram is abc, expected def"])
+        self.assertEqual(results[1]['expected'], {'cram_md5': 'abc'})
+        mock_compare.assert_any_call('a.bam', 'a.cram')
+        mock_compare.assert_any_call('b.bam', 'b.cram', compute_digests=True)
+
+    @mock.patch('checks.batch.verify_pair')
+    def test_verify_pairs_reads_the_entries_lazily(self, mock_verify_pair):
+        started = []
+        mock_verify_pair.side_effect = lambda bam_path, cram_path, compare_kwargs: started.append(bam_path) or {
+            'bam': bam_path, 'cram': cram_path, 'status': 'passed', 'errors': []}
+        entries_read = []
+
+        def entries():
+            for name in 'abcdef':
+                entries_read.append(name)
+                yield {'bam': name + '.bam', 'cram': name + '.cram'}
+
+        results = batch.verify_pairs(entries(), 2)
+        next(results)
+        self.assertLessEqual(len(entries_read), 3)
+        self.assertEqual(len(list(results)), 5)
+        self.assertEqual(len(started), 6)
+
+
+class TestPairName(TestCase):
+
+    def test_pair_name(self):
+        name = batch.pair_name('/zone/run1/a.bam', '/zone/run1/a.cram')
+        self.assertTrue(name.startswith('a.'))
+        self.assertNotEqual(name, batch.pair_name('/zone/run2/a.bam', '/zone/run2/a.cram'))
+        self.assertEqual(name, batch.pair_name('/zone/run1/a.bam', '/zone/run1/a.cram'))
+
+
+class TestRunBatch(TestCase):
+
+    @mock.patch('checks.batch.CompareStatsForFiles.verify_bam_and_cram')
+    def test_verify_pair(self, mock_compare):
+        mock_compare.return_value = {'errors': ['FLAGSTAT DIFFERENT'], 'tier': 'full'}
+        result = batch.verify_pair('a.bam', 'a.cram', {'single_decode': True})
+        mock_compare.assert_called_once_with('a.bam', 'a.cram', single_decode=True)
+        self.assertEqual(result['status'], 'failed')
+        self.assertEqual(result['errors'], ['FLAGSTAT DIFFERENT'])
+        self.assertEqual(result['tier'], 'full')
+
+    @mock.patch('checks.batch.CompareStatsForFiles.verify_bam_and_cram')
+    def test_verify_pair_unexpected_error(self, mock_compare):
+        mock_compare.side_effect = OSError('disk gone')
+        result = batch.verify_pair('a.bam', 'a.cram')
+        self.assertEqual(result['status'], 'failed')
+
+    @mock.patch('checks.batch.sources')
+    @mock.patch('checks.batch.CompareStatsForFiles.verify_bam_and_cram')
+    def test_verify_pair_prefetches_next_pair(self, mock_compare, mock_sources):
+        mock_compare.return_value = {'errors': [], 'tier': 'full'}
+        batch.verify_pair('irods:/a.bam', 'irods:/a.cram', {'fetch_command': 'iget {path} -'},
+                          next_pair=('irods:/b.bam', '/data/b.cram'))
+        mock_sources.prefetch.assert_called_once_with('irods:/b.bam', 'iget {path} -')
+        mock_sources.discard_prefetched.assert_called_once_with(keep=('irods:/b.bam', '/data/b.cram'))
+
+    @mock.patch('checks.batch.ProcessPoolExecutor', ThreadPoolExecutor)
+    @mock.patch('checks.batch.verify_pair')
+    def test_run_batch_irods_lanes(self, mock_verify_pair):
+        mock_verify_pair.side_effect = lambda bam_path, cram_path, compare_kwargs, log_fpath, next_pair: {
+            'bam': bam_path, 'cram': cram_path, 'status': 'passed', 'errors': [], 'tier': 'full'}
+        pairs = [('irods:/%s.bam' % name, 'irods:/%s.cram' % name) for name in 'abcde']
+        with tempfile.TemporaryDirectory() as output_dir:
+            summary = batch.run_batch(pairs, output_dir, jobs=2)
+        self.assertEqual(summary['passed'], 5)
+        next_pairs = {call[0][0]: call[0][4] for call in mock_verify_pair.call_args_list}
+        self.assertEqual(next_pairs, {'irods:/a.bam': pairs[2], 'irods:/c.bam': pairs[4], 'irods:/e.bam': None,
+                                      'irods:/b.bam': pairs[3], 'irods:/d.bam': None})
+
+    @mock.patch('checks.batch.ProcessPoolExecutor', ThreadPoolExecutor)
+    @mock.patch('checks.batch.CompareStatsForFiles.verify_bam_and_cram')
+    def test_run_batch(self, mock_compare):
+        mock_compare.side_effect = lambda bam_path, cram_path: {
+            'errors': [] if bam_path == '/data/a.bam' else ['some error'], 'tier': 'full'}
+        with tempfile.TemporaryDirectory() as output_dir:
+            summary = batch.run_batch([('/data/a.bam', '/data/a.cram'), ('/data/b.bam', '/data/b.cram')], output_dir,
+                                      jobs=2)
+            self.assertEqual(sorted(os.listdir(output_dir)),
+                             [batch.pair_name('/data/a.bam', '/data/a.cram') + '.json',
+                              batch.pair_name('/data/b.bam', '/data/b.cram') + '.json', 'summary.json'])
+            with open(os.path.join(output_dir, 'summary.json')) as f:
+                self.assertEqual(json.load(f), summary)
+        self.assertEqual(summary['passed'], 1)
+        self.assertEqual(summary['failed'], 1)
+        self.assertEqual(summary['failed_pairs'][0]['bam'], '/data/b.bam')
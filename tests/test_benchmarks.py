@@ -0,0 +1,94 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import tempfile
+from unittest import TestCase
+from benchmarks import fixtures
+from benchmarks import run
+from checks.stats_checks import CompareStatsForFiles, HandleSamtoolsStats
+
+
+class TestFixtures(TestCase):
+
+    def test_synthetic_stats(self):
+        counts = fixtures.synthetic_counts(1)
+        stats = fixtures.synthetic_stats(counts, extra_lines=10)
+        self.assertEqual(HandleSamtoolsStats.extract_seq_checksum_from_stats(stats),
+                         "CHK\t%08x\t%08x\t%08x" % tuple(counts['chk']))
+        self.assertEqual(HandleSamtoolsStats.extract_flagstat_counts_from_stats(stats)['reads mapped'],
+                         counts['mapped'])
+        self.assertEqual(len(stats.splitlines()), 3 + 21 + 10)
+
+    def test_fake_samtools(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            bin_dir = os.path.join(work_dir, 'bin')
+            fixtures.write_fake_samtools(bin_dir)
+            pairs = fixtures.make_pairs(os.path.join(work_dir, 'data'), 2, extra_lines=10, different_every=2)
+            with run.mock_environ(dict(os.environ, PATH=bin_dir + os.pathsep + os.environ['PATH'],
+                                       BAM2CRAM_SAMTOOLS_CACHE=os.path.join(work_dir, 'capabilities'))):
+                different = CompareStatsForFiles.compare_bam_and_cram_by_statistics(*pairs[0])
+                equal = CompareStatsForFiles.compare_bam_and_cram_by_statistics(*pairs[1], single_decode=True)
+        self.assertEqual(len(different), 1)
+        self.assertTrue(different[0].startswith("STATS SEQUENCE CHECKSUM DIFFERENT"))
+        self.assertEqual(equal, [])
+
+
+class TestRunBenchmarks(TestCase):
+
+    def test_run_benchmarks(self):
+        options = run.parse_args(['--stats-lines', '10', '--jobs', '1'])
+        with tempfile.TemporaryDirectory() as work_dir:
+            results = run.run_benchmarks(work_dir, [1, 2], ['checksum_extraction', 'compare_cache_miss',
+                                                            'compare_cache_hit'], options)
+            self.assertEqual(sorted(os.listdir(work_dir)), ['bin', 'samtools-capabilities', 'work-1', 'work-2'])
+        self.assertEqual(sorted(results['results']), ['checksum_extraction', 'compare_cache_hit',
+                                                      'compare_cache_miss'])
+        self.assertEqual(sorted(results['results']['compare_cache_hit']), ['1', '2'])
+        self.assertEqual(results['metadata']['stats_lines'], 10)
+
+    def test_run_checksum_engine_benchmark(self):
+        options = run.parse_args(['--sam-reads', '50'])
+        with tempfile.TemporaryDirectory() as work_dir:
+            results = run.run_benchmarks(work_dir, [2], ['checksum_engine'], options)
+        self.assertEqual(sorted(results['results']), ['checksum_engine'])
+        self.assertEqual(results['metadata']['sam_reads'], 50)
+
+    def test_compare_engine_to_samtools(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            bin_dir = os.path.join(work_dir, 'bin')
+            fixtures.write_fake_samtools(bin_dir)
+            bam_path = fixtures.make_pairs(os.path.join(work_dir, 'data'), 1, extra_lines=10)[0][0]
+            with open(bam_path + fixtures.FAKE_OUTPUT_EXT % 'view', 'w') as f:
+                f.write(fixtures.synthetic_sam(0, 10))
+            with run.mock_environ(dict(os.environ, PATH=bin_dir + os.pathsep + os.environ['PATH'],
+                                       BAM2CRAM_SAMTOOLS_CACHE=os.path.join(work_dir, 'capabilities'))):
+                result = run.compare_engine_to_samtools(bam_path)
+        # The fake samtools stats output isn't computed from the fake reads:
+        self.assertFalse(result['same_checksum'])
+        self.assertTrue(result['engine_mb_per_s'] > 0)
+        self.assertTrue(result['samtools_stats_mb_per_s'] > 0)
+
+    def test_compare_to_baseline(self):
+        baseline = {'results': {'compare': {'1': {'seconds': 1.0}, '100': {'seconds': 10.0}}}}
+        results = {'results': {'compare': {'1': {'seconds': 1.1}, '100': {'seconds': 13.0}},
+                               'batch': {'1': {'seconds': 5.0}}}}
+        self.assertEqual(run.compare_to_baseline(results, baseline, tolerance=0.2),
+                         [('compare', '100', 10.0, 13.0)])
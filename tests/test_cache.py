@@ -0,0 +1,219 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import pickle
+import tempfile
+import threading
+from unittest import mock, TestCase
+from checks import cache
+from checks import stats_checks
+
+
+@mock.patch('checks.cache.samtools_version', return_value='samtools 1.3')
+class TestCacheKey(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.fpath = os.path.join(self.tmp_dir.name, 'some.bam')
+        with open(self.fpath, 'w') as f:
+            f.write('data')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_cache_key_same_file(self, mock_version):
+        self.assertEqual(cache.cache_key(self.fpath, ['stats']), cache.cache_key(self.fpath, ['stats']))
+
+    def test_cache_key_different_args(self, mock_version):
+        self.assertNotEqual(cache.cache_key(self.fpath, ['stats']), cache.cache_key(self.fpath, ['flagstat']))
+
+    def test_cache_key_different_version(self, mock_version):
+        key = cache.cache_key(self.fpath, ['stats'])
+        mock_version.return_value = 'samtools 1.9'
+        self.assertNotEqual(key, cache.cache_key(self.fpath, ['stats']))
+
+    def test_cache_key_file_changed(self, mock_version):
+        key = cache.cache_key(self.fpath, ['stats'])
+        with open(self.fpath, 'a') as f:
+            f.write('more data')
+        self.assertNotEqual(key, cache.cache_key(self.fpath, ['stats']))
+
+    def test_cache_key_missing_file(self, mock_version):
+        self.assertIsNone(cache.cache_key(os.path.join(self.tmp_dir.name, 'missing.bam'), ['stats']))
+
+    @mock.patch.dict('checks.cache._irods_checksums', clear=True)
+    @mock.patch('checks.cache.subprocess.run')
+    def test_file_identity_irods(self, mock_run, mock_version):
+        mock_run.return_value = mock.Mock(returncode=0, stdout='    some.bam    sha2:abcd\n', stderr='')
+        result = cache.file_identity('irods:/zone/some.bam')
+        self.assertEqual(cache.file_identity('irods:/zone/some.bam'), result)
+        mock_run.assert_called_once_with(['ichksum', '/zone/some.bam'], stdout=mock.ANY, stderr=mock.ANY,
+                                         universal_newlines=True)
+        self.assertEqual(result['checksum'], 'sha2:abcd')
+
+
+class CacheBackendTests:
+
+    def make_cache(self, max_bytes=None):
+        raise NotImplementedError()
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_get_missing(self):
+        self.assertIsNone(self.make_cache().get('a' * 64))
+
+    def test_put_get(self):
+        stats_cache = self.make_cache()
+        stats_cache.put('a' * 64, 'CHK\t1\t2\t3\n')
+        self.assertEqual(stats_cache.get('a' * 64), 'CHK\t1\t2\t3\n')
+
+    def test_evicts_least_recently_used(self):
+        stats_cache = self.make_cache(max_bytes=25)
+        with mock.patch('checks.cache.time.time', side_effect=range(100)):
+            stats_cache.put('a' * 64, 'x' * 10)
+            stats_cache.put('b' * 64, 'y' * 10)
+            stats_cache.get('a' * 64)
+            stats_cache.put('c' * 64, 'z' * 10)
+        self.assertIsNone(stats_cache.get('b' * 64))
+        self.assertEqual(stats_cache.get('a' * 64), 'x' * 10)
+        self.assertEqual(stats_cache.get('c' * 64), 'z' * 10)
+
+    def test_concurrent_writers(self):
+        stats_cache = self.make_cache()
+
+        def write(i):
+            for j in range(20):
+                stats_cache.put('%064d' % j, 'value %s' % j)
+        writers = [threading.Thread(target=write, args=(i,)) for i in range(4)]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+        self.assertEqual(stats_cache.get('%064d' % 7), 'value 7')
+
+    @mock.patch('checks.cache.samtools_version', return_value='samtools 1.3')
+    def test_get_put_output(self, mock_version):
+        stats_cache = self.make_cache()
+        fpath = os.path.join(self.tmp_dir.name, 'some.bam')
+        open(fpath, 'w').close()
+        self.assertIsNone(stats_cache.get_output(fpath, ['flagstat']))
+        stats_cache.put_output(fpath, ['flagstat'], 'some flagstat')
+        self.assertEqual(stats_cache.get_output(fpath, ['flagstat']), 'some flagstat')
+
+
+class TestDirectoryCache(CacheBackendTests, TestCase):
+
+    def make_cache(self, max_bytes=None):
+        return cache.DirectoryCache(self.tmp_dir.name, max_bytes)
+
+    def test_open_cache(self):
+        self.assertIsInstance(cache.open_cache(self.tmp_dir.name), cache.DirectoryCache)
+
+    def test_scans_only_when_over_max_bytes(self):
+        stats_cache = self.make_cache(max_bytes=10000)
+        with mock.patch.object(stats_cache, 'evict', wraps=stats_cache.evict) as mock_evict:
+            for i in range(20):
+                stats_cache.put('%064d' % i, 'x' * 10)
+            self.assertEqual(mock_evict.call_count, 1)
+            # Then every DIRECTORY_SCAN_WRITES entries, for the entries of the other writers:
+            for i in range(20, cache.DIRECTORY_SCAN_WRITES + 1):
+                stats_cache.put('%064d' % i, 'x' * 10)
+            self.assertEqual(mock_evict.call_count, 2)
+            stats_cache.put('b' * 64, 'x' * 10000)
+            self.assertEqual(mock_evict.call_count, 3)
+        self.assertIsNotNone(stats_cache.get('b' * 64))
+        self.assertIsNone(stats_cache.get('%064d' % 0))
+
+    def test_pickle(self):
+        stats_cache = self.make_cache(max_bytes=1000)
+        stats_cache.put('a' * 64, 'value')
+        unpickled = pickle.loads(pickle.dumps(stats_cache))
+        self.assertEqual((unpickled.get('a' * 64), unpickled.max_bytes), ('value', 1000))
+
+
+class TestSQLiteCache(CacheBackendTests, TestCase):
+
+    def make_cache(self, max_bytes=None):
+        return cache.SQLiteCache(os.path.join(self.tmp_dir.name, 'cache.db'), max_bytes)
+
+    def test_open_cache(self):
+        self.assertIsInstance(cache.open_cache('sqlite:' + os.path.join(self.tmp_dir.name, 'cache.db')),
+                              cache.SQLiteCache)
+
+    def test_pickle(self):
+        stats_cache = self.make_cache()
+        stats_cache.put('a' * 64, 'value')
+        self.assertEqual(pickle.loads(pickle.dumps(stats_cache)).get('a' * 64), 'value')
+
+    def test_shared_journal_mode(self):
+        stats_cache = cache.SQLiteCache(os.path.join(self.tmp_dir.name, 'cache.db'),
+                                        journal_mode=cache.SHARED_JOURNAL_MODE)
+        stats_cache.put('a' * 64, 'value')
+        # Unpickled in the elements of a job array, it mustn't switch the database to WAL:
+        unpickled = pickle.loads(pickle.dumps(stats_cache))
+        self.assertEqual(unpickled.get('a' * 64), 'value')
+        with unpickled._connection() as conn:
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], 'delete')
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir.name, 'cache.db-wal')))
+
+
+class TestFetchStatsFromCache(TestCase):
+
+    @mock.patch('checks.stats_checks.os.path')
+    @mock.patch('checks.stats_checks.HandleSamtoolsStats._generate_stats')
+    def test_fetch_stats_cache_hit(self, mock_gen_s, mock_path):
+        mock_path.isfile.return_value = True
+        stats_cache = mock.Mock()
+        stats_cache.get_output.return_value = 'cached stats'
+        result = stats_checks.HandleSamtoolsStats.fetch_stats('some path', 'some path.stats', cache=stats_cache)
+        self.assertEqual(result, 'cached stats')
+        self.assertFalse(mock_gen_s.called)
+
+    @mock.patch('checks.stats_checks.utils.check_path_writable', return_value=False)
+    @mock.patch('checks.stats_checks.os.path')
+    @mock.patch('checks.stats_checks.HandleSamtoolsStats._generate_stats')
+    def test_fetch_stats_cache_miss(self, mock_gen_s, mock_path, mock_writable):
+        mock_path.isfile.side_effect = lambda fpath: fpath == 'some path'
+        mock_gen_s.return_value = 'some stats'
+        stats_cache = mock.Mock()
+        stats_cache.get_output.return_value = None
+        result = stats_checks.HandleSamtoolsStats.fetch_stats('some path', 'some path.stats', cache=stats_cache)
+        self.assertEqual(result, 'some stats')
+        stats_cache.put_output.assert_called_once_with('some path', ['stats'], 'some stats')
+
+
+class TestCacheChain(TestCase):
+
+    def test_cache_chain_get_output(self):
+        first, second = mock.Mock(), mock.Mock()
+        first.get_output.return_value = None
+        second.get_output.return_value = 'some stats'
+        self.assertEqual(cache.CacheChain([first, second]).get_output('some path', ['stats']), 'some stats')
+
+    def test_cache_chain_put_output(self):
+        first, second = mock.Mock(), mock.Mock()
+        cache.CacheChain([first, second]).put_output('some path', ['stats'], 'some stats')
+        first.put_output.assert_called_once_with('some path', ['stats'], 'some stats')
+        second.put_output.assert_called_once_with('some path', ['stats'], 'some stats')
@@ -0,0 +1,108 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import sys
+import time
+import subprocess
+import threading
+from unittest import mock, TestCase
+from checks import cancellation
+from checks import stats_checks
+
+SLEEP_CMD = [sys.executable, '-c', 'import time; time.sleep(30)']
+
+
+class TestCancellation(TestCase):
+
+    def test_set_terminates_registered_processes(self):
+        cancel = cancellation.Cancellation()
+        proc = subprocess.Popen(SLEEP_CMD)
+        with cancel.registered(proc):
+            cancel.set()
+            self.assertNotEqual(proc.wait(10), 0)
+        self.assertTrue(cancel.is_set())
+
+    def test_registering_after_set_terminates(self):
+        cancel = cancellation.Cancellation()
+        cancel.set()
+        proc = subprocess.Popen(SLEEP_CMD)
+        with cancel.registered(proc):
+            self.assertNotEqual(proc.wait(10), 0)
+
+    def test_run_subprocess_cancelled(self):
+        cancel = cancellation.Cancellation()
+        threading.Timer(0.2, cancel.set).start()
+        start = time.time()
+        self.assertRaises(RuntimeError, stats_checks.RunSamtoolsCommands._run_subprocess, SLEEP_CMD, cancel)
+        self.assertLess(time.time() - start, 10)
+
+    def test_stream_subprocess_cancelled(self):
+        cancel = cancellation.Cancellation()
+        threading.Timer(0.2, cancel.set).start()
+        self.assertRaises(RuntimeError, stats_checks.RunSamtoolsCommands._stream_subprocess, SLEEP_CMD, [],
+                          cancellation=cancel)
+
+
+class TestFailFast(TestCase):
+
+    @staticmethod
+    def _slow_fetch_stats(fpath, stats_fpath, shard_stats, chunk_size, allocator, cache, cancel):
+        stats_checks.RunSamtoolsCommands._run_subprocess(SLEEP_CMD, cancel)
+        return 'CHK\t1\t2\t3\n'
+
+    @mock.patch('checks.stats_checks.os.path')
+    @mock.patch('checks.stats_checks.utils')
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands.run_samtools_quickcheck')
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands.get_samtools_flagstat_output')
+    @mock.patch('checks.stats_checks.HandleSamtoolsStats.fetch_stats')
+    def test_fail_fast_on_flagstat_difference(self, mock_fetch_stats, mock_flagstat, mock_quickcheck, mock_utils,
+                                              mock_path):
+        mock_path.isfile.return_value = True
+        mock_utils.can_read_file.return_value = True
+        mock_utils.is_irods_path.return_value = False
+        mock_flagstat.side_effect = lambda fpath, threads, cancel: 'flagstat of %s' % fpath
+        mock_fetch_stats.side_effect = self._slow_fetch_stats
+        start = time.time()
+        result = stats_checks.CompareStatsForFiles.compare_bam_and_cram_by_statistics('some bam', 'some cram',
+                                                                                       fail_fast=True)
+        self.assertLess(time.time() - start, 10)
+        self.assertEqual(len(result), 2)
+        self.assertTrue(result[0].startswith('FLAGSTAT DIFFERENT'))
+        self.assertEqual(result[1], "Can't compare samtools stats.")
+
+    @mock.patch('checks.stats_checks.os.path')
+    @mock.patch('checks.stats_checks.utils')
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands.run_samtools_quickcheck')
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands.get_samtools_flagstat_output')
+    @mock.patch('checks.stats_checks.HandleSamtoolsStats.fetch_stats')
+    def test_fail_fast_on_stage_error(self, mock_fetch_stats, mock_flagstat, mock_quickcheck, mock_utils, mock_path):
+        mock_path.isfile.return_value = True
+        mock_utils.can_read_file.return_value = True
+        mock_utils.is_irods_path.return_value = False
+
+        def flagstat(fpath, threads, cancel):
+            if fpath == 'some cram':
+                raise RuntimeError('flagstat failed')
+            stats_checks.RunSamtoolsCommands._run_subprocess(SLEEP_CMD, cancel)
+        mock_flagstat.side_effect = flagstat
+        result = stats_checks.CompareStatsForFiles.compare_bam_and_cram_by_statistics('some bam', 'some cram',
+                                                                                       fail_fast=True)
+        self.assertEqual(result, ['flagstat failed', "Can't compare samtools stats."])
+        self.assertFalse(mock_fetch_stats.called)
@@ -0,0 +1,154 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import stat
+import tempfile
+from unittest import mock, TestCase
+from checks import capabilities
+from checks import threads
+
+VERSION_OUTPUT = "samtools 1.10\nUsing htslib 1.10.2\nCopyright (C) 2019 Genome Research Ltd.\n"
+
+STATS_USAGE = """About: samtools stats
+Usage: samtools stats [options] <in.bam>|<in.sam>|<in.cram> [<region>...]
+
+Options:
+    -c, --coverage <int>,<int>,<int>    Coverage distribution min,max,step [1,1000,1]
+    -X, --customized-index-file         Use a customized index file
+    -@, --threads INT                   Number of additional threads to use [0]
+"""
+
+FAKE_SAMTOOLS = """#!/bin/sh
+echo "$*" >> "%s"
+case $1 in
+    --version) printf '%s' ;;
+    stats) printf '%s' ;;
+    *) echo "Usage: samtools $1 [-o out] <in.bam>" ;;
+esac
+"""
+
+
+class TestParsing(TestCase):
+
+    def test_parse_version_numbers(self):
+        self.assertEqual(capabilities.parse_version_numbers('1.10'), (1, 10, 0))
+        self.assertEqual(capabilities.parse_version_numbers('1.2.1'), (1, 2, 1))
+        self.assertEqual(capabilities.parse_version_numbers('1.2-216-gdffc67f'), (1, 2, 0))
+        self.assertIsNone(capabilities.parse_version_numbers('random'))
+
+    def test_parse_version_output(self):
+        self.assertEqual(capabilities.parse_version_output(VERSION_OUTPUT),
+                         {'version_line': 'samtools 1.10', 'version': '1.10', 'htslib': '1.10.2'})
+
+    def test_parse_version_output_random(self):
+        self.assertRaises(ValueError, capabilities.parse_version_output, 'random')
+
+    def test_parse_usage_options(self):
+        self.assertEqual(capabilities.parse_usage_options(STATS_USAGE),
+                         ['--coverage', '--customized-index-file', '--threads', '-@', '-X', '-c'])
+
+    def test_parse_usage_options_not_a_usage(self):
+        self.assertIsNone(capabilities.parse_usage_options("samtools: unrecognized command"))
+
+
+class TestCheckSamtoolsVersion(TestCase):
+
+    def test_check_samtools_version_ok(self):
+        capabilities.check_samtools_version({'version': '1.10', 'version_numbers': (1, 10, 0)})
+        capabilities.check_samtools_version({'version': '1.3', 'version_numbers': [1, 3, 0]})
+
+    def test_check_samtools_version_too_old(self):
+        self.assertRaises(ValueError, capabilities.check_samtools_version,
+                          {'version': '1.2-216-gdffc67f', 'version_numbers': (1, 2, 0)})
+        self.assertRaises(ValueError, capabilities.check_samtools_version,
+                          {'version': '0.1.19', 'version_numbers': (0, 1, 19)})
+
+    def test_check_samtools_version_unknown(self):
+        self.assertRaises(ValueError, capabilities.check_samtools_version, {'version': 'x', 'version_numbers': None})
+
+
+class TestSamtoolsCapabilities(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.calls_fpath = os.path.join(self.tmp_dir.name, 'calls')
+        self.samtools_fpath = os.path.join(self.tmp_dir.name, 'bin', 'samtools')
+        self.cache_dir = os.path.join(self.tmp_dir.name, 'cache')
+        self._write_samtools(VERSION_OUTPUT)
+        path = os.path.dirname(self.samtools_fpath) + os.pathsep + os.environ['PATH']
+        self.patches = [mock.patch.dict(os.environ, {'PATH': path, 'BAM2CRAM_SAMTOOLS_CACHE': self.cache_dir}),
+                        mock.patch('checks.capabilities._probed', {})]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.tmp_dir.cleanup()
+
+    def _write_samtools(self, version_output):
+        os.makedirs(os.path.dirname(self.samtools_fpath), exist_ok=True)
+        with open(self.samtools_fpath, 'w') as f:
+            f.write(FAKE_SAMTOOLS % (self.calls_fpath, version_output, STATS_USAGE))
+        os.chmod(self.samtools_fpath, os.stat(self.samtools_fpath).st_mode | stat.S_IXUSR)
+
+    def _calls(self):
+        with open(self.calls_fpath) as f:
+            return f.read().splitlines()
+
+    def test_samtools_capabilities(self):
+        result = capabilities.samtools_capabilities()
+        self.assertEqual(result['version'], '1.10')
+        self.assertEqual(result['cram_versions'], ['2.1', '3.0', '3.1'])
+        self.assertIn('-@', result['options']['stats'])
+        self.assertEqual(result['options']['view'], ['-o'])
+        self.assertEqual(self._calls(), ['--version', 'view --help', 'flagstat --help', 'stats --help'])
+
+    def test_samtools_capabilities_probed_once(self):
+        capabilities.samtools_capabilities()
+        capabilities.samtools_capabilities()
+        with mock.patch('checks.capabilities._probed', {}):
+            # As in another process, with the capabilities saved on disk:
+            result = capabilities.samtools_capabilities()
+        self.assertEqual(result['version_numbers'], [1, 10, 0])
+        self.assertEqual(len(self._calls()), 4)
+
+    def test_samtools_capabilities_probed_again_when_samtools_changes(self):
+        capabilities.samtools_capabilities()
+        self._write_samtools(VERSION_OUTPUT.replace('1.10', '1.2'))
+        result = capabilities.samtools_capabilities()
+        self.assertEqual(result['version'], '1.2')
+        self.assertEqual(result['cram_versions'], ['2.1', '3.0'])
+        self.assertEqual(len(self._calls()), 8)
+
+    def test_samtools_capabilities_not_found(self):
+        with mock.patch.dict(os.environ, {'PATH': self.cache_dir}):
+            self.assertRaises(RuntimeError, capabilities.samtools_capabilities)
+
+    def test_samtools_capabilities_version_fails(self):
+        with open(self.samtools_fpath, 'a') as f:
+            f.write("exit 1\n")
+        self.assertRaises(RuntimeError, capabilities.samtools_capabilities)
+
+    def test_samtools_threads_args(self):
+        self.assertEqual(threads.samtools_threads_args(4, 'stats'), ['-@', '3'])
+        self.assertEqual(threads.samtools_threads_args(4, 'flagstat'), [])
+        self.assertEqual(threads.samtools_threads_args(4), ['-@', '3'])
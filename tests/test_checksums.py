@@ -0,0 +1,150 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import zlib
+import shutil
+import tempfile
+from unittest import TestCase, skipUnless
+from benchmarks import fixtures
+from benchmarks import run
+from checks import checksums
+from checks import streaming
+from checks.stats_checks import RunSamtoolsCommands
+
+BAM_SEQ_CODES = '=ACMGRSVTWYHKDBN'
+
+
+def bam_checksums(reads):
+    """
+    The checksums as samtools stats computes them out of the BAM records, for a list of (name, seq, qual) reads,
+    the sequence being packed 4 bits a base and the qualities being Phred scores (0xff if missing).
+    """
+    sums = [0, 0, 0]
+    for name, seq, qual in reads:
+        sums[0] += zlib.crc32(name.encode())
+        if seq == '*':
+            continue
+        codes = [BAM_SEQ_CODES.index(base.upper()) if base.upper() in BAM_SEQ_CODES else 15 for base in seq] + [0]
+        packed = bytes(codes[i] << 4 | codes[i + 1] for i in range(0, len(seq), 2))
+        phred = bytes([0xff] * len(seq) if qual == '*' else [ord(char) - 33 for char in qual])
+        sums[1] += zlib.crc32(packed)
+        sums[2] += zlib.crc32(phred[:(len(seq) + 1) // 2])
+    return checksums.checksum_line([value & 0xffffffff for value in sums])
+
+
+def sam_line(name, seq, qual, contig='1', read_group=None):
+    line = "%s\t0\t%s\t100\t60\t%sM\t*\t0\t0\t%s\t%s" % (name, contig, len(seq), seq, qual)
+    return line + ("\tNM:i:0\tRG:Z:%s" % read_group if read_group else "")
+
+
+class TestSamChecksums(TestCase):
+
+    def setUp(self):
+        self.reads = [('read1', 'ACGTN', 'IIII#', '1', 'rg1'), ('read2', 'acgtRYK', '*', '2', 'rg2'),
+                      ('read3', '*', '*', '*', None), ('read4', 'GATTACA', 'ABCDEFG', '1', 'rg2')]
+        self.sam = ''.join(sam_line(*read) + '\n' for read in self.reads).encode()
+
+    def test_sam_checksums_as_samtools_stats(self):
+        engine = checksums.SamChecksums()
+        engine.consume(self.sam)
+        engine.finish()
+        self.assertEqual(engine.checksum_line(), bam_checksums([read[:3] for read in self.reads]))
+        self.assertEqual(engine.reads, 4)
+
+    def test_sam_checksums_lines_across_chunks(self):
+        engine = checksums.SamChecksums()
+        for i in range(0, len(self.sam), 7):
+            engine.consume(self.sam[i:i + 7])
+        engine.finish()
+        self.assertEqual(engine.checksum_line(), bam_checksums([read[:3] for read in self.reads]))
+
+    def test_sam_checksums_no_final_newline(self):
+        engine = checksums.SamChecksums()
+        engine.consume(self.sam.rstrip(b'\n'))
+        engine.finish()
+        self.assertEqual(engine.reads, 4)
+
+    def test_sam_checksums_breakdown(self):
+        engine = checksums.SamChecksums()
+        engine.consume(self.sam)
+        engine.finish()
+        self.assertEqual(sorted(engine.by_read_group), ['', 'rg1', 'rg2'])
+        self.assertEqual(checksums.checksum_line(engine.by_read_group['rg2']),
+                         bam_checksums([self.reads[1][:3], self.reads[3][:3]]))
+        self.assertEqual(sorted(engine.by_contig), ['*', '1', '2'])
+        self.assertEqual(checksums.checksum_line(engine.by_contig['1']),
+                         bam_checksums([self.reads[0][:3], self.reads[3][:3]]))
+
+    def test_compare_checksums(self):
+        engine_b, engine_c = checksums.SamChecksums(), checksums.SamChecksums()
+        engine_b.consume(self.sam)
+        engine_c.consume(self.sam.replace(b'GATTACA', b'GATTACC'))
+        result = checksums.compare_checksums(engine_b, engine_c)
+        self.assertEqual(len(result), 2)
+        self.assertTrue(result[0].startswith("STATS SEQUENCE CHECKSUM DIFFERENT for read group rg2: CHK"))
+        self.assertTrue(result[1].startswith("STATS SEQUENCE CHECKSUM DIFFERENT for contig 1: CHK"))
+
+    def test_compare_checksums_equal(self):
+        engine_b, engine_c = checksums.SamChecksums(), checksums.SamChecksums()
+        engine_b.consume(self.sam)
+        engine_c.consume(self.sam)
+        self.assertEqual(checksums.compare_checksums(engine_b, engine_c), [])
+
+
+class TestComputeChecksums(TestCase):
+
+    def test_compute_checksums(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            bin_dir = os.path.join(work_dir, 'bin')
+            fixtures.write_fake_samtools(bin_dir)
+            fpath = os.path.join(work_dir, 'some.bam')
+            sam = fixtures.synthetic_sam(1, 100)
+            with open(fpath + fixtures.FAKE_OUTPUT_EXT % 'view', 'w') as f:
+                f.write(sam)
+            with run.mock_environ(dict(os.environ, PATH=bin_dir + os.pathsep + os.environ['PATH'])):
+                result = checksums.compute_checksums(fpath, chunk_size=1000)
+        expected = checksums.SamChecksums()
+        expected.consume(sam.encode())
+        self.assertEqual(result.checksum_line(), expected.checksum_line())
+        self.assertEqual(result.reads, 100)
+        self.assertEqual(sorted(result.by_read_group), ['1#1', '1#2'])
+
+
+@skipUnless(shutil.which('samtools'), "samtools isn't installed")
+class TestUsingActualFiles(TestCase):
+    """Checks that the checksums are the same as the CHK line of samtools stats for the files of test-cases."""
+    def setUp(self):
+        self.test_data_dirpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test-cases')
+
+    def _assert_same_checksums_as_samtools_stats(self, fname):
+        fpath = os.path.join(self.test_data_dirpath, fname)
+        checksum = streaming.ChecksumExtractor()
+        RunSamtoolsCommands.stream_samtools_stats_output(fpath, [checksum])
+        self.assertEqual(checksums.compute_checksums(fpath).checksum_line(), checksum.checksum)
+
+    def test_same_checksums_as_samtools_stats_bam(self):
+        for fname in ('ok_bam_cram/mpileup.3.bam', 'mpileup.3.rev.bam', 'diff_stats/mpileup.1.bam', '1read.bam',
+                      '4.quickcheck.ok.bam', 'ce#5b.bam'):
+            with self.subTest(fname=fname):
+                self._assert_same_checksums_as_samtools_stats(fname)
+
+    def test_same_checksums_as_samtools_stats_cram(self):
+        self._assert_same_checksums_as_samtools_stats('ok_bam_cram/mpileup.3.cram')
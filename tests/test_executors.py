@@ -0,0 +1,123 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import tempfile
+from unittest import mock, TestCase
+from benchmarks import fixtures
+from checks import batch
+from checks import cache
+from checks import executors
+from checks import resources
+from checks.journal import VerificationJournal
+
+
+class TestSubmitCommands(TestCase):
+
+    def test_lsf_submit_command(self):
+        executor = executors.LSFExecutor(memory_mb=8000, queue='long', submit_options='-G hgi')
+        result = executor.submit_command('b2c', 3, 2, 4, 'python -m checks.executors b2c.array', '/logs')
+        self.assertEqual(result, ['bsub', '-K', '-J', 'b2c[1-3]%2', '-o', '/logs/b2c.%I.out', '-n', '4', '-M', '8000',
+                                  '-R', 'span[hosts=1] select[mem>8000] rusage[mem=8000]', '-q', 'long', '-G', 'hgi',
+                                  'python -m checks.executors b2c.array'])
+
+    def test_slurm_submit_command(self):
+        executor = executors.SlurmExecutor()
+        result = executor.submit_command('b2c', 3, None, None, 'python -m checks.executors b2c.array', '/logs')
+        self.assertEqual(result, ['sbatch', '--wait', '--job-name=b2c', '--array=0-2', '--output=/logs/b2c.%a.out',
+                                  '--cpus-per-task=1', '--mem=4000M', '--wrap=python -m checks.executors b2c.array'])
+
+
+class TestJobArrayExecutors(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.bin_dir = os.path.join(self.tmp_dir.name, 'bin')
+        fixtures.write_fake_samtools(self.bin_dir)
+        fixtures.write_fake_schedulers(self.bin_dir)
+        self.pairs = fixtures.make_pairs(os.path.join(self.tmp_dir.name, 'data'), 5, extra_lines=10,
+                                         different_every=2)
+        self.output_dir = os.path.join(self.tmp_dir.name, 'output')
+        path = self.bin_dir + os.pathsep + os.environ['PATH']
+        self.environ = mock.patch.dict(os.environ, {'PATH': path, 'BAM2CRAM_SAMTOOLS_CACHE': self.tmp_dir.name})
+        self.environ.start()
+
+    def tearDown(self):
+        self.environ.stop()
+        self.tmp_dir.cleanup()
+
+    def _check_run(self, executor):
+        journal = VerificationJournal(os.path.join(self.tmp_dir.name, 'journal.db'),
+                                      journal_mode=cache.SHARED_JOURNAL_MODE)
+        summary = executor.run(self.pairs, self.output_dir, jobs=2, compare_kwargs={'threads': 1}, journal=journal)
+        self.assertEqual((summary['passed'], summary['failed'], summary['skipped']), (2, 3, 0))
+        self.assertEqual([pair['bam'] for pair in summary['failed_pairs']],
+                         [self.pairs[0][0], self.pairs[2][0], self.pairs[4][0]])
+        self.assertEqual(journal.get_pair(*self.pairs[1])['status'], 'passed')
+        self.assertIn(batch.pair_name(*self.pairs[1]) + '.json', os.listdir(self.output_dir))
+        self.assertFalse([fname for fname in os.listdir(self.output_dir) if fname.endswith('.array')])
+        summary = executor.run(self.pairs, self.output_dir, jobs=2, compare_kwargs={'threads': 1}, journal=journal)
+        self.assertEqual((summary['passed'], summary['failed'], summary['skipped']), (2, 3, 2))
+
+    def test_run_lsf(self):
+        self._check_run(executors.LSFExecutor(pairs_per_element=2))
+
+    def test_run_slurm(self):
+        self._check_run(executors.SlurmExecutor(pairs_per_element=2))
+
+    def test_run_when_the_array_fails(self):
+        fixtures._write_executable(self.bin_dir, 'sbatch', "#!/bin/sh\nexit 1\n")
+        summary = executors.SlurmExecutor().run(self.pairs, self.output_dir, compare_kwargs={'threads': 1})
+        self.assertEqual(summary['failed'], 5)
+        self.assertIn("didn't finish", summary['failed_pairs'][0]['errors'][0])
+        self.assertIn(executors.JOURNAL_FNAME, os.listdir(self.output_dir))
+
+    def test_run_with_history(self):
+        history = resources.ResourceHistory(os.path.join(self.tmp_dir.name, 'history.db'))
+        executor = executors.SlurmExecutor(history=history)
+        executor.run(self.pairs, self.output_dir, compare_kwargs={'threads': 1})
+        self.assertEqual(len(history.observations('stats', 'bam')), 5)
+        self.assertEqual(len(history.observations('flagstat', 'cram')), 5)
+        self.assertEqual(executor.plan_arrays(self.pairs, threads=1)[0]['threads'], 1)
+        self.assertEqual(len(executor.plan_arrays(self.pairs, threads=1)[0]['elements']), 1)
+
+    @mock.patch('checks.executors.MAX_ARRAY_SIZE', 2)
+    def test_run_array_size_limit(self):
+        executor = executors.SlurmExecutor(pairs_per_element=1)
+        with mock.patch.object(executor, 'submit_command', wraps=executor.submit_command) as mock_submit:
+            executor.run(self.pairs, self.output_dir, compare_kwargs={'threads': 1})
+        self.assertEqual(mock_submit.call_args[0][1], 2)
+
+
+class TestStalledRetries(TestCase):
+
+    @mock.patch('checks.executors.JobArrayExecutor._run_arrays')
+    def test_run_submits_the_stalled_pairs_again(self, mock_run_arrays):
+        def run_arrays(pairs, output_dir, jobs, compare_kwargs, log_dir, journal):
+            status = 'stalled' if mock_run_arrays.call_count == 1 else 'passed'
+            return [{'bam': bam_path, 'cram': cram_path, 'status': 'passed' if bam_path == 'a.bam' else status,
+                     'errors': [] if bam_path == 'a.bam' or status == 'passed' else ['STALLED running process']}
+                    for bam_path, cram_path in pairs]
+        mock_run_arrays.side_effect = run_arrays
+        pairs = [('a.bam', 'a.cram'), ('b.bam', 'b.cram')]
+        with tempfile.TemporaryDirectory() as output_dir:
+            summary = executors.LSFExecutor(stalled_retries=2).run(pairs, output_dir)
+        self.assertEqual((summary['passed'], summary['failed'], summary['stalled']), (2, 0, 0))
+        self.assertEqual([call[0][0] for call in mock_run_arrays.call_args_list], [pairs, [('b.bam', 'b.cram')]])
@@ -0,0 +1,122 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import pickle
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, TestCase
+from checks import batch
+from checks import journal
+
+
+@mock.patch('checks.cache.samtools_version', return_value='samtools 1.3')
+class TestVerificationJournal(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.bam_path = os.path.join(self.tmp_dir.name, 'a.bam')
+        self.cram_path = os.path.join(self.tmp_dir.name, 'a.cram')
+        for fpath in (self.bam_path, self.cram_path):
+            with open(fpath, 'w') as f:
+                f.write('data')
+        self.journal = journal.VerificationJournal(os.path.join(self.tmp_dir.name, 'journal.db'))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_is_verified_when_passed(self, mock_version):
+        self.journal.record_pair(self.bam_path, self.cram_path, {'status': 'passed', 'errors': [], 'duration': 1.0},
+                                 journal.verification_scope())
+        self.assertTrue(self.journal.is_verified(self.bam_path, self.cram_path))
+
+    def test_is_verified_when_passed_fewer_tiers(self, mock_version):
+        self.journal.record_pair(self.bam_path, self.cram_path,
+                                 {'status': 'passed', 'errors': [], 'duration': 1.0, 'tier': 'header'},
+                                 journal.verification_scope({'tiers': ['header']}))
+        self.assertEqual(self.journal.get_pair(self.bam_path, self.cram_path)['tier'], 'header')
+        self.assertTrue(self.journal.is_verified(self.bam_path, self.cram_path,
+                                                 journal.verification_scope({'tiers': ['header']})))
+        self.assertFalse(self.journal.is_verified(self.bam_path, self.cram_path))
+
+    def test_is_verified_without_scope(self, mock_version):
+        # A pair recorded without what it was verified for is verified again
+        self.journal.record_pair(self.bam_path, self.cram_path, {'status': 'passed', 'errors': [], 'duration': 1.0})
+        self.assertFalse(self.journal.is_verified(self.bam_path, self.cram_path))
+
+    def test_scope_covers(self, mock_version):
+        full = journal.verification_scope()
+        tolerant = journal.verification_scope({'all_sections': True, 'stats_tolerances': {'GCF': 0.01}})
+        strict = journal.verification_scope({'all_sections': True})
+        self.assertTrue(journal.scope_covers(strict, full))
+        self.assertTrue(journal.scope_covers(strict, tolerant))
+        self.assertFalse(journal.scope_covers(tolerant, strict))
+        self.assertFalse(journal.scope_covers(full, strict))
+        self.assertFalse(journal.scope_covers(full, journal.verification_scope({'compute_digests': True})))
+
+    def test_is_verified_when_failed(self, mock_version):
+        self.journal.record_pair(self.bam_path, self.cram_path, {'status': 'failed', 'errors': ['x'], 'duration': 1.0})
+        self.assertFalse(self.journal.is_verified(self.bam_path, self.cram_path))
+        self.assertEqual(self.journal.get_pair(self.bam_path, self.cram_path)['errors'], ['x'])
+
+    def test_is_verified_when_file_changed(self, mock_version):
+        self.journal.record_pair(self.bam_path, self.cram_path, {'status': 'passed', 'errors': [], 'duration': 1.0})
+        with open(self.cram_path, 'a') as f:
+            f.write('more data')
+        self.assertFalse(self.journal.is_verified(self.bam_path, self.cram_path))
+
+    def test_is_verified_when_unknown(self, mock_version):
+        self.assertFalse(self.journal.is_verified(self.bam_path, self.cram_path))
+
+    def test_stage_outputs(self, mock_version):
+        self.journal.put_output(self.bam_path, ['flagstat'], 'some flagstat')
+        self.journal.put_output(self.bam_path, ['stats'], 'some stats')
+        self.assertEqual(self.journal.get_output(self.bam_path, ['flagstat']), 'some flagstat')
+        self.assertEqual(self.journal.get_output(self.bam_path, ['stats']), 'some stats')
+
+    def test_pickle(self, mock_version):
+        self.journal.put_output(self.bam_path, ['flagstat'], 'some flagstat')
+        unpickled = pickle.loads(pickle.dumps(self.journal))
+        self.assertEqual(unpickled.get_output(self.bam_path, ['flagstat']), 'some flagstat')
+
+    @mock.patch('checks.batch.ProcessPoolExecutor', ThreadPoolExecutor)
+    @mock.patch('checks.batch.CompareStatsForFiles.verify_bam_and_cram')
+    def test_run_batch_skips_verified_pairs(self, mock_compare, mock_version):
+        mock_compare.return_value = {'errors': [], 'tier': 'full'}
+        output_dir = os.path.join(self.tmp_dir.name, 'out')
+        summary = batch.run_batch([(self.bam_path, self.cram_path)], output_dir, jobs=1, journal=self.journal)
+        self.assertEqual(summary['skipped'], 0)
+        self.assertIs(mock_compare.call_args[1]['cache'], self.journal)
+        summary = batch.run_batch([(self.bam_path, self.cram_path)], output_dir, jobs=1, journal=self.journal)
+        self.assertEqual(summary['skipped'], 1)
+        self.assertEqual(summary['passed'], 1)
+        self.assertEqual(mock_compare.call_count, 1)
+
+    @mock.patch('checks.batch.ProcessPoolExecutor', ThreadPoolExecutor)
+    @mock.patch('checks.batch.CompareStatsForFiles.verify_bam_and_cram')
+    def test_run_batch_verifies_again_for_more_tiers(self, mock_compare, mock_version):
+        mock_compare.return_value = {'errors': [], 'tier': 'header'}
+        output_dir = os.path.join(self.tmp_dir.name, 'out')
+        batch.run_batch([(self.bam_path, self.cram_path)], output_dir, jobs=1, journal=self.journal,
+                        compare_kwargs={'tiers': ['header']})
+        mock_compare.return_value = {'errors': [], 'tier': 'full'}
+        summary = batch.run_batch([(self.bam_path, self.cram_path)], output_dir, jobs=1, journal=self.journal)
+        self.assertEqual(summary['skipped'], 0)
+        self.assertEqual(mock_compare.call_count, 2)
@@ -0,0 +1,164 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+from unittest import mock, TestCase
+from checks import localize
+
+CONTIG_LENGTH = 1000000
+
+
+def make_reads(damaged_pos=None):
+    """:return: list of (contig, pos, SAM line) of a read every 1000 bases, the one at damaged_pos having a bad base"""
+    reads = []
+    for contig in ('1', '2'):
+        for pos in range(1, CONTIG_LENGTH, 1000):
+            seq = 'ACGTN' if (contig, pos) == damaged_pos else 'ACGTA'
+            reads.append((contig, pos, "r%s_%s\t0\t%s\t%s\t60\t5M\t*\t0\t0\t%s\tIIIII" % (contig, pos, contig, pos,
+                                                                                          seq)))
+    return reads
+
+
+def reads_in_region(reads, region):
+    if region == localize.UNMAPPED_REGION:
+        return []
+    contig, start, end = region
+    return [line for read_contig, pos, line in reads if read_contig == contig and start <= pos <= end]
+
+
+class TestLocalizeChecksumDifferences(TestCase):
+
+    def setUp(self):
+        self.reads = {'a.bam': make_reads(), 'a.cram': make_reads(damaged_pos=('2', 534001))}
+        self.checksum_calls = []
+        self.view_regions = []
+
+        def get_region_checksum(fpath, region):
+            self.checksum_calls.append(region)
+            return str(sorted(reads_in_region(self.reads[fpath], region)))
+
+        def stream_view_output(fpath, region, consumers, min_pos=None):
+            self.view_regions.append(region)
+            contig, interval = region.split(':')
+            start, end = (int(pos) for pos in interval.split('-'))
+            for line in reads_in_region(self.reads[fpath], (contig, start, end)):
+                consumers[0].consume(line + '\n')
+        patches = [mock.patch('checks.localize.get_region_checksum', side_effect=get_region_checksum),
+                   mock.patch('checks.localize.RunSamtoolsCommands.stream_samtools_view_output_for_region',
+                              side_effect=stream_view_output),
+                   mock.patch('checks.localize.get_contig_regions',
+                              return_value=[('1', 1, CONTIG_LENGTH), ('2', 1, CONTIG_LENGTH), '*']),
+                   mock.patch('checks.localize.os.path.isfile', return_value=True),
+                   mock.patch('checks.localize.utils.find_index_file', return_value='a.bai'),
+                   mock.patch('checks.localize.capabilities.supports_option', return_value=True)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_localize_checksum_differences(self):
+        result = localize.localize_checksum_differences('a.bam', 'a.cram', min_region_size=10000)
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0]['only_in_bam_count'], 1)
+        self.assertEqual(result[0]['only_in_cram_count'], 1)
+        self.assertTrue(result[0]['only_in_bam'][0].startswith("r2_534001\t"))
+        self.assertTrue(result[0]['only_in_cram'][0].endswith("ACGTN\tIIIII"))
+        contig, start, end = result[0]['region'].replace(':', '-').split('-')
+        self.assertEqual(contig, '2')
+        self.assertTrue(int(start) <= 534001 <= int(end))
+        self.assertTrue(int(end) - int(start) < 10000)
+        # Only the mismatching regions are split, not the whole genome:
+        self.assertTrue(len(self.checksum_calls) < 2 * (3 + 4 * 7))
+
+    def test_compare_reads_of_large_region(self):
+        self.reads['a.cram'] = make_reads(damaged_pos=('1', 534001))
+        result = localize.compare_reads_of_large_region('a.bam', 'a.cram', ('1', 1, CONTIG_LENGTH),
+                                                        max_region_size=100000)
+        self.assertEqual([(difference['region'], difference['only_in_bam_count']) for difference in result],
+                         [('1:500001-600000', 1)])
+        self.assertEqual(len(self.view_regions), 2 * 10)
+
+    def test_compare_reads_of_large_region_without_differences(self):
+        result = localize.compare_reads_of_large_region('a.bam', 'a.cram', ('1', 1, CONTIG_LENGTH),
+                                                        max_region_size=100000)
+        self.assertEqual(result, [{'region': '1:1-100000', 'only_in_bam_count': 0, 'only_in_cram_count': 0,
+                                   'only_in_bam': [], 'only_in_cram': []}])
+
+    def test_localize_checksum_differences_equal_files(self):
+        self.reads['a.cram'] = make_reads()
+        result = localize.localize_checksum_differences('a.bam', 'a.cram')
+        self.assertEqual(result, [])
+        self.assertEqual(len(self.checksum_calls), 6)
+
+    def test_localize_checksum_differences_not_indexed(self):
+        with mock.patch('checks.localize.utils.find_index_file', return_value=None):
+            self.assertRaises(ValueError, localize.localize_checksum_differences, 'a.bam', 'a.cram')
+
+    def test_localize_checksum_differences_without_expressions(self):
+        with mock.patch('checks.localize.capabilities.supports_option', return_value=False):
+            self.assertRaises(ValueError, localize.localize_checksum_differences, 'a.bam', 'a.cram')
+        self.assertEqual(self.checksum_calls, [])
+
+    def test_format_differences(self):
+        differences = [{'region': '2:530001-540000', 'only_in_bam_count': 1, 'only_in_cram_count': 0,
+                        'only_in_bam': ['r1\t0\t2'], 'only_in_cram': []},
+                       {'region': '*', 'only_in_bam_count': None, 'only_in_cram_count': None,
+                        'only_in_bam': [], 'only_in_cram': []}]
+        result = localize.format_differences(differences)
+        self.assertEqual(result, ["STATS SEQUENCE CHECKSUM DIFFERENT in 2:530001-540000: 1 reads only in the BAM "
+                                  "and 0 only in the CRAM",
+                                  "BAM only: r1\t0\t2",
+                                  "STATS SEQUENCE CHECKSUM DIFFERENT for the unmapped reads without coordinates"])
+
+
+class TestSplitRegion(TestCase):
+
+    def test_split_region(self):
+        result = localize.split_region(('1', 1, 10), 4)
+        self.assertEqual(result, [('1', 1, 3), ('1', 4, 6), ('1', 7, 9), ('1', 10, 10)])
+
+    def test_split_region_smaller_than_parts(self):
+        result = localize.split_region(('1', 5, 6), 4)
+        self.assertEqual(result, [('1', 5, 5), ('1', 6, 6)])
+
+    def test_region_text(self):
+        self.assertEqual(localize.region_text(('chr1', 1, 100)), 'chr1:1-100')
+        self.assertEqual(localize.region_text('*'), '*')
+        self.assertEqual(localize.region_text(('HLA-A*01:01:01:01', 1, 100)), '{HLA-A*01:01:01:01}:1-100')
+
+
+class TestGetContigRegions(TestCase):
+
+    @mock.patch('checks.localize.RunSamtoolsCommands.get_samtools_idxstats_output')
+    @mock.patch('checks.localize.HandleSamtoolsStats.get_header_contigs')
+    def test_get_contig_regions(self, mock_header_contigs, mock_idxstats):
+        mock_header_contigs.side_effect = lambda fpath: {'a.bam': [('1', 1000), ('2', 2000)],
+                                                         'a.cram': [('1', 1000), ('2', 2000), ('MT', 16569)]}[fpath]
+        result = localize.get_contig_regions('a.bam', 'a.cram')
+        self.assertEqual(result, [('1', 1, 1000), ('2', 1, 2000), ('MT', 1, 16569), localize.UNMAPPED_REGION])
+        self.assertFalse(mock_idxstats.called)
+
+
+class TestGetRegionChecksum(TestCase):
+
+    @mock.patch('checks.localize.RunSamtoolsCommands.stream_samtools_stats_output_for_region')
+    def test_get_region_checksum(self, mock_stream):
+        mock_stream.side_effect = lambda fpath, region, consumers, min_pos: consumers[0].consume("CHK\t1\t2\t3\n")
+        result = localize.get_region_checksum('a.bam', ('1', 1001, 2000))
+        mock_stream.assert_called_once_with('a.bam', '1:1001-2000', mock.ANY, 1001)
+        self.assertEqual(result, "CHK\t1\t2\t3")
@@ -0,0 +1,98 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import gzip
+import hashlib
+import tempfile
+from unittest import mock, TestCase
+from checks import reference
+
+FASTA = b""">chr1 some description
+acgtNN
+ACGT
+>chr2
+GGGG
+CC
+"""
+CHR1_MD5 = hashlib.md5(b'ACGTNNACGT').hexdigest()
+CHR2_MD5 = hashlib.md5(b'GGGGCC').hexdigest()
+
+
+class TestRefCache(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp_dir.name, 'ref_cache')
+        self.fasta_fpath = os.path.join(self.tmp_dir.name, 'ref.fa')
+        with open(self.fasta_fpath, 'wb') as f:
+            f.write(FASTA)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_ref_cache_path(self):
+        result = reference.ref_cache_path('/cache', '0123456789abcdef')
+        self.assertEqual(result, '/cache/01/23/456789abcdef')
+
+    def test_populate_ref_cache(self):
+        result = reference.populate_ref_cache(self.fasta_fpath, self.cache_dir)
+        self.assertEqual(result, {'chr1': CHR1_MD5, 'chr2': CHR2_MD5})
+        with open(reference.ref_cache_path(self.cache_dir, CHR1_MD5), 'rb') as f:
+            self.assertEqual(f.read(), b'ACGTNNACGT')
+        with open(reference.ref_cache_path(self.cache_dir, CHR2_MD5), 'rb') as f:
+            self.assertEqual(f.read(), b'GGGGCC')
+        self.assertFalse([fname for fname in os.listdir(self.cache_dir) if fname.startswith('.tmp')])
+
+    def test_populate_ref_cache_gzipped(self):
+        gz_fpath = self.fasta_fpath + '.gz'
+        with gzip.open(gz_fpath, 'wb') as f:
+            f.write(FASTA)
+        result = reference.populate_ref_cache(gz_fpath, self.cache_dir)
+        self.assertEqual(result, {'chr1': CHR1_MD5, 'chr2': CHR2_MD5})
+
+    def test_populate_ref_cache_reads_fasta_once(self):
+        reference.populate_ref_cache(self.fasta_fpath, self.cache_dir)
+        with mock.patch('checks.reference._add_sequences') as mock_add:
+            result = reference.populate_ref_cache(self.fasta_fpath, self.cache_dir)
+        self.assertFalse(mock_add.called)
+        self.assertEqual(result, {'chr1': CHR1_MD5, 'chr2': CHR2_MD5})
+
+    def test_populate_ref_cache_sequence_removed(self):
+        reference.populate_ref_cache(self.fasta_fpath, self.cache_dir)
+        os.remove(reference.ref_cache_path(self.cache_dir, CHR2_MD5))
+        reference.populate_ref_cache(self.fasta_fpath, self.cache_dir)
+        self.assertTrue(os.path.isfile(reference.ref_cache_path(self.cache_dir, CHR2_MD5)))
+
+    def test_missing_references(self):
+        reference.populate_ref_cache(self.fasta_fpath, self.cache_dir)
+        header = "@HD\tVN:1.4\n@SQ\tSN:chr1\tLN:10\tM5:%s\n@SQ\tSN:chr3\tLN:4\tM5:%s\n@SQ\tSN:chr4\tLN:4\n" % \
+                 (CHR1_MD5.upper(), 'f' * 32)
+        self.assertEqual(reference.missing_references(header, self.cache_dir), ['chr3'])
+
+    def test_use_ref_cache(self):
+        with mock.patch.dict(os.environ, {'REF_PATH': 'http://www.ebi.ac.uk/ena/cram/md5/%s'}):
+            reference.use_ref_cache(self.cache_dir)
+            self.assertEqual(os.environ['REF_PATH'], os.path.join(self.cache_dir, '%2s/%2s/%s'))
+            self.assertEqual(os.environ['REF_CACHE'], os.environ['REF_PATH'])
+
+    def test_default_ref_cache_dir(self):
+        with mock.patch.dict(os.environ, {reference.REF_CACHE_ENV_VAR: '/shared/ref_cache'}):
+            self.assertEqual(reference.default_ref_cache_dir(), '/shared/ref_cache')
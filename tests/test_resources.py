@@ -0,0 +1,145 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import tempfile
+from unittest import mock, TestCase
+from checks import executors
+from checks import resources
+
+
+def _telemetry(fpath, stage, duration, cpu, rss):
+    return {'stages': [{'file': fpath, 'stage': stage, 'duration': duration,
+                        'processes': [{'user_cpu': cpu, 'system_cpu': 0.0, 'max_rss_mb': rss}]}]}
+
+
+class TestFitLinear(TestCase):
+
+    def test_fit_linear(self):
+        intercept, slope, max_residual = resources.fit_linear([(0, 1), (10, 21), (20, 41)])
+        self.assertAlmostEqual(intercept, 1)
+        self.assertAlmostEqual(slope, 2)
+        self.assertAlmostEqual(max_residual, 0)
+
+    def test_fit_linear_negative_slope(self):
+        intercept, slope, max_residual = resources.fit_linear([(0, 10), (10, 5), (20, 6)])
+        self.assertEqual(slope, 0)
+        self.assertAlmostEqual(intercept, 7)
+        self.assertAlmostEqual(max_residual, 3)
+
+    def test_fit_linear_same_sizes(self):
+        model = resources.fit_linear([(5, 1), (5, 3)])
+        self.assertAlmostEqual(resources.predict_linear(model, 100), 3)
+
+
+class TestResourceHistory(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.history = resources.ResourceHistory(os.path.join(self.tmp_dir.name, 'history.db'))
+        self.files = {}
+        for name, size in (('a.bam', 1000), ('b.bam', 2000), ('c.bam', 3000), ('d.bam', 10000),
+                           ('a.cram', 500), ('b.cram', 1000), ('c.cram', 1500), ('d.cram', 5000)):
+            self.files[name] = os.path.join(self.tmp_dir.name, name)
+            with open(self.files[name], 'wb') as f:
+                f.write(b'x' * size)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _record_history(self):
+        for name in ('a', 'b', 'c'):
+            bam_size = os.path.getsize(self.files[name + '.bam'])
+            self.history.record(_telemetry(self.files[name + '.bam'], 'stats', bam_size * 0.06, bam_size * 0.12,
+                                           bam_size / 10.0))
+            self.history.record(_telemetry(self.files[name + '.cram'], 'stats', bam_size * 0.03, bam_size * 0.06,
+                                           bam_size / 10.0))
+
+    def test_record_skips_stages_without_processes(self):
+        self.history.record({'stages': [{'file': self.files['a.bam'], 'stage': 'stats', 'duration': 1.0,
+                                         'processes': []},
+                                        {'file': 'irods:/a.bam', 'stage': 'stats', 'duration': 1.0,
+                                         'processes': [{'user_cpu': 1.0, 'system_cpu': 0.0, 'max_rss_mb': 1.0}]}]})
+        self.assertEqual(self.history.observations('stats', 'bam'), [])
+
+    def test_predict_pair(self):
+        self._record_history()
+        result = self.history.predict_pair(self.files['d.bam'], self.files['d.cram'])
+        # stats of the BAM: 600s, 1200s of CPU, 1000MB; stats of the CRAM: 300s, 600s of CPU, 1000MB
+        self.assertEqual(result, {'memory_mb': int((1000 + 1000 + resources.PROCESS_MEMORY_MB) * 1.25),
+                                  'threads': 3, 'walltime_minutes': 15})
+        self.assertEqual(self.history.predict_pair(self.files['d.bam'], self.files['d.cram'], max_threads=2)['threads'],
+                         2)
+
+    def test_predict_pair_memory_of_stages(self):
+        self._record_history()
+        for name in ('a', 'b', 'c'):
+            bam_size = os.path.getsize(self.files[name + '.bam'])
+            self.history.record(_telemetry(self.files[name + '.bam'], 'flagstat', bam_size * 0.01, bam_size * 0.01,
+                                           bam_size / 20.0))
+        result = self.history.predict_pair(self.files['d.bam'], self.files['d.cram'])
+        # The stages of a file run one after the other, so the flagstat of the BAM (500MB) doesn't add to its stats
+        self.assertEqual(result['memory_mb'], int((1000 + 1000 + resources.PROCESS_MEMORY_MB) * 1.25))
+
+    def test_predict_pair_without_enough_history(self):
+        self.history.record(_telemetry(self.files['a.bam'], 'stats', 1.0, 1.0, 1.0))
+        self.assertIsNone(self.history.predict_pair(self.files['d.bam'], self.files['d.cram']))
+
+    def test_predict_pair_not_local(self):
+        self._record_history()
+        self.assertIsNone(self.history.predict_pair('irods:/d.bam', 'irods:/d.cram'))
+
+
+class TestPackPairs(TestCase):
+
+    def test_pack_pairs(self):
+        small = {'memory_mb': 900, 'threads': 1, 'walltime_minutes': 10}
+        predictions = {('a.bam', 'a.cram'): small, ('b.bam', 'b.cram'): small, ('c.bam', 'c.cram'): small,
+                       ('d.bam', 'd.cram'): dict(small, walltime_minutes=25),
+                       ('e.bam', 'e.cram'): {'memory_mb': 7500, 'threads': 4, 'walltime_minutes': 120}}
+        result = resources.pack_pairs(predictions, max_minutes=30)
+        self.assertEqual(result, [{'memory_mb': 1000, 'threads': 1, 'walltime_minutes': 30,
+                                   'elements': [[('d.bam', 'd.cram')],
+                                                [('a.bam', 'a.cram'), ('b.bam', 'b.cram'), ('c.bam', 'c.cram')]]},
+                                  {'memory_mb': 8000, 'threads': 4, 'walltime_minutes': 120,
+                                   'elements': [[('e.bam', 'e.cram')]]}])
+
+
+class TestPlanArrays(TestCase):
+
+    def test_plan_arrays(self):
+        history = mock.Mock()
+        history.predict_pair.side_effect = lambda bam_path, cram_path, max_threads: None if bam_path == 'x.bam' else \
+            {'memory_mb': 1500, 'threads': 2, 'walltime_minutes': 5}
+        executor = executors.LSFExecutor(pairs_per_element=2, history=history)
+        result = executor.plan_arrays([('x.bam', 'x.cram'), ('a.bam', 'a.cram'), ('b.bam', 'b.cram')], threads=4)
+        self.assertEqual(result, [{'memory_mb': executors.DEFAULT_MEMORY_MB, 'threads': 4, 'walltime_minutes': None,
+                                   'elements': [[('x.bam', 'x.cram')]]},
+                                  {'memory_mb': 2000, 'threads': 2, 'walltime_minutes': 10,
+                                   'elements': [[('a.bam', 'a.cram'), ('b.bam', 'b.cram')]]}])
+        history.predict_pair.assert_any_call('a.bam', 'a.cram', max_threads=4)
+
+    def test_lsf_submit_command_with_walltime(self):
+        result = executors.LSFExecutor().submit_command('b2c', 1, None, 2, 'cmd', '/logs', 2000, 10)
+        self.assertEqual(result[result.index('-M') + 1], '2000')
+        self.assertEqual(result[result.index('-W') + 1], '10')
+        result = executors.SlurmExecutor().submit_command('b2c', 1, None, 2, 'cmd', '/logs', 2000, 10)
+        self.assertIn('--mem=2000M', result)
+        self.assertIn('--time=10', result)
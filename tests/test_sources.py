@@ -0,0 +1,150 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import sys
+import zlib
+import hashlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, TestCase
+from checks import sources
+from checks.stats_checks import RunSamtoolsCommands
+
+# Stand-in for iget: writes the local file given as parameter to stdout, or fails if it doesn't exist
+FETCH_SCRIPT = """import sys, shutil
+try:
+    with open(sys.argv[1], 'rb') as f:
+        shutil.copyfileobj(f, sys.stdout.buffer)
+except IOError as e:
+    sys.stderr.write(str(e))
+    sys.exit(3)
+"""
+MD5_CMD = [sys.executable, '-c', 'import sys, hashlib; print(hashlib.md5(sys.stdin.buffer.read()).hexdigest())']
+
+
+class TestFetchCommandArgs(TestCase):
+
+    @mock.patch.dict(os.environ, {}, clear=True)
+    def test_fetch_command_args_default(self):
+        result = sources.fetch_command_args('irods:/seq/1234/1234_5.bam')
+        self.assertEqual(result, ['iget', '/seq/1234/1234_5.bam', '-'])
+
+    @mock.patch.dict(os.environ, {'BAM2CRAM_FETCH_COMMAND': 'irods-cat --zone seq {path}'})
+    def test_fetch_command_args_from_env(self):
+        result = sources.fetch_command_args('irods:/seq/1234/1234_5.bam')
+        self.assertEqual(result, ['irods-cat', '--zone', 'seq', '/seq/1234/1234_5.bam'])
+
+    @mock.patch.dict(os.environ, {'BAM2CRAM_FETCH_COMMAND': 'irods-cat {path}'})
+    def test_fetch_command_args_given(self):
+        result = sources.fetch_command_args('irods:/seq/1234/1234_5.bam', "baton-get --path '{path}'")
+        self.assertEqual(result, ['baton-get', '--path', '/seq/1234/1234_5.bam'])
+
+
+class TestStreamedInput(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        script_fpath = os.path.join(self.tmp_dir.name, 'fetch.py')
+        with open(script_fpath, 'w') as f:
+            f.write(FETCH_SCRIPT)
+        self.fetch_command = '%s %s {path}' % (sys.executable, script_fpath)
+        self.data = os.urandom(3 * 1024 * 1024 + 17)
+        self.fpath = os.path.join(self.tmp_dir.name, 'some.bam')
+        with open(self.fpath, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _streamed_input(self, fpath):
+        return sources.StreamedInput('irods:' + fpath, self.fetch_command, chunk_size=64 * 1024,
+                                     max_buffered_chunks=4)
+
+    def test_stream_to_several_consumers(self):
+        source = self._streamed_input(self.fpath)
+        sinks = [source.open_sink(), source.open_sink()]
+        source.start()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            outputs = list(executor.map(lambda sink: RunSamtoolsCommands._run_subprocess(MD5_CMD, stdin=sink), sinks))
+        source.wait()
+        self.assertEqual(outputs, [hashlib.md5(self.data).hexdigest() + '\n'] * 2)
+
+    def test_stream_computing_digests(self):
+        source = self._streamed_input(self.fpath)
+        source.compute_digests = True
+        early_sink = source.open_sink()
+        source.start()
+        # The digests are of the whole file, even if the consumers don't read it all:
+        RunSamtoolsCommands._run_subprocess([sys.executable, '-c', 'pass'], stdin=early_sink)
+        source.wait()
+        self.assertEqual(source.digests(), {'md5': hashlib.md5(self.data).hexdigest(),
+                                            'crc32': '%08x' % zlib.crc32(self.data), 'size': len(self.data)})
+
+    def test_stream_local_file(self):
+        source = sources.StreamedInput(self.fpath, sources.LOCAL_FETCH_COMMAND, compute_digests=True)
+        sink = source.open_sink()
+        source.start()
+        output = RunSamtoolsCommands._run_subprocess(MD5_CMD, stdin=sink)
+        source.wait()
+        self.assertEqual(output, hashlib.md5(self.data).hexdigest() + '\n')
+        self.assertEqual(source.digests()['md5'], hashlib.md5(self.data).hexdigest())
+
+    def test_stream_when_a_consumer_exits_early(self):
+        source = self._streamed_input(self.fpath)
+        early_sink, sink = source.open_sink(), source.open_sink()
+        source.start()
+        RunSamtoolsCommands._run_subprocess([sys.executable, '-c', 'pass'], stdin=early_sink)
+        output = RunSamtoolsCommands._run_subprocess(MD5_CMD, stdin=sink)
+        source.wait()
+        self.assertEqual(output, hashlib.md5(self.data).hexdigest() + '\n')
+
+    def test_stream_when_fetch_fails(self):
+        source = self._streamed_input(os.path.join(self.tmp_dir.name, 'missing.bam'))
+        sink = source.open_sink()
+        source.start()
+        RunSamtoolsCommands._run_subprocess(MD5_CMD, stdin=sink)
+        self.assertRaises(RuntimeError, source.wait)
+
+    def test_prefetch_reads_ahead_a_bounded_amount(self):
+        source = self._streamed_input(self.fpath)
+        source.start_fetching()
+        # The fetch command can't finish as only 4 chunks (+1 being put in the queue) are read ahead:
+        self.assertRaises(Exception, source._proc.wait, 0.5)
+        sink = source.open_sink()
+        source.start()
+        output = RunSamtoolsCommands._run_subprocess(MD5_CMD, stdin=sink)
+        source.wait()
+        self.assertEqual(output, hashlib.md5(self.data).hexdigest() + '\n')
+
+    def test_open_input_takes_the_prefetched_one(self):
+        sources.prefetch('irods:' + self.fpath, self.fetch_command)
+        source = sources.open_input('irods:' + self.fpath, self.fetch_command)
+        self.assertIsNotNone(source._proc)
+        self.assertIsNone(sources.open_input('irods:' + self.fpath, self.fetch_command)._proc)
+        source.discard()
+
+    def test_discard_prefetched(self):
+        sources.prefetch('irods:' + self.fpath, self.fetch_command)
+        sources.prefetch('irods:/other.bam', self.fetch_command)
+        sources.discard_prefetched(keep=['irods:/other.bam'])
+        self.assertEqual(list(sources._prefetched), ['irods:/other.bam'])
+        sources.discard_prefetched()
+        self.assertEqual(sources._prefetched, {})
@@ -20,9 +20,23 @@ This file has been created on Feb 09, 2016.
 """
 
 import os
-from unittest import mock, TestCase, skip
+import sys
+import gzip
+import shutil
+import json
+import signal
+import hashlib
+import tempfile
+from unittest import mock, TestCase
 from checks import stats_checks
+from checks import streaming
+from checks import cancellation
+from checks import cache
+from checks import threads as samtools_threads
+from benchmarks import fixtures
 import subprocess
+import threading
+import zlib
 from collections import namedtuple
 
 
@@ -56,19 +70,23 @@ class TestRunSamtoolsCommands(TestCase):
     @mock.patch('checks.stats_checks.RunSamtoolsCommands._run_subprocess')
     def test_run_samtools_quickcheck_1(self, mock_subproc):
         stats_checks.RunSamtoolsCommands.run_samtools_quickcheck('some_path')
-        mock_subproc.assert_called_with(['samtools', 'quickcheck', '-v', 'some_path'])
+        mock_subproc.assert_called_with(['samtools', 'quickcheck', '-v', 'some_path'], None)
 
     @mock.patch('checks.stats_checks.RunSamtoolsCommands._run_subprocess')
     def test_get_samtools_flagstat_output_1(self, mock_subproc):
         stats_checks.RunSamtoolsCommands.get_samtools_flagstat_output('some_path')
-        mock_subproc.assert_called_with(['samtools', 'flagstat', 'some_path'])
+        mock_subproc.assert_called_with(['samtools', 'flagstat', 'some_path'], None, None)
 
     @mock.patch('checks.stats_checks.RunSamtoolsCommands._run_subprocess')
-    def test_get_samtools_stats_output_1(self, mock_subproc):
-        mock_subproc.return_value = 'some_stats'
-        result = stats_checks.RunSamtoolsCommands.get_samtools_stats_output('some_path')
-        mock_subproc.assert_called_with(['samtools', 'stats', 'some_path'])
-        self.assertEqual(result, 'some_stats')
+    def test_get_samtools_flagstat_output_threads(self, mock_subproc):
+        stats_checks.RunSamtoolsCommands.get_samtools_flagstat_output('some_path', threads=4)
+        mock_subproc.assert_called_with(['samtools', 'flagstat', '-@', '3', 'some_path'], None, None)
+
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands._stream_subprocess')
+    def test_stream_samtools_stats_output(self, mock_subproc):
+        consumers = [streaming.ChecksumExtractor()]
+        stats_checks.RunSamtoolsCommands.stream_samtools_stats_output('some_path', consumers)
+        mock_subproc.assert_called_with(['samtools', 'stats', 'some_path'], consumers, stdin=None, cancellation=None)
 
 
 class TestHandleSamtoolsStats(TestCase):
@@ -97,14 +115,29 @@ class TestHandleSamtoolsStats(TestCase):
         actual_result = stats_checks.HandleSamtoolsStats.extract_seq_checksum_from_stats(stats)
         self.assertEqual(wanted_result, actual_result)
 
-    @mock.patch('checks.stats_checks.os.path')
-    @mock.patch('checks.stats_checks.utils.read_from_file')
-    def test_get_stats_1(self, mock_readf, mock_path):
-        mock_readf.return_value = 'some stats'
-        mock_path.isfile.return_value = True
-        result = stats_checks.HandleSamtoolsStats._get_stats('some path')
-        expected = 'some stats'
-        self.assertEqual(result, expected)
+    def test_extract_summary_numbers_from_stats(self):
+        stats = "CHK\t1bfca46a\t2046405a\tf4f56eb9\nSN\traw total sequences:\t235\n" \
+                "SN\treads paired:\t234\t# paired-end technology bit set\n"
+        result = stats_checks.HandleSamtoolsStats.extract_summary_numbers_from_stats(stats)
+        self.assertEqual(result, {'raw total sequences': '235', 'reads paired': '234'})
+
+    def test_extract_flagstat_counts_from_stats(self):
+        stats = "SN\traw total sequences:\t235\nSN\taverage length:\t101\nSN\treads mapped:\t230\n"
+        result = stats_checks.HandleSamtoolsStats.extract_flagstat_counts_from_stats(stats)
+        self.assertEqual(result, {'raw total sequences': 235, 'reads mapped': 230})
+
+    def test_extract_flagstat_counts_from_stats_no_sn(self):
+        result = stats_checks.HandleSamtoolsStats.extract_flagstat_counts_from_stats("CHK\t1\t2\t3\n")
+        self.assertIsNone(result)
+
+    def test_get_stats_1(self):
+        test_data_dirpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test-cases')
+        stats_fpath = os.path.join(test_data_dirpath, 'ok_bam_cram/mpileup.3.bam.stats')
+        result = stats_checks.HandleSamtoolsStats._get_stats(stats_fpath)
+        self.assertEqual(stats_checks.HandleSamtoolsStats.extract_seq_checksum_from_stats(result),
+                         "CHK\t6a4b2306\teca97c7a\t9507eccd")
+        self.assertEqual(stats_checks.HandleSamtoolsStats.extract_summary_numbers_from_stats(result)['sequences'], '235')
+        self.assertNotIn('FFQ', result)
 
     @mock.patch('checks.stats_checks.os.path')
     def test_get_stats_2(self, mock_path):
@@ -128,33 +161,49 @@ class TestHandleSamtoolsStats(TestCase):
         self.assertRaises(ValueError, stats_checks.HandleSamtoolsStats._generate_stats, None)
 
     @mock.patch('checks.stats_checks.os.path')
-    @mock.patch('checks.stats_checks.RunSamtoolsCommands.get_samtools_stats_output')
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands.stream_samtools_stats_output')
     def test_generate_stats_3(self, mock_stats, mock_path):
-        mock_stats.return_value = 'some stats'
+        def stream_stats(fpath, consumers, threads=None, cancellation=None, stdin=None):
+            streaming.feed_lines(['# some comment\n', 'CHK\t1\t2\t3\n', 'SN\tsequences:\t2\n', 'RL\t1\t2\n'],
+                                 consumers)
+        mock_stats.side_effect = stream_stats
         mock_path.isfile.return_value = True
         result = stats_checks.HandleSamtoolsStats._generate_stats('some path')
-        expected = 'some stats'
+        expected = 'CHK\t1\t2\t3\nSN\tsequences:\t2\n'
         self.assertEqual(result, expected)
 
 
-    def test_persist_stats_when_empty_params(self):
-        self.assertRaises(ValueError, stats_checks.HandleSamtoolsStats.persist_stats, None, None)
-
-    def test_persist_stats_when_one_empty_param(self):
-        self.assertRaises(ValueError, stats_checks.HandleSamtoolsStats.persist_stats, None, 'irrelevant')
-
-    @mock.patch('checks.stats_checks.os.path')
-    def test_persist_stats_when_existing_stats_file(self, mock_path):
-        mock_path.isfile.return_value = True
-        result = stats_checks.HandleSamtoolsStats.persist_stats('some stats', 'some path')
-        self.assertFalse(result)
-
-    @mock.patch('checks.utils.write_to_file')
-    def test_persist_stats_when_ok(self, mock_writef):
-        mock_writef.return_value = True
-        result = stats_checks.HandleSamtoolsStats.persist_stats('some stats', 'some path')
-        expected = True
-        self.assertEqual(result, expected)
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands.stream_samtools_stats_output')
+    def test_generate_stats_writes_sidecar(self, mock_stats):
+        lines = ['CHK\t1\t2\t3\n', 'SN\tsequences:\t2\n', 'RL\t1\t2\n']
+
+        def stream_stats(fpath, consumers, threads=None, cancellation=None, stdin=None):
+            streaming.feed_lines(lines, consumers)
+            for consumer in consumers:
+                consumer.finish()
+        mock_stats.side_effect = stream_stats
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            data_fpath = os.path.join(tmp_dir, 'a.bam')
+            open(data_fpath, 'w').close()
+            result = stats_checks.HandleSamtoolsStats._generate_stats(data_fpath, data_fpath + '.stats')
+            self.assertEqual(result, 'CHK\t1\t2\t3\nSN\tsequences:\t2\n')
+            with open(data_fpath + '.stats') as f:
+                self.assertEqual(f.read(), ''.join(lines))
+
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands.stream_samtools_stats_output')
+    def test_generate_stats_failed_doesnt_leave_sidecar(self, mock_stats):
+        def stream_stats(fpath, consumers, threads=None, cancellation=None, stdin=None):
+            for consumer in consumers:
+                consumer.consume('CHK\t1\t2\t3\n')
+                consumer.abort()
+            raise RuntimeError('samtools stats failed')
+        mock_stats.side_effect = stream_stats
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            data_fpath = os.path.join(tmp_dir, 'a.bam')
+            open(data_fpath, 'w').close()
+            with self.assertRaises(RuntimeError):
+                stats_checks.HandleSamtoolsStats._generate_stats(data_fpath, data_fpath + '.stats')
+            self.assertEqual(os.listdir(tmp_dir), ['a.bam'])
 
     @mock.patch('checks.stats_checks.utils.can_read_file')
     @mock.patch('checks.stats_checks.os.path')
@@ -219,6 +268,29 @@ class TestCompareStatsForFiles(TestCase):
 
 
 
+    def test_compare_flagstats_counts_when_equal(self):
+        result = stats_checks.CompareStatsForFiles.compare_flagstats({'reads mapped': 3}, {'reads mapped': 3})
+        self.assertEqual(result, [])
+
+    def test_compare_flagstats_counts_when_different(self):
+        result = stats_checks.CompareStatsForFiles.compare_flagstats({'reads mapped': 3, 'reads paired': 2},
+                                                                     {'reads mapped': 4, 'reads paired': 2})
+        self.assertEqual(result, ['FLAGSTAT DIFFERENT for reads mapped: 3 and 4'])
+
+    @mock.patch('checks.stats_checks.os.path')
+    @mock.patch('checks.stats_checks.utils')
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands')
+    @mock.patch('checks.stats_checks.HandleSamtoolsStats.fetch_stats')
+    def test_compare_bam_and_cram_by_statistics_single_decode(self, mock_fetch_stats, mock_samt, mock_utils, mock_path):
+        mock_path.isfile.return_value = True
+        mock_utils.can_read_file.return_value = True
+        mock_utils.is_irods_path.return_value = False
+        mock_fetch_stats.return_value = 'CHK\t1\t2\t3\nSN\treads mapped:\t5\n'
+        result = stats_checks.CompareStatsForFiles.compare_bam_and_cram_by_statistics('some bam', 'some cram',
+                                                                                       single_decode=True)
+        self.assertEqual(result, [])
+        self.assertFalse(mock_samt.get_samtools_flagstat_output.called)
+
     def test_compare_stats_by_sequence_checksum_1(self):
         result = stats_checks.CompareStatsForFiles.compare_stats_by_sequence_checksum('stats1\nCHK 1234', 'stats2\nCHK 1234')
         self.assertEqual(len(result), 0)
@@ -258,16 +330,29 @@ class TestCompareStatsForFiles(TestCase):
     @mock.patch('checks.stats_checks.utils')
     @mock.patch('checks.stats_checks.RunSamtoolsCommands')
     @mock.patch('checks.stats_checks.HandleSamtoolsStats.fetch_stats')
-    @mock.patch('checks.stats_checks.HandleSamtoolsStats.persist_stats')
-    def test_compare_bam_and_cram_by_statistics(self, mock_persist_stats, mock_fetch_stats, mock_samt, mock_utils, mock_path):
+    def test_compare_bam_and_cram_by_statistics(self, mock_fetch_stats, mock_samt, mock_utils, mock_path):
         mock_path.isfile.return_value = True
         mock_utils.can_read_file.return_value = True
+        mock_utils.is_irods_path.return_value = False
         mock_samt.get_samtools_flagstat_output.return_value = 'flag'
         mock_fetch_stats.side_effect = ['\nCHK 123', '\nCHK 456']
-        mock_persist_stats.return_value = True
         result = stats_checks.CompareStatsForFiles.compare_bam_and_cram_by_statistics('some bam', 'some cram')
         self.assertEqual(len(result), 1)
 
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands')
+    @mock.patch('checks.stats_checks.HandleSamtoolsStats.fetch_stats')
+    def test_compare_bam_and_cram_by_statistics_doesnt_save_compact_stats(self, mock_fetch_stats, mock_samt):
+        mock_samt.get_samtools_flagstat_output.return_value = 'flag'
+        mock_fetch_stats.return_value = 'CHK\t1\t2\t3\nSN\tsequences:\t2\n'
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bam_path, cram_path = os.path.join(tmp_dir, 'a.bam'), os.path.join(tmp_dir, 'a.cram')
+            for fpath in (bam_path, cram_path):
+                open(fpath, 'w').close()
+            result = stats_checks.CompareStatsForFiles.compare_bam_and_cram_by_statistics(bam_path, cram_path,
+                                                                                           all_sections=True)
+            self.assertEqual(result, [])
+            self.assertEqual(sorted(os.listdir(tmp_dir)), ['a.bam', 'a.cram'])
+
     @mock.patch('checks.stats_checks.os.path')
     @mock.patch('checks.stats_checks.utils.can_read_file')
     def test_compare_bam_and_cram_by_statistics_cant_read(self, mock_can_readf, mock_path):
@@ -277,6 +362,500 @@ class TestCompareStatsForFiles(TestCase):
         self.assertEqual(len(result), 2)
 
 
+    @mock.patch('checks.stats_checks.os.path')
+    @mock.patch('checks.stats_checks.utils')
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands')
+    @mock.patch('checks.stats_checks.HandleSamtoolsStats.fetch_stats')
+    def test_compare_bam_and_cram_by_statistics_quickcheck_fails(self, mock_fetch_stats, mock_samt, mock_utils, mock_path):
+        mock_path.isfile.return_value = True
+        mock_utils.can_read_file.return_value = True
+        mock_utils.is_irods_path.return_value = False
+        mock_samt.run_samtools_quickcheck.side_effect = [None, RuntimeError('quickcheck failed')]
+        result = stats_checks.CompareStatsForFiles.compare_bam_and_cram_by_statistics('some bam', 'some cram')
+        self.assertEqual(result, ['quickcheck failed'])
+
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands')
+    @mock.patch('checks.stats_checks.HandleSamtoolsStats.fetch_stats')
+    def test_run_checks_on_file_when_aborted(self, mock_fetch_stats, mock_samt):
+        abort = threading.Event()
+        abort.set()
+        result = stats_checks.CompareStatsForFiles._run_checks_on_file('some bam', 'some bam.stats', abort)
+        self.assertFalse(mock_samt.get_samtools_flagstat_output.called)
+        self.assertFalse(mock_fetch_stats.called)
+        self.assertIsNone(result['stats'])
+
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands')
+    def test_run_checks_on_file_quickcheck_sets_abort(self, mock_samt):
+        abort = threading.Event()
+        mock_samt.run_samtools_quickcheck.side_effect = RuntimeError('quickcheck failed')
+        result = stats_checks.CompareStatsForFiles._run_checks_on_file('some bam', 'some bam.stats', abort)
+        self.assertTrue(abort.is_set())
+        self.assertEqual(result['quickcheck_errors'], ['quickcheck failed'])
+
+
+class TestCompareBamAndCrams(TestCase):
+
+    @mock.patch('checks.stats_checks.os.path.getsize', return_value=100)
+    @mock.patch('checks.stats_checks.CompareStatsForFiles._check_file_paths')
+    @mock.patch('checks.stats_checks.HandleSamtoolsStats.fetch_stats')
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands')
+    def test_compare_bam_and_crams_decodes_bam_once(self, mock_samt, mock_fetch_stats, mock_check_paths, mock_getsize):
+        mock_check_paths.return_value = []
+        mock_samt.get_samtools_flagstat_output.side_effect = lambda fpath, threads, cancellation: \
+            'flag 2' if fpath == 'v2.cram' else 'flag'
+        mock_fetch_stats.side_effect = lambda fpath, *args: '\nCHK 456' if fpath == 'binned.cram' else '\nCHK 123'
+        result = stats_checks.CompareStatsForFiles.compare_bam_and_crams_by_statistics(
+            'some.bam', ['v3.cram', 'v2.cram', 'binned.cram'], threads=4)
+        self.assertEqual(result['v3.cram'], [])
+        self.assertTrue(result['v2.cram'][0].startswith("FLAGSTAT DIFFERENT"))
+        self.assertEqual(len(result['binned.cram']), 1)
+        self.assertTrue(result['binned.cram'][0].startswith("STATS SEQUENCE CHECKSUM DIFFERENT"))
+        flagstat_fpaths = [call[0][0] for call in mock_samt.get_samtools_flagstat_output.call_args_list]
+        self.assertEqual(sorted(flagstat_fpaths), ['binned.cram', 'some.bam', 'v2.cram', 'v3.cram'])
+        stats_fpaths = [call[0][0] for call in mock_fetch_stats.call_args_list]
+        self.assertEqual(sorted(stats_fpaths), ['binned.cram', 'some.bam', 'v2.cram', 'v3.cram'])
+
+    @mock.patch('checks.stats_checks.CompareStatsForFiles._check_file_paths')
+    @mock.patch('checks.stats_checks.HandleSamtoolsStats.fetch_stats')
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands')
+    def test_compare_bam_and_crams_cram_quickcheck_fails(self, mock_samt, mock_fetch_stats, mock_check_paths):
+        mock_check_paths.return_value = []
+
+        def quickcheck(fpath, cancellation):
+            if fpath == 'bad.cram':
+                raise RuntimeError('quickcheck failed')
+        mock_samt.run_samtools_quickcheck.side_effect = quickcheck
+        mock_samt.get_samtools_flagstat_output.return_value = 'flag'
+        mock_fetch_stats.return_value = '\nCHK 123'
+        result = stats_checks.CompareStatsForFiles.compare_bam_and_crams_by_statistics('some.bam',
+                                                                                        ['bad.cram', 'good.cram'])
+        self.assertEqual(result, {'bad.cram': ['quickcheck failed'], 'good.cram': []})
+
+    @mock.patch('checks.stats_checks.os.path.isfile')
+    def test_compare_bam_and_crams_invalid_path(self, mock_isfile):
+        mock_isfile.side_effect = lambda fpath: fpath != 'missing.cram'
+        with mock.patch('checks.stats_checks.CompareStatsForFiles._run_checks_on_file') as mock_run_checks, \
+                mock.patch('checks.stats_checks.utils.can_read_file', return_value=True):
+            mock_run_checks.return_value = {'quickcheck_errors': ['quickcheck failed'], 'flagstat': None,
+                                            'flagstat_errors': [], 'stats': None, 'stats_errors': []}
+            result = stats_checks.CompareStatsForFiles.compare_bam_and_crams_by_statistics('some.bam',
+                                                                                            ['missing.cram', 'a.cram'])
+        self.assertEqual(result['missing.cram'], ["The CRAM file path:missing.cram is not valid"])
+        self.assertEqual(result['a.cram'], ['quickcheck failed', 'quickcheck failed'])
+
+
+class TestStreamedChecks(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.fpath = os.path.join(self.tmp_dir.name, 'some.bam')
+        with open(self.fpath, 'wb') as f:
+            f.write(b'some bam content' * 10000)
+        # Stand-in for iget, writing a local file to stdout:
+        self.fetch_command = "%s -c 'import sys, shutil; shutil.copyfileobj(open(sys.argv[1], \"rb\"), " \
+                             "sys.stdout.buffer)' {path}" % sys.executable
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    @mock.patch('checks.stats_checks.HandleSamtoolsStats._generate_stats')
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands.get_samtools_flagstat_output')
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands.run_samtools_quickcheck')
+    def test_run_checks_on_irods_file(self, mock_quickcheck, mock_flagstat, mock_generate_stats):
+        mock_flagstat.side_effect = lambda fpath, threads, cancellation, stdin: 'flagstat of %s bytes' % \
+            len(stdin.read())
+        mock_generate_stats.side_effect = lambda fpath, sidecar_fpath, cancellation, stdin, threads: \
+            'stats of %s bytes' % len(stdin.read())
+        cancel = cancellation.Cancellation()
+        result = stats_checks.CompareStatsForFiles._run_checks_on_file('irods:' + self.fpath, None, cancel,
+                                                                       fetch_command=self.fetch_command)
+        self.assertFalse(mock_quickcheck.called)
+        self.assertEqual(result['flagstat'], 'flagstat of 160000 bytes')
+        self.assertEqual(result['stats'], 'stats of 160000 bytes')
+        self.assertEqual(mock_flagstat.call_args[0][0], '-')
+        self.assertIsNone(mock_generate_stats.call_args[1]['sidecar_fpath'])
+        self.assertFalse(cancel.is_set())
+
+    @mock.patch('checks.stats_checks.HandleSamtoolsStats._generate_stats')
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands.get_samtools_flagstat_output')
+    def test_run_checks_on_irods_file_fetch_fails(self, mock_flagstat, mock_generate_stats):
+        mock_flagstat.side_effect = lambda fpath, threads, cancellation, stdin: stdin.read() and None
+        mock_generate_stats.side_effect = lambda fpath, sidecar_fpath, cancellation, stdin, threads: \
+            stdin.read() and None
+        cancel = cancellation.Cancellation()
+        result = stats_checks.CompareStatsForFiles._run_checks_on_file('irods:/missing.bam', None, cancel,
+                                                                       fetch_command=self.fetch_command)
+        self.assertEqual(len(result['quickcheck_errors']), 1)
+        self.assertTrue(cancel.is_set())
+
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands.get_samtools_flagstat_output')
+    def test_run_checks_on_irods_file_cached(self, mock_flagstat):
+        mock_cache = mock.Mock()
+        mock_cache.get_output.side_effect = lambda fpath, args_list: 'cached %s' % args_list[0]
+        result = stats_checks.CompareStatsForFiles._run_checks_on_file('irods:/some.bam', None, cancellation.Cancellation(),
+                                                                       cache=mock_cache)
+        self.assertFalse(mock_flagstat.called)
+        self.assertEqual(result['flagstat'], 'cached flagstat')
+        self.assertEqual(result['stats'], 'cached stats')
+
+    @mock.patch('checks.stats_checks.HandleSamtoolsStats._generate_stats')
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands.get_samtools_flagstat_output')
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands.run_samtools_quickcheck')
+    def test_run_checks_on_local_file_with_digests(self, mock_quickcheck, mock_flagstat, mock_generate_stats):
+        mock_flagstat.side_effect = lambda fpath, threads, cancellation, stdin: 'flagstat of %s bytes' % \
+            len(stdin.read())
+        mock_generate_stats.side_effect = lambda fpath, sidecar_fpath, cancellation, stdin, threads: \
+            'stats of %s bytes' % len(stdin.read())
+        stats_cache = cache.DirectoryCache(os.path.join(self.tmp_dir.name, 'cache'))
+        digests = {}
+        with mock.patch('checks.cache.samtools_version', return_value='samtools 1.10'):
+            result = stats_checks.CompareStatsForFiles._run_checks_on_file(self.fpath, self.fpath + '.stats',
+                                                                           cancellation.Cancellation(),
+                                                                           cache=stats_cache, digests=digests)
+            mock_quickcheck.assert_called_once_with(self.fpath, mock.ANY)
+            self.assertEqual(result['flagstat'], 'flagstat of 160000 bytes')
+            self.assertEqual(result['stats'], 'stats of 160000 bytes')
+            # The full samtools stats output is saved next to the file, as when it isn't streamed:
+            self.assertEqual(mock_generate_stats.call_args[1]['sidecar_fpath'], self.fpath + '.stats')
+            with open(self.fpath, 'rb') as f:
+                content = f.read()
+            expected = {'md5': hashlib.md5(content).hexdigest(), 'crc32': '%08x' % zlib.crc32(content),
+                        'size': 160000}
+            self.assertEqual(digests, {self.fpath: expected})
+            # The digests are cached together with the outputs, so the file isn't read again:
+            digests = {}
+            stats_checks.CompareStatsForFiles._run_checks_on_file(self.fpath, self.fpath + '.stats',
+                                                                  cancellation.Cancellation(), cache=stats_cache,
+                                                                  digests=digests)
+        self.assertEqual(digests, {self.fpath: expected})
+        self.assertEqual(mock_flagstat.call_count, 1)
+
+    @mock.patch('checks.stats_checks.CompareStatsForFiles.compare_bam_and_cram_by_statistics')
+    def test_verify_bam_and_cram_with_digests(self, mock_compare):
+        def compare(bam_path, cram_path, telemetry, digests):
+            digests.update({bam_path: {'md5': 'b'}, cram_path: {'md5': 'c'}})
+            return []
+        mock_compare.side_effect = compare
+        with mock.patch('checks.stats_checks.CompareStatsForFiles._check_file_paths', return_value=[]):
+            result = stats_checks.CompareStatsForFiles.verify_bam_and_cram('a.bam', 'a.cram', compute_digests=True,
+                                                                           tiers=[stats_checks.TIER_FULL])
+        self.assertEqual(result['digests'], {'a.bam': {'md5': 'b'}, 'a.cram': {'md5': 'c'}})
+
+
+class TestStreamedChecksWithThreadBudget(TestCase):
+    """Streams bigger than the pipes to their consumers, with fewer threads than samtools processes."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        bin_dir = os.path.join(self.tmp_dir.name, 'bin')
+        fixtures.write_fake_samtools(bin_dir)
+        self.bam_path, self.cram_path = fixtures.make_pairs(os.path.join(self.tmp_dir.name, 'data'), 1,
+                                                            extra_lines=10)[0]
+        for fpath in (self.bam_path, self.cram_path):
+            with open(fpath, 'wb') as f:
+                f.write(b'fake alignment data' * 200000)
+        environ = mock.patch.dict(os.environ, {'PATH': bin_dir + os.pathsep + os.environ['PATH'],
+                                               'BAM2CRAM_SAMTOOLS_CACHE': self.tmp_dir.name,
+                                               'FAKE_SAMTOOLS_STDIN': self.bam_path})
+        environ.start()
+        self.addCleanup(environ.stop)
+
+    def _compare(self, bam_path, cram_path, **kwargs):
+        """
+        Runs the comparison in another process, which is killed if it's blocked.
+        :return: the errors and the digests
+        """
+        code = "import json\nfrom checks import stats_checks\ndigests = {}\n" \
+               "errors = stats_checks.CompareStatsForFiles.compare_bam_and_cram_by_statistics(\n" \
+               "    %r, %r, digests=digests, **%r)\nprint(json.dumps([errors, digests]))" % \
+               (bam_path, cram_path, kwargs)
+        root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        proc = subprocess.Popen([sys.executable, '-c', code], cwd=root_dir, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, universal_newlines=True, start_new_session=True)
+        try:
+            out, _ = proc.communicate(timeout=60)
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+            proc.communicate()
+            self.fail("The comparison of %s and %s is blocked" % (bam_path, cram_path))
+        return json.loads(out.splitlines()[-1])
+
+    def test_streamed_files_with_one_thread(self):
+        errors, digests = self._compare('irods:' + self.bam_path, 'irods:' + self.cram_path, threads=1,
+                                        fetch_command='cat {path}')
+        self.assertEqual(errors, [])
+        self.assertEqual(digests['irods:' + self.bam_path]['size'], 3800000)
+
+    def test_streamed_files_with_two_threads(self):
+        errors, _ = self._compare('irods:' + self.bam_path, 'irods:' + self.cram_path, threads=2,
+                                  fetch_command='cat {path}')
+        self.assertEqual(errors, [])
+
+    def test_local_files_with_digests_with_one_thread(self):
+        # With --digests, the local files are streamed to flagstat and stats too
+        errors, digests = self._compare(self.bam_path, self.cram_path, threads=1)
+        self.assertEqual(errors, [])
+        self.assertEqual(digests[self.cram_path]['size'], 3800000)
+        self.assertTrue(os.path.isfile(self.bam_path + '.stats'))
+
+
+class TestVerificationTiers(TestCase):
+
+    header_b = "@HD\tVN:1.4\tSO:coordinate\n@SQ\tSN:1\tLN:249250621\n@SQ\tSN:2\tLN:243199373\n" \
+               "@RG\tID:1#1\tSM:sample1\tLB:lib1\n@RG\tID:1#2\tSM:sample1\tLB:lib2\n@PG\tID:bwa\n"
+
+    def test_compare_headers_when_equal(self):
+        # Extra @SQ tags added by the conversion, the @RG lines in a different order and an extra @PG are fine
+        header_c = "@HD\tVN:1.4\tSO:coordinate\n@SQ\tSN:1\tLN:249250621\tM5:1b22b98cdeb4a9304cb5d48026a85128\n" \
+                   "@SQ\tSN:2\tLN:243199373\n@RG\tID:1#2\tSM:sample1\tLB:lib2\n" \
+                   "@RG\tID:1#1\tSM:sample1\tLB:lib1\n@PG\tID:bwa\n@PG\tID:samtools\n"
+        self.assertEqual(stats_checks.CompareStatsForFiles.compare_headers(self.header_b, header_c), [])
+
+    def test_compare_headers_when_sq_different(self):
+        header_c = self.header_b.replace("LN:243199373", "LN:243199374")
+        result = stats_checks.CompareStatsForFiles.compare_headers(self.header_b, header_c)
+        self.assertEqual(len(result), 1)
+        self.assertTrue(result[0].startswith("HEADER @SQ DIFFERENT"))
+
+    def test_compare_headers_when_rg_missing(self):
+        header_c = self.header_b.replace("@RG\tID:1#2\tSM:sample1\tLB:lib2\n", "")
+        result = stats_checks.CompareStatsForFiles.compare_headers(self.header_b, header_c)
+        self.assertEqual(len(result), 1)
+        self.assertTrue(result[0].startswith("HEADER @RG DIFFERENT"))
+
+    def test_compare_idxstats_when_equal(self):
+        idxstats = "1\t249250621\t100\t2\n2\t243199373\t50\t0\n*\t0\t0\t10\n"
+        self.assertEqual(stats_checks.CompareStatsForFiles.compare_idxstats(idxstats, idxstats), [])
+
+    def test_compare_idxstats_when_different(self):
+        idxstats_b = "1\t249250621\t100\t2\n2\t243199373\t50\t0\n*\t0\t0\t10\n"
+        idxstats_c = "1\t249250621\t100\t2\n2\t243199373\t49\t0\n*\t0\t0\t10\n"
+        result = stats_checks.CompareStatsForFiles.compare_idxstats(idxstats_b, idxstats_c)
+        self.assertEqual(result, ["IDXSTATS DIFFERENT for 2: ['243199373', '50', '0'] and ['243199373', '49', '0']"])
+
+    @mock.patch('checks.stats_checks.utils.find_index_file')
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands.get_samtools_idxstats_output')
+    def test_compare_idxstats_of_files_not_indexed(self, mock_idxstats, mock_find_index):
+        mock_find_index.side_effect = ['some bam.bai', None]
+        result = stats_checks.CompareStatsForFiles.compare_idxstats_of_files('some bam', 'some cram')
+        self.assertEqual(result, [])
+        self.assertFalse(mock_idxstats.called)
+
+    @mock.patch('checks.stats_checks.HandleSamtoolsStats.get_header_contigs')
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands.get_samtools_idxstats_output')
+    def test_get_contigs_with_reads_of_cram(self, mock_idxstats, mock_header_contigs):
+        mock_header_contigs.return_value = [('1', 249250621), ('2', 243199373), ('3', 198022430)]
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        cram_path = os.path.join(tmp_dir, 'a.cram')
+        open(cram_path, 'w').close()
+        with gzip.open(cram_path + '.crai', 'wt') as f:
+            f.write("0\t1\t5000\t1200\t200\t9000\n0\t5001\t4000\t10200\t200\t8000\n"
+                    "2\t1\t3000\t18200\t200\t7000\n-1\t0\t1\t25200\t200\t500\n")
+        result = stats_checks.CompareStatsForFiles.get_contigs_with_reads(cram_path)
+        self.assertEqual(result, {'1', '3', '*'})
+        self.assertFalse(mock_idxstats.called)
+
+    @mock.patch('checks.stats_checks.utils.find_index_file')
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands.get_samtools_idxstats_output')
+    def test_get_contigs_with_reads_of_bam(self, mock_idxstats, mock_find_index):
+        mock_find_index.return_value = 'some bam.bai'
+        mock_idxstats.return_value = "1\t249250621\t100\t2\n2\t243199373\t0\t0\n3\t198022430\t0\t1\n*\t0\t0\t10\n"
+        result = stats_checks.CompareStatsForFiles.get_contigs_with_reads('some bam')
+        self.assertEqual(result, {'1', '3', '*'})
+
+    def test_compare_contigs_with_reads_when_different(self):
+        result = stats_checks.CompareStatsForFiles.compare_contigs_with_reads({'1', '2', '*'}, {'1', '3', '*'})
+        self.assertEqual(result, ["INDEX CONTIGS DIFFERENT: contigs with reads only in the BAM: ['2'], "
+                                  "only in the CRAM: ['3']"])
+
+    @mock.patch('checks.stats_checks.utils.find_index_file')
+    @mock.patch('checks.stats_checks.CompareStatsForFiles.get_contigs_with_reads')
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands.get_samtools_idxstats_output')
+    def test_compare_idxstats_of_files_with_crai(self, mock_idxstats, mock_contigs, mock_find_index):
+        mock_find_index.side_effect = lambda fpath: fpath + ('.crai' if fpath.endswith('cram') else '.bai')
+        mock_contigs.return_value = {'1', '*'}
+        result = stats_checks.CompareStatsForFiles.compare_idxstats_of_files('some bam', 'some cram')
+        self.assertEqual(result, [])
+        self.assertEqual(mock_contigs.call_count, 2)
+        self.assertFalse(mock_idxstats.called)
+
+    @mock.patch('checks.stats_checks.CompareStatsForFiles._check_file_paths')
+    @mock.patch('checks.stats_checks.CompareStatsForFiles.compare_bam_and_cram_by_statistics')
+    @mock.patch('checks.stats_checks.CompareStatsForFiles.compare_idxstats_of_files')
+    @mock.patch('checks.stats_checks.CompareStatsForFiles.compare_headers_of_files')
+    def test_verify_stops_at_first_failing_tier(self, mock_headers, mock_idxstats, mock_compare, mock_check_paths):
+        mock_check_paths.return_value = []
+        mock_headers.return_value = ['HEADER @SQ DIFFERENT']
+        result = stats_checks.CompareStatsForFiles.verify_bam_and_cram('some bam', 'some cram',
+                                                                       tiers=stats_checks.TIERS)
+        self.assertEqual((result['errors'], result['tier']), (['HEADER @SQ DIFFERENT'], stats_checks.TIER_HEADER))
+        self.assertFalse(mock_idxstats.called)
+        self.assertFalse(mock_compare.called)
+
+    @mock.patch('checks.stats_checks.CompareStatsForFiles._check_file_paths')
+    @mock.patch('checks.stats_checks.CompareStatsForFiles.compare_bam_and_cram_by_statistics')
+    @mock.patch('checks.stats_checks.CompareStatsForFiles.compare_idxstats_of_files')
+    @mock.patch('checks.stats_checks.CompareStatsForFiles.compare_headers_of_files')
+    def test_verify_cheap_tiers_only(self, mock_headers, mock_idxstats, mock_compare, mock_check_paths):
+        mock_check_paths.return_value = []
+        mock_headers.return_value = []
+        mock_idxstats.return_value = []
+        result = stats_checks.CompareStatsForFiles.verify_bam_and_cram(
+            'some bam', 'some cram', tiers=[stats_checks.TIER_INDEX, stats_checks.TIER_HEADER])
+        self.assertEqual((result['errors'], result['tier']), ([], stats_checks.TIER_INDEX))
+        self.assertFalse(mock_compare.called)
+
+    @mock.patch('checks.stats_checks.CompareStatsForFiles._check_file_paths')
+    @mock.patch('checks.stats_checks.CompareStatsForFiles.compare_bam_and_cram_by_statistics')
+    @mock.patch('checks.stats_checks.CompareStatsForFiles.compare_idxstats_of_files')
+    @mock.patch('checks.stats_checks.CompareStatsForFiles.compare_headers_of_files')
+    def test_verify_all_tiers_by_default(self, mock_headers, mock_idxstats, mock_compare, mock_check_paths):
+        mock_check_paths.return_value = []
+        mock_headers.return_value = []
+        mock_idxstats.return_value = []
+        mock_compare.return_value = ['FLAGSTAT DIFFERENT']
+        result = stats_checks.CompareStatsForFiles.verify_bam_and_cram('some bam', 'some cram', single_decode=True)
+        self.assertTrue(mock_headers.called)
+        self.assertTrue(mock_idxstats.called)
+        mock_compare.assert_called_once_with('some bam', 'some cram', single_decode=True, telemetry=mock.ANY)
+        self.assertEqual((result['errors'], result['tier']), (['FLAGSTAT DIFFERENT'], stats_checks.TIER_FULL))
+
+    def test_verify_unknown_tier(self):
+        self.assertRaises(ValueError, stats_checks.CompareStatsForFiles.verify_bam_and_cram, 'some bam', 'some cram',
+                          tiers=['everything'])
+
+
+class TestShardedStats(TestCase):
+
+    @staticmethod
+    def _stats_for_reads(reads):
+        """Builds the CHK and SN lines samtools stats would output for a list of (name, seq, qual, mapped) reads."""
+        sums = [0, 0, 0]
+        for read in reads:
+            for i, field in enumerate(read[:3]):
+                sums[i] = (sums[i] + zlib.crc32(field.encode())) & 0xffffffff
+        mapped = sum(1 for read in reads if read[3])
+        return "CHK\t%08x\t%08x\t%08x\nSN\traw total sequences:\t%s\nSN\treads mapped:\t%s\n" \
+               "SN\treads unmapped:\t%s\nSN\taverage length:\t%s\nSN\tmaximum length:\t%s\n" % \
+               (sums[0], sums[1], sums[2], len(reads), mapped, len(reads) - mapped,
+                sum(len(read[1]) for read in reads) // max(len(reads), 1), max(len(read[1]) for read in reads))
+
+    def setUp(self):
+        self.reads = [('read%d' % i, 'ACGT' * (i % 7 + 1), 'I' * (4 * (i % 7 + 1)), i % 5 != 0) for i in range(1000)]
+
+    def test_merge_stats_matches_unsharded(self):
+        unsharded = self._stats_for_reads(self.reads)
+        shards = [self._stats_for_reads(self.reads[start:start + 137]) for start in range(0, len(self.reads), 137)]
+        merged = stats_checks.HandleSamtoolsStats.merge_stats(shards)
+        self.assertEqual(stats_checks.HandleSamtoolsStats.extract_seq_checksum_from_stats(merged),
+                         stats_checks.HandleSamtoolsStats.extract_seq_checksum_from_stats(unsharded))
+        merged_sn = stats_checks.HandleSamtoolsStats.extract_summary_numbers_from_stats(merged)
+        unsharded_sn = stats_checks.HandleSamtoolsStats.extract_summary_numbers_from_stats(unsharded)
+        for field in ('raw total sequences', 'reads mapped', 'reads unmapped', 'maximum length'):
+            self.assertEqual(merged_sn[field], unsharded_sn[field])
+        self.assertNotIn('average length', merged_sn)
+
+    def test_merge_stats_does_not_depend_on_order(self):
+        shards = [self._stats_for_reads(self.reads[:300]), self._stats_for_reads(self.reads[300:])]
+        self.assertEqual(stats_checks.HandleSamtoolsStats.merge_stats(shards),
+                         stats_checks.HandleSamtoolsStats.merge_stats(shards[::-1]))
+
+    def test_merge_stats_overflow(self):
+        merged = stats_checks.HandleSamtoolsStats.merge_stats(['CHK\tffffffff\t1\t2\n', 'CHK\t00000002\t1\t2\n'])
+        self.assertEqual(stats_checks.HandleSamtoolsStats.extract_seq_checksum_from_stats(merged),
+                         'CHK\t00000001\t00000002\t00000004')
+
+    def test_merge_stats_without_chk(self):
+        self.assertRaises(ValueError, stats_checks.HandleSamtoolsStats.merge_stats, ['SN\tsequences:\t1\n'])
+
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands.get_samtools_header_output')
+    def test_get_header_contigs(self, mock_header):
+        mock_header.return_value = "@HD\tVN:1.6\n@SQ\tSN:chr1\tLN:1000\tM5:abc\n@SQ\tSN:chr2\tLN:500\n@RG\tID:1\n"
+        result = stats_checks.HandleSamtoolsStats.get_header_contigs('some cram')
+        self.assertEqual(result, [('chr1', 1000), ('chr2', 500)])
+
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands.get_samtools_idxstats_output')
+    @mock.patch('checks.stats_checks.HandleSamtoolsStats.get_header_contigs')
+    def test_get_shard_regions_by_contig(self, mock_contigs, mock_idxstats):
+        mock_contigs.return_value = [('chr1', 1000), ('chr2', 500)]
+        result = stats_checks.HandleSamtoolsStats.get_shard_regions('some cram')
+        self.assertEqual(result, [('chr1', None), ('chr2', None), ('*', None)])
+        self.assertFalse(mock_idxstats.called)
+
+    @mock.patch('checks.stats_checks.capabilities.supports_option', return_value=True)
+    @mock.patch('checks.stats_checks.HandleSamtoolsStats.get_header_contigs')
+    def test_get_shard_regions_by_chunk(self, mock_contigs, mock_supports_option):
+        mock_contigs.return_value = [('chr1', 1000), ('chr2', 300)]
+        result = stats_checks.HandleSamtoolsStats.get_shard_regions('some bam', chunk_size=400)
+        self.assertEqual(result, [('chr1:1-400', None), ('chr1:401-800', 401), ('chr1:801-1000', 801),
+                                  ('chr2', None), ('*', None)])
+        mock_supports_option.assert_called_once_with('view', '-e')
+
+    @mock.patch('checks.stats_checks.capabilities.supports_option', return_value=True)
+    @mock.patch('checks.stats_checks.HandleSamtoolsStats.get_header_contigs')
+    def test_get_shard_regions_of_contigs_with_colon(self, mock_contigs, mock_supports_option):
+        mock_contigs.return_value = [('HLA-A*01:01:01:01', 600), ('HLA-B*07:02:01', 300)]
+        result = stats_checks.HandleSamtoolsStats.get_shard_regions('some bam', chunk_size=400)
+        self.assertEqual(result, [('{HLA-A*01:01:01:01}:1-400', None), ('{HLA-A*01:01:01:01}:401-600', 401),
+                                  ('{HLA-B*07:02:01}', None), ('*', None)])
+
+    @mock.patch('checks.stats_checks.capabilities.supports_option', return_value=False)
+    @mock.patch('checks.stats_checks.HandleSamtoolsStats.get_header_contigs')
+    def test_get_shard_regions_by_chunk_without_expressions(self, mock_contigs, mock_supports_option):
+        mock_contigs.return_value = [('chr1', 1000), ('chr2', 300)]
+        result = stats_checks.HandleSamtoolsStats.get_shard_regions('some bam', chunk_size=400)
+        self.assertEqual(result, [('chr1', None), ('chr2', None), ('*', None)])
+
+    @mock.patch('checks.stats_checks.utils.find_index_file')
+    @mock.patch('checks.stats_checks.os.path')
+    @mock.patch('checks.stats_checks.HandleSamtoolsStats.get_shard_regions')
+    @mock.patch('checks.stats_checks.HandleSamtoolsStats._generate_stats_for_region')
+    def test_generate_sharded_stats(self, mock_gen_region, mock_regions, mock_path, mock_find_index):
+        mock_path.isfile.return_value = True
+        mock_find_index.return_value = 'some bam.bai'
+        mock_regions.return_value = [('chr1', None), ('*', None)]
+        mock_gen_region.side_effect = lambda fpath, region, min_pos, allocator, cancellation: \
+            self._stats_for_reads(self.reads[:500] if region == 'chr1' else self.reads[500:])
+        result = stats_checks.HandleSamtoolsStats.generate_sharded_stats('some bam', max_workers=2)
+        self.assertEqual(stats_checks.HandleSamtoolsStats.extract_seq_checksum_from_stats(result),
+                         stats_checks.HandleSamtoolsStats.extract_seq_checksum_from_stats(
+                             self._stats_for_reads(self.reads)))
+
+    @mock.patch('checks.stats_checks.utils.find_index_file')
+    @mock.patch('checks.stats_checks.os.path')
+    def test_generate_sharded_stats_without_index(self, mock_path, mock_find_index):
+        mock_path.isfile.return_value = True
+        mock_find_index.return_value = None
+        self.assertRaises(ValueError, stats_checks.HandleSamtoolsStats.generate_sharded_stats, 'some bam')
+
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands._stream_pipeline')
+    def test_stream_samtools_stats_output_for_chunk(self, mock_pipeline):
+        stats_checks.RunSamtoolsCommands.stream_samtools_stats_output_for_region('some bam', 'chr1:401-800', [], 401)
+        mock_pipeline.assert_called_with(['samtools', 'view', '-u', '-e', 'pos >= 401', 'some bam', 'chr1:401-800'],
+                                         ['samtools', 'stats', '-'], [], None)
+
+    @mock.patch('checks.stats_checks.capabilities.supports_option', return_value=True)
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands._stream_pipeline')
+    def test_stream_samtools_stats_output_for_region_threads(self, mock_pipeline, mock_supports_option):
+        stats_checks.RunSamtoolsCommands.stream_samtools_stats_output_for_region('some bam', 'chr1', [], threads=4)
+        mock_pipeline.assert_called_with(['samtools', 'view', '-u', '-@', '2', 'some bam', 'chr1'],
+                                         ['samtools', 'stats', '-'], [], None)
+
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands.stream_samtools_stats_output_for_region')
+    def test_generate_stats_for_region_counts_pipeline_threads(self, mock_stream):
+        allocator = samtools_threads.ThreadAllocator(8)
+        stats_checks.HandleSamtoolsStats._generate_stats_for_region('some bam', 'chr1', None, allocator)
+        self.assertEqual(mock_stream.call_args[0][4], stats_checks.SHARD_PIPELINE_THREADS)
+
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands._stream_subprocess')
+    def test_stream_samtools_view_output_for_region(self, mock_stream):
+        stats_checks.RunSamtoolsCommands.stream_samtools_view_output_for_region('some bam', 'chr1:401-800', [], 401)
+        mock_stream.assert_called_with(['samtools', 'view', '-e', 'pos >= 401', 'some bam', 'chr1:401-800'], [],
+                                       cancellation=None)
+
+
 class TestHandleSamtoolsVersion(TestCase):
 
     def test_get_version_nr_from_samtools_output_1_3(self):
@@ -378,6 +957,10 @@ class TestHandleSamtoolsVersion(TestCase):
         vs = "samtools 1.2-218-g00e55ad\nUsing htslib 1.2.1-218-g9f6fa0f\nCopyright (C) 2015 Genome Research Ltd.\n"
         self.assertRaises(ValueError, stats_checks.HandleSamtoolsVersion.check_samtools_version, vs)
 
+    def test_check_samtools_version_ok_vs_1_10(self):
+        vs = "samtools 1.10\nUsing htslib 1.10.2\nCopyright (C) 2019 Genome Research Ltd.\n"
+        self.assertIsNone(stats_checks.HandleSamtoolsVersion.check_samtools_version(vs))
+
     def test_check_samtools_version_no_vs(self):
         vs = None
         self.assertRaises(ValueError, stats_checks.HandleSamtoolsVersion.check_samtools_version, vs)
@@ -0,0 +1,167 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import math
+import tempfile
+from unittest import TestCase
+from benchmarks import fixtures
+from benchmarks import run
+from checks import stats_model
+from checks.stats_checks import CompareStatsForFiles
+
+STATS = """# This file was produced by samtools stats (1.10+htslib-1.10)
+# CHK, Checksum\t[2]Read Names\t[3]Sequences\t[4]Qualities
+CHK\t1bfca46a\t2046405a\tf4f56eb9
+SN\traw total sequences:\t1000\t# excluding supplementary and secondary reads
+SN\tis sorted:\t1
+SN\taverage quality:\t36.4
+FFQ\t1\t0\t0\t12\t988
+FFQ\t2\t0\t3\t9\t988
+RL\t150\t1000
+COV\t[1-1]\t1\t2000
+COV\t[2-2]\t2\t1500
+"""
+
+
+class TestSamtoolsStats(TestCase):
+
+    def test_parse(self):
+        stats = stats_model.SamtoolsStats.parse(STATS)
+        self.assertEqual(stats.section_names, ['CHK', 'SN', 'FFQ', 'RL', 'COV'])
+        sn = stats.section('SN')
+        self.assertEqual(sn.keys, ['raw total sequences', 'is sorted', 'average quality'])
+        self.assertEqual(list(sn.row(0)), [1000])
+        self.assertEqual(list(sn.row(2)), [36.4])
+        self.assertEqual(list(stats.section('FFQ').rows()['2']), [0, 3, 9, 988])
+        self.assertEqual(stats.section('COV').keys, ['[1-1]', '[2-2]'])
+        self.assertIsNone(stats.section('GCD'))
+
+    def test_parse_is_lazy(self):
+        stats = stats_model.SamtoolsStats.parse(STATS)
+        self.assertEqual(stats._sections, {})
+        stats.section('RL')
+        self.assertEqual(list(stats._sections), ['RL'])
+
+    def test_parse_not_numbers(self):
+        section = stats_model.StatsSection.from_lines('XX', ['XX\tkey\t1\tN/A'])
+        self.assertEqual(section.row(0)[0], 1)
+        self.assertTrue(math.isnan(section.row(0)[1]))
+
+
+class TestCompareStats(TestCase):
+
+    def test_compare_stats_equal(self):
+        stats_b, stats_c = stats_model.SamtoolsStats.parse(STATS), stats_model.SamtoolsStats.parse(STATS)
+        self.assertEqual(stats_model.compare_stats(stats_b, stats_c), [])
+
+    def test_compare_stats_ignores_chk(self):
+        stats_b = stats_model.SamtoolsStats.parse(STATS)
+        stats_c = stats_model.SamtoolsStats.parse(STATS.replace('1bfca46a', '00000000'))
+        self.assertEqual(stats_model.compare_stats(stats_b, stats_c), [])
+
+    def test_compare_stats_different_values(self):
+        stats_b = stats_model.SamtoolsStats.parse(STATS)
+        stats_c = stats_model.SamtoolsStats.parse(STATS.replace('FFQ\t2\t0\t3\t9\t988', 'FFQ\t2\t0\t4\t8\t988'))
+        result = stats_model.compare_stats(stats_b, stats_c)
+        self.assertEqual(result, ["STATS FFQ DIFFERENT for 2: [0, 3, 9, 988] and [0, 4, 8, 988]"])
+
+    def test_compare_stats_different_rows(self):
+        stats_b = stats_model.SamtoolsStats.parse(STATS)
+        stats_c = stats_model.SamtoolsStats.parse(STATS.replace('COV\t[2-2]\t2\t1500\n', '') + 'RL\t151\t1\n')
+        result = stats_model.compare_stats(stats_b, stats_c)
+        self.assertEqual(result, ["STATS RL DIFFERENT: rows [] only in the BAM and ['151'] only in the CRAM",
+                                  "STATS COV DIFFERENT: rows ['[2-2]'] only in the BAM and [] only in the CRAM"])
+
+    def test_compare_stats_tolerance(self):
+        stats_b = stats_model.SamtoolsStats.parse(STATS)
+        stats_c = stats_model.SamtoolsStats.parse(STATS.replace('COV\t[1-1]\t1\t2000', 'COV\t[1-1]\t1\t2010'))
+        self.assertEqual(stats_model.compare_stats(stats_b, stats_c, {'COV': 0.01}), [])
+        self.assertEqual(len(stats_model.compare_stats(stats_b, stats_c, {'COV': 0.001})), 1)
+
+    def test_compare_stats_missing_section(self):
+        stats_b = stats_model.SamtoolsStats.parse(STATS)
+        stats_c = stats_model.SamtoolsStats.parse(STATS + 'GCD\t0.0\t0.1\t0.2\n')
+        result = stats_model.compare_stats(stats_b, stats_c)
+        self.assertEqual(result, ["STATS GCD section only in the CRAM"])
+
+    def test_compare_stats_many_rows(self):
+        lines_b = ''.join('COV\t[%s-%s]\t%s\t%s\n' % (i, i, i, i) for i in range(20))
+        lines_c = ''.join('COV\t[%s-%s]\t%s\t%s\n' % (i, i, i, i + 1) for i in range(20))
+        result = stats_model.compare_stats(stats_model.SamtoolsStats.parse(lines_b),
+                                           stats_model.SamtoolsStats.parse(lines_c))
+        self.assertEqual(len(result), stats_model.MAX_REPORTED_ROWS + 1)
+        self.assertEqual(result[-1], "STATS COV DIFFERENT for 15 more rows")
+
+
+class TestCompareStatsFiles(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.fpath_b = os.path.join(self.tmp_dir.name, 'a.bam.stats')
+        self.fpath_c = os.path.join(self.tmp_dir.name, 'a.cram.stats')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _write(self, fpath, stats):
+        with open(fpath, 'w') as f:
+            f.write(stats)
+
+    def test_compare_stats_files_compact(self):
+        # The stats of a file are compact (CHK and SN only) when they come e.g. from the merged shards:
+        self._write(self.fpath_b, STATS)
+        self._write(self.fpath_c, 'CHK\t1\t2\t3\nSN\traw total sequences:\t1000\nSN\tis sorted:\t1\n'
+                                  'SN\taverage quality:\t36.5\n')
+        result = stats_model.compare_stats_files(self.fpath_b, self.fpath_c)
+        self.assertEqual(result, ["STATS SN DIFFERENT for average quality: [36.4] and [36.5]"])
+
+    def test_compare_stats_files_missing(self):
+        self._write(self.fpath_b, STATS)
+        self.assertEqual(stats_model.compare_stats_files(self.fpath_b, self.fpath_c), [])
+
+    def test_compare_stats_files_older_than_data(self):
+        self._write(self.fpath_b, STATS)
+        self._write(self.fpath_c, STATS + 'GCD\t0.0\t0.1\t0.2\n')
+        bam_path, cram_path = self.fpath_b[:-len('.stats')], self.fpath_c[:-len('.stats')]
+        self._write(bam_path, '')
+        self._write(cram_path, '')
+        os.utime(self.fpath_c, (0, 0))
+        result = stats_model.compare_stats_files(self.fpath_b, self.fpath_c, data_fpaths=(bam_path, cram_path))
+        self.assertEqual(result, [])
+        for fpath in (bam_path, cram_path):
+            os.utime(fpath, (0, 0))
+        os.utime(self.fpath_c, (1, 1))
+        result = stats_model.compare_stats_files(self.fpath_b, self.fpath_c, data_fpaths=(bam_path, cram_path))
+        self.assertEqual(result, ["STATS GCD section only in the CRAM"])
+
+    def test_compare_bam_and_cram_all_sections(self):
+        bin_dir = os.path.join(self.tmp_dir.name, 'bin')
+        fixtures.write_fake_samtools(bin_dir)
+        bam_path, cram_path = fixtures.make_pairs(os.path.join(self.tmp_dir.name, 'data'), 1, extra_lines=10)[0]
+        fake_stats_fpath = cram_path + fixtures.FAKE_OUTPUT_EXT % 'stats'
+        with open(fake_stats_fpath) as f:
+            stats = f.read()
+        self._write(fake_stats_fpath, stats.replace('COV\t[3-3]\t3\t21', 'COV\t[3-3]\t3\t22'))
+        with run.mock_environ(dict(os.environ, PATH=bin_dir + os.pathsep + os.environ['PATH'],
+                                   BAM2CRAM_SAMTOOLS_CACHE=os.path.join(self.tmp_dir.name, 'capabilities'))):
+            result = CompareStatsForFiles.compare_bam_and_cram_by_statistics(bam_path, cram_path,
+                                                                             all_sections=True)
+        self.assertEqual(result, ["STATS COV DIFFERENT for [3-3]: [3, 21] and [3, 22]"])
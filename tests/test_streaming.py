@@ -0,0 +1,128 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import sys
+import tempfile
+from unittest import TestCase
+from checks import streaming
+from checks.stats_checks import RunSamtoolsCommands
+
+
+class TestStreamConsumers(TestCase):
+
+    def test_checksum_extractor(self):
+        extractor = streaming.ChecksumExtractor()
+        streaming.feed_lines(['# CHK, Checksum\n', 'CHK\t1bfca46a\t2046405a\tf4f56eb9\n', 'SN\tsequences:\t3\n'],
+                             [extractor])
+        self.assertEqual(extractor.checksum, 'CHK\t1bfca46a\t2046405a\tf4f56eb9')
+
+    def test_checksum_extractor_no_chk(self):
+        extractor = streaming.ChecksumExtractor()
+        streaming.feed_lines(['SN\tsequences:\t3\n'], [extractor])
+        self.assertIsNone(extractor.checksum)
+
+    def test_summary_numbers_parser(self):
+        parser = streaming.SummaryNumbersParser()
+        streaming.feed_lines(['SN\treads paired:\t234\t# paired-end technology bit set\n', 'RL\t101\t235\n'], [parser])
+        self.assertEqual(parser.summary, {'reads paired': '234'})
+
+    def test_sidecar_writer_finish(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fpath = os.path.join(tmp_dir, 'some.stats')
+            writer = streaming.SidecarWriter(fpath)
+            streaming.feed_lines(['line1\n', 'line2\n'], [writer])
+            self.assertFalse(os.path.exists(fpath))
+            writer.finish()
+            with open(fpath) as f:
+                self.assertEqual(f.read(), 'line1\nline2\n')
+            self.assertEqual(os.listdir(tmp_dir), ['some.stats'])
+
+    def test_sidecar_writer_abort(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            writer = streaming.SidecarWriter(os.path.join(tmp_dir, 'some.stats'))
+            streaming.feed_lines(['line1\n'], [writer])
+            writer.abort()
+            self.assertEqual(os.listdir(tmp_dir), [])
+
+    def test_summary_stats_text(self):
+        result = streaming.summary_stats_text('CHK\t1\t2\t3', {'sequences': '2'})
+        self.assertEqual(result, 'CHK\t1\t2\t3\nSN\tsequences:\t2\n')
+
+
+class TestStreamSubprocess(TestCase):
+
+    def test_stream_subprocess_feeds_consumers(self):
+        parser = streaming.SummaryNumbersParser()
+        script = "for i in range(100000): print('SN\\tfield %d:\\t%d' % (i, i))"
+        RunSamtoolsCommands._stream_subprocess([sys.executable, '-c', script], [parser])
+        self.assertEqual(len(parser.summary), 100000)
+        self.assertEqual(parser.summary['field 99999'], '99999')
+
+    def test_stream_subprocess_drains_stderr(self):
+        # Writes to stderr much more than a pipe buffer holds before writing to stdout
+        script = "import sys; sys.stderr.write('x' * 1000000); sys.stderr.flush(); print('CHK\\t1\\t2\\t3')"
+        extractor = streaming.ChecksumExtractor()
+        self.assertRaises(RuntimeError, RunSamtoolsCommands._stream_subprocess, [sys.executable, '-c', script],
+                          [extractor])
+        self.assertEqual(extractor.checksum, 'CHK\t1\t2\t3')
+
+    def test_stream_subprocess_aborts_consumers_on_failure(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fpath = os.path.join(tmp_dir, 'some.stats')
+            script = "import sys; print('CHK\\t1\\t2\\t3'); sys.exit(1)"
+            self.assertRaises(RuntimeError, RunSamtoolsCommands._stream_subprocess, [sys.executable, '-c', script],
+                              [streaming.SidecarWriter(fpath)])
+            self.assertEqual(os.listdir(tmp_dir), [])
+
+    def test_stream_subprocess_in_chunks(self):
+        class ChunkCollector(streaming.StreamConsumer):
+            def __init__(self):
+                self.chunks = []
+
+            def consume(self, chunk):
+                self.chunks.append(chunk)
+        collector = ChunkCollector()
+        script = "import sys; sys.stdout.write('x' * 2500)"
+        RunSamtoolsCommands._stream_subprocess([sys.executable, '-c', script], [collector], chunk_size=1000)
+        self.assertEqual(b''.join(collector.chunks), b'x' * 2500)
+        self.assertTrue(all(len(chunk) <= 1000 for chunk in collector.chunks))
+
+    def test_stream_subprocess_in_chunks_fails(self):
+        script = "import sys; sys.stderr.write('bad file'); sys.exit(1)"
+        with self.assertRaises(RuntimeError) as context:
+            RunSamtoolsCommands._stream_subprocess([sys.executable, '-c', script], [], chunk_size=1000)
+        self.assertIn('bad file', str(context.exception))
+
+    def test_stream_pipeline(self):
+        parser = streaming.SummaryNumbersParser()
+        upstream = [sys.executable, '-c', "print('SN\\tsequences:\\t3')"]
+        downstream = [sys.executable, '-c', "import sys; sys.stdout.write(sys.stdin.read())"]
+        RunSamtoolsCommands._stream_pipeline(upstream, downstream, [parser])
+        self.assertEqual(parser.summary, {'sequences': '3'})
+
+    def test_stream_pipeline_upstream_fails(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fpath = os.path.join(tmp_dir, 'some.stats')
+            upstream = [sys.executable, '-c', "import sys; print('CHK'); sys.exit(2)"]
+            downstream = [sys.executable, '-c', "import sys; sys.stdout.write(sys.stdin.read())"]
+            self.assertRaises(RuntimeError, RunSamtoolsCommands._stream_pipeline, upstream, downstream,
+                              [streaming.SidecarWriter(fpath)])
+            self.assertEqual(os.listdir(tmp_dir), [])
@@ -0,0 +1,106 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import sys
+import json
+import threading
+import subprocess
+from unittest import mock, TestCase
+from checks import telemetry
+from checks.stats_checks import RunSamtoolsCommands
+
+ALLOCATE_CMD = [sys.executable, '-c', 'x = bytearray(50 * 1024 * 1024); print(len(x))']
+
+
+class TestTelemetry(TestCase):
+
+    def test_wait_records_process_usage(self):
+        recorder = telemetry.Telemetry()
+        with recorder.stage('some bam', 'flagstat'):
+            proc = subprocess.Popen(ALLOCATE_CMD, stdout=subprocess.DEVNULL)
+            self.assertEqual(telemetry.wait(proc), 0)
+        self.assertEqual(proc.returncode, 0)
+        stage = recorder.as_dict()['stages'][0]
+        self.assertEqual((stage['file'], stage['stage']), ('some bam', 'flagstat'))
+        self.assertGreater(stage['duration'], 0)
+        self.assertEqual(len(stage['processes']), 1)
+        self.assertGreater(stage['processes'][0]['max_rss_mb'], 50)
+        self.assertGreaterEqual(stage['processes'][0]['user_cpu'], 0)
+
+    def test_wait_exit_codes(self):
+        proc = subprocess.Popen([sys.executable, '-c', 'import sys; sys.exit(3)'])
+        self.assertEqual(telemetry.wait(proc), 3)
+        proc = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])
+        proc.kill()
+        self.assertEqual(telemetry.wait(proc), -9)
+
+    def test_wait_outside_stage(self):
+        proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+        self.assertEqual(telemetry.wait(proc), 0)
+        self.assertIsNone(telemetry.current_stage())
+
+    def test_wait_already_waited_for(self):
+        proc = subprocess.Popen([sys.executable, '-c', 'import sys; sys.exit(2)'])
+        proc.wait()
+        self.assertEqual(telemetry.wait(proc), 2)
+
+    def test_resumed_stage_in_other_thread(self):
+        recorder = telemetry.Telemetry()
+        with recorder.stage('some bam', 'stats'):
+            stage = telemetry.current_stage()
+
+            def run_shard():
+                with telemetry.resumed_stage(stage):
+                    RunSamtoolsCommands._run_subprocess([sys.executable, '-c', 'print("shard")'])
+            threads = [threading.Thread(target=run_shard) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        result = recorder.as_dict()
+        self.assertEqual(len(result['stages'][0]['processes']), 3)
+        self.assertGreater(result['max_rss_mb'], 0)
+        json.dumps(result)
+
+    def test_nested_stages(self):
+        recorder = telemetry.Telemetry()
+        with recorder.stage('some bam', 'stats'):
+            with recorder.stage('some bam', 'cache_read'):
+                pass
+            self.assertEqual(telemetry.current_stage()['stage'], 'stats')
+        self.assertEqual([stage['stage'] for stage in recorder.as_dict()['stages']], ['stats', 'cache_read'])
+
+    def test_stage_without_telemetry(self):
+        with telemetry.stage(None, 'some bam', 'stats') as record:
+            self.assertIsNone(record)
+            self.assertIsNone(telemetry.current_stage())
+
+    def test_timed_cache(self):
+        recorder = telemetry.Telemetry()
+        mock_cache = mock.Mock()
+        mock_cache.get_output.side_effect = [None, 'some stats']
+        timed_cache = telemetry.TimedCache(mock_cache, recorder)
+        self.assertIsNone(timed_cache.get_output('some bam', ['stats']))
+        timed_cache.put_output('some bam', ['stats'], 'some stats')
+        self.assertEqual(timed_cache.get_output('some bam', ['stats']), 'some stats')
+        stages = recorder.as_dict()['stages']
+        self.assertEqual([(stage['stage'], stage.get('hit')) for stage in stages],
+                         [('cache_read', False), ('cache_write', None), ('cache_read', True)])
+        mock_cache.put_output.assert_called_once_with('some bam', ['stats'], 'some stats')
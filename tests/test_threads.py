@@ -0,0 +1,127 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import threading
+from unittest import mock, TestCase
+from checks import threads
+
+
+class TestSamtoolsThreadsArgs(TestCase):
+
+    def test_samtools_threads_args_none(self):
+        self.assertEqual(threads.samtools_threads_args(None), [])
+
+    def test_samtools_threads_args_one(self):
+        self.assertEqual(threads.samtools_threads_args(1), [])
+
+    def test_samtools_threads_args_more(self):
+        self.assertEqual(threads.samtools_threads_args(4), ['-@', '3'])
+
+    def test_default_thread_budget_lsf(self):
+        with mock.patch.dict('checks.threads.os.environ', {'LSB_DJOB_NUMPROC': '8'}):
+            self.assertEqual(threads.default_thread_budget(), 8)
+
+    def test_default_thread_budget_no_lsf(self):
+        with mock.patch.dict('checks.threads.os.environ', {}, clear=True):
+            self.assertIsNone(threads.default_thread_budget())
+
+
+class TestThreadAllocator(TestCase):
+
+    def test_allocator_invalid_budget(self):
+        self.assertRaises(ValueError, threads.ThreadAllocator, 0)
+
+    def test_allocate_proportional_to_size(self):
+        allocator = threads.ThreadAllocator(8)
+        allocator.register('bam', 300, 2)
+        allocator.register('cram', 100, 2)
+        with allocator.allocate('bam') as bam_threads:
+            self.assertEqual(bam_threads, 6)
+            with allocator.allocate('cram') as cram_threads:
+                self.assertEqual(cram_threads, 2)
+
+    def test_allocate_never_above_budget(self):
+        allocator = threads.ThreadAllocator(4)
+        allocator.register('bam', 100, 2)
+        allocator.register('cram', 100, 2)
+        with allocator.allocate('bam') as bam_threads, allocator.allocate('cram') as cram_threads:
+            self.assertEqual(bam_threads + cram_threads, 4)
+
+    def test_allocate_gets_whole_budget_when_other_file_done(self):
+        allocator = threads.ThreadAllocator(8)
+        allocator.register('bam', 100, 2)
+        allocator.register('cram', 100, 2)
+        allocator.file_done('cram')
+        with allocator.allocate('bam') as bam_threads:
+            self.assertEqual(bam_threads, 8)
+
+    def test_allocate_depends_on_stages_left(self):
+        allocator = threads.ThreadAllocator(6)
+        allocator.register('bam', 100, 2)
+        allocator.register('cram', 100, 2)
+        allocator.stage_done('cram')
+        with allocator.allocate('bam') as bam_threads:
+            self.assertEqual(bam_threads, 4)
+
+    def test_allocate_max_threads(self):
+        allocator = threads.ThreadAllocator(8)
+        allocator.register('bam', 100, 1)
+        with allocator.allocate('bam', max_threads=1) as bam_threads:
+            self.assertEqual(bam_threads, 1)
+
+    def test_allocate_min_threads(self):
+        allocator = threads.ThreadAllocator(3)
+        allocator.register('bam', 100, 1)
+        allocator.register('cram', 100, 1)
+        with allocator.allocate('bam') as bam_threads:
+            self.assertEqual(bam_threads, 1)
+            with allocator.allocate('cram', max_threads=2, min_threads=2) as cram_threads:
+                self.assertEqual(cram_threads, 2)
+
+    def test_allocate_min_threads_above_budget(self):
+        allocator = threads.ThreadAllocator(1)
+        with allocator.allocate('bam', max_threads=2, min_threads=2) as bam_threads:
+            self.assertEqual(bam_threads, 1)
+
+    def test_allocate_waits_for_free_threads(self):
+        allocator = threads.ThreadAllocator(2)
+        allocator.register('bam', 100, 1)
+        allocated = []
+        with allocator.allocate('bam') as bam_threads:
+            self.assertEqual(bam_threads, 2)
+
+            def allocate_other():
+                with allocator.allocate('bam') as other_threads:
+                    allocated.append(other_threads)
+            other = threading.Thread(target=allocate_other)
+            other.start()
+            other.join(0.1)
+            self.assertEqual(allocated, [])
+        other.join(5)
+        self.assertEqual(allocated, [2])
+
+    def test_allocated_threads_without_allocator(self):
+        with threads.allocated_threads(None, 'bam') as nr_threads:
+            self.assertIsNone(nr_threads)
+
+    def test_split_threads(self):
+        self.assertEqual(threads.split_threads(5, 2), [2, 3])
+        self.assertEqual(threads.split_threads(1, 2), [1, 1])
+        self.assertEqual(threads.split_threads(None, 2), [None, None])
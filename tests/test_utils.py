@@ -19,6 +19,8 @@ along with this program. If not, see <http://www.gnu.org/licenses/>.
 This file has been created on Feb 09, 2016.
 """
 
+import os
+import tempfile
 from unittest import mock, TestCase
 from checks import utils
 
@@ -145,18 +147,40 @@ class TestCompareTimestamps(TestCase):
         self.assertEqual(result, expected)
 
 
+class TestFindIndexFile(TestCase):
 
+    def test_find_index_file_next_to_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            open(os.path.join(tmp_dir, 'some.cram.crai'), 'w').close()
+            self.assertEqual(utils.find_index_file(os.path.join(tmp_dir, 'some.cram')),
+                             os.path.join(tmp_dir, 'some.cram.crai'))
 
+    def test_find_index_file_without_extension(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            open(os.path.join(tmp_dir, 'some.bai'), 'w').close()
+            self.assertEqual(utils.find_index_file(os.path.join(tmp_dir, 'some.bam')), os.path.join(tmp_dir, 'some.bai'))
 
+    def test_find_index_file_of_bam_and_cram_with_same_name(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            open(os.path.join(tmp_dir, 'some.crai'), 'w').close()
+            self.assertIsNone(utils.find_index_file(os.path.join(tmp_dir, 'some.bam')))
+            open(os.path.join(tmp_dir, 'some.bam.bai'), 'w').close()
+            self.assertEqual(utils.find_index_file(os.path.join(tmp_dir, 'some.bam')),
+                             os.path.join(tmp_dir, 'some.bam.bai'))
+            self.assertEqual(utils.find_index_file(os.path.join(tmp_dir, 'some.cram')),
+                             os.path.join(tmp_dir, 'some.crai'))
 
+    def test_find_index_file_when_none(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.assertIsNone(utils.find_index_file(os.path.join(tmp_dir, 'some.bam')))
 
 
+class TestSamtoolsRegion(TestCase):
 
+    def test_samtools_region(self):
+        self.assertEqual(utils.samtools_region('chr1'), 'chr1')
+        self.assertEqual(utils.samtools_region('chr1', 1, 100), 'chr1:1-100')
 
-
-
-
-
-
-
-
+    def test_samtools_region_of_contig_with_colon(self):
+        self.assertEqual(utils.samtools_region('HLA-A*01:01:01:01'), '{HLA-A*01:01:01:01}')
+        self.assertEqual(utils.samtools_region('HLA-A*01:01:01:01', 1, 100), '{HLA-A*01:01:01:01}:1-100')
@@ -0,0 +1,101 @@
+"""
+Copyright (C) 2016  Genome Research Ltd.
+
+Author: Irina Colgiu <ic4@sanger.ac.uk>
+
+This program is part of bam2cram-check
+
+bam2cram-check is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+This file has been created on Oct 18, 2026.
+"""
+import os
+import threading
+import subprocess
+from unittest import mock, TestCase
+from checks import batch
+from checks import watchdog
+from checks.cancellation import Cancellation
+from checks.stats_checks import RunSamtoolsCommands, CompareStatsForFiles, TIER_HEADER
+
+
+class TestWatchdog(TestCase):
+
+    def _run_watched(self, args_list, pair_watchdog):
+        proc = subprocess.Popen(args_list, stdout=subprocess.DEVNULL, start_new_session=True)
+        pair_watchdog.watch(proc)
+        try:
+            returncode = proc.wait(timeout=10)
+        finally:
+            pair_watchdog.unwatch(proc)
+        return returncode, pair_watchdog.error(proc)
+
+    def test_process_stage(self):
+        self.assertEqual(watchdog.process_stage(['samtools', 'stats', '-@', '2', 'a.bam']), 'stats')
+        self.assertEqual(watchdog.process_stage(['/usr/bin/samtools', 'quickcheck', 'a.bam']), 'quickcheck')
+        self.assertEqual(watchdog.process_stage(['iget', '/zone/a.cram', '-']), watchdog.FETCH_STAGE)
+
+    def test_read_progress(self):
+        if not os.path.exists('/proc/self/io') and not os.path.exists('/proc/self/stat'):
+            self.skipTest("There's no /proc")
+        self.assertIsInstance(watchdog.read_progress(os.getpid()), int)
+
+    def test_stage_timeout(self):
+        returncode, error = self._run_watched(['sleep', '30'], watchdog.Watchdog({'fetch': 0.2}, poll_interval=0.05))
+        self.assertNotEqual(returncode, 0)
+        self.assertTrue(error.startswith('TIMEOUT running process'))
+
+    def test_stalled(self):
+        if watchdog.read_progress(os.getpid()) is None:
+            self.skipTest("The progress of the processes can't be read")
+        returncode, error = self._run_watched(['sleep', '30'], watchdog.Watchdog(stall_timeout=0.3, poll_interval=0.05))
+        self.assertNotEqual(returncode, 0)
+        self.assertTrue(error.startswith('STALLED running process'))
+
+    def test_not_stalled_while_writing(self):
+        args_list = ['sh', '-c', 'for i in 1 2 3 4 5 6; do echo line; sleep 0.1; done']
+        returncode, error = self._run_watched(args_list, watchdog.Watchdog(stall_timeout=2, poll_interval=0.05))
+        self.assertEqual((returncode, error), (0, None))
+
+    def test_run_subprocess_timeout(self):
+        cancellation = Cancellation(watchdog.Watchdog({'fetch': 0.2}, poll_interval=0.05))
+        with self.assertRaises(RuntimeError) as context:
+            RunSamtoolsCommands._run_subprocess(['sleep', '30'], cancellation)
+        self.assertTrue(str(context.exception).startswith('TIMEOUT running process'))
+
+    def test_run_within_timeout(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        cancellation = Cancellation(watchdog.Watchdog({watchdog.INDEX_STAGE: 0.2}))
+        with self.assertRaises(RuntimeError) as context:
+            watchdog.run_within_timeout(lambda: release.wait(30), cancellation, watchdog.INDEX_STAGE, 'reading a.crai')
+        self.assertTrue(str(context.exception).startswith('TIMEOUT running process: reading a.crai'))
+        for other_cancellation in (cancellation, None):
+            self.assertEqual(watchdog.run_within_timeout(lambda: 'ids', other_cancellation, watchdog.INDEX_STAGE,
+                                                         'reading a.crai'), 'ids')
+
+    @mock.patch('checks.stats_checks.CompareStatsForFiles._check_file_paths', return_value=[])
+    @mock.patch('checks.stats_checks.RunSamtoolsCommands.get_samtools_header_output')
+    def test_header_tier_timeout(self, mock_header, mock_check_paths):
+        # Stand-in for samtools view -H blocked on a hung filesystem
+        mock_header.side_effect = lambda fpath, cancellation: RunSamtoolsCommands._run_subprocess(['sleep', '30'],
+                                                                                                  cancellation)
+        result = CompareStatsForFiles.verify_bam_and_cram('a.bam', 'a.cram', tiers=[TIER_HEADER],
+                                                          stage_timeouts={watchdog.FETCH_STAGE: 0.2})
+        self.assertEqual(len(result['errors']), 2)
+        self.assertTrue(watchdog.is_stalled(result['errors']))
+
+    def test_pair_status(self):
+        self.assertEqual(batch.pair_status([]), 'passed')
+        self.assertEqual(batch.pair_status(["FLAGSTAT DIFFERENT"]), 'failed')
+        self.assertEqual(batch.pair_status(["STALLED running process: ['iget'], no progress for 60 seconds"]),
+                         watchdog.STALLED)